@@ -0,0 +1,1366 @@
+import argparse
+import asyncio
+import contextlib
+import math
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from sqlalchemy import create_engine, insert
+from sqlmodel import SQLModel, Session, select, or_, func
+from models import ProductDB, SortBy
+
+#Benchmark / load test ของ API
+#รัน: python benchmark.py search --products 200000   → ilike (scan ทั้งตาราง) vs FTS n-gram index
+#     python benchmark.py coalesce                   → จำนวน query เมื่อมี request พร้อมกันเยอะๆ
+#     python benchmark.py feed-queries               → เช็คว่า GET /posts/ ใช้จำนวน query คงที่ (exit 1 ถ้าไม่)
+#     python benchmark.py contention                 → หลาย thread/process แย่งซื้อสินค้าชิ้นเดียวกัน ต้องมีผู้ชนะคนเดียว (exit 1 ถ้าไม่)
+#     python benchmark.py sweep --orders 10000       → เวลาที่ sweeper ใช้ยกเลิก order ที่หมดเวลาจอง
+#     python benchmark.py checkout --orders 1000     → checkout ได้กี่ order/วินาที บน SQLite ไฟล์จริง
+#     python benchmark.py event-loop                 → req/s เมื่อมี client พร้อมกันหลายตัว + GET ค้างไหมตอนมี request รอ write lock (Session sync vs AsyncSession)
+#     python benchmark.py engine-profile             → เทียบ PRAGMA (WAL/synchronous/mmap/cache) กับงานอ่านเยอะและเขียนเยอะ
+#     python benchmark.py query-plans                → EXPLAIN QUERY PLAN ของ query หลักๆ ต้องใช้ index (exit 1 ถ้ามี full scan)
+#     python benchmark.py replicas                   → GET อ่านจาก replica (ไฟล์ SQLite ที่ copy มา) และกลับไป primary เมื่อ replica เก่าเกิน (exit 1 ถ้าไม่)
+#     python benchmark.py load --scale medium --output run.json          → ข้อมูลสังเคราะห์ + throughput/p50/p95/p99 ของ hot path
+#     python benchmark.py load --mode http --baseline run.json           → ยิงผ่าน HTTP server จริง แล้วเทียบกับผลรอบก่อน
+#     python benchmark.py metrics-overhead           → ต้นทุนของ /metrics: observe() ต่อครั้ง, req/s เปิด vs ปิด, เวลา scrape
+#     python benchmark.py serialize --products 50000 → GET /products/ ทั้งรายการ: เวลา encode (เดิม vs orjson) และขนาดหลัง gzip/br
+#     python benchmark.py export --orders 50000      → memory สูงสุดของ /export/... ต้องคงที่ไม่ว่าจะกี่แถว (exit 1 ถ้าโตตาม)
+#คำสั่งที่ import main (coalesce, feed-queries, contention, sweep, checkout, query-plans, load, metrics-overhead, serialize, export) รันกับ Postgres ได้ด้วย
+#     FIIT_BENCH_DATABASE_URL=postgresql://localhost/fiit_bench python benchmark.py contention   (DB นี้ถูกล้างทุกครั้ง)
+
+THAI_ITEMS = ["เสื้อเชิ้ต", "เสื้อยืด", "กางเกงยีนส์", "กระโปรง", "เดรส", "แจ็คเก็ต", "เสื้อกันหนาว", "รองเท้าผ้าใบ", "กระเป๋าสะพาย", "หมวกแก๊ป"]
+THAI_DETAILS = ["ลายสก็อต", "ลายดอก", "สีขาว", "สีดำ", "สีครีม", "ทรงโอเวอร์ไซซ์", "มินิมอล", "วินเทจ", "ริมแดง", "งานปักมือ"]
+THAI_NOTES = ["สภาพ 95%", "ใส่ครั้งเดียว", "มีตำหนิเล็กน้อย", "ผ้าหนานุ่ม ใส่สบาย", "ของแท้ 100%", "ซักแล้วไม่ยืด"]
+BRANDS = ["Uniqlo", "Levi's", "H&M", "Zara", "Nike", "Adidas", "Converse", "Muji", "GU", "Coach"]
+TAGS = ["แบรนด์เนม", "วินเทจ", "มินิมอล", "แฟชั่นเกาหลี", "streetwear", "y2k", "มือสอง", "ของแท้"]
+
+SEARCH_QUERIES = ["เสื้อ", "กางเกงยีนส์", "สก็อต", "ลายดอก สีขาว", "uniqlo", "levi", "ทรงโอเวอร์ไซซ์", "ไม่มีสินค้านี้"]
+
+
+def generate_products(count: int, seed: int = 411):
+    rng = random.Random(seed)
+    for _ in range(count):
+        item = rng.choice(THAI_ITEMS)
+        detail = rng.choice(THAI_DETAILS)
+        brand = rng.choice(BRANDS)
+        yield {
+            "pname": f"{item}{detail} {brand}",
+            "price": float(rng.randint(50, 3000)),
+            "brand": brand,
+            "description": f"{rng.choice(THAI_NOTES)} {rng.choice(THAI_DETAILS)} อก {rng.randint(30, 48)} นิ้ว",
+            "categoryID": rng.randint(1, 15),
+            "seller_id": rng.randint(1, 500),
+            "tags": ", ".join(rng.sample(TAGS, 3)),
+            "product_status": "available" if rng.random() < 0.8 else "sold",
+        }
+
+
+def make_database(path: str, products: int):
+    from database import analyze_database
+
+    bench_engine = create_engine(f"sqlite:///{path}")
+    SQLModel.metadata.create_all(bench_engine)
+    rows = generate_products(products)
+    with Session(bench_engine) as session:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == 5000:
+                session.execute(insert(ProductDB), batch)
+                batch = []
+        if batch:
+            session.execute(insert(ProductDB), batch)
+        session.commit()
+    analyze_database(bench_engine)  # เหมือน app ที่ ANALYZE ตอนเปิดและทุก ANALYZE_INTERVAL
+    return bench_engine
+
+
+def _ilike_statement(text_query: str):
+    term = f"%{text_query}%"
+    return select(ProductDB).where(
+        or_(ProductDB.pname.ilike(term), ProductDB.brand.ilike(term), ProductDB.description.ilike(term))
+    )
+
+
+def _index_statement(text_query: str):
+    from search import match_subquery
+
+    fts = match_subquery(text_query)
+    return select(ProductDB).join(fts, ProductDB.product_id == fts.c.product_id)
+
+
+def _run_search(session: Session, statement, page_size: int = 20):
+    # ทำงานเหมือน search_products: นับจำนวน + ดึงหน้าแรก
+    statement = statement.where(ProductDB.product_status == "available")
+    total = session.exec(select(func.count()).select_from(statement.subquery())).one()
+    session.exec(statement.order_by(ProductDB.product_id.desc()).limit(page_size)).all()
+    return total
+
+
+def _time(fn, repeat: int):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), result
+
+
+def bench_search(products: int, repeat: int):
+    from search import init_search_index
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+
+        started = time.perf_counter()
+        bench_engine = make_database(path, products)
+        print(f"generated {products} products in {time.perf_counter() - started:.1f}s")
+
+        started = time.perf_counter()
+        init_search_index(bench_engine)
+        print(f"built search index in {time.perf_counter() - started:.1f}s")
+
+        print(f"{'query':<24}{'ilike ms':>12}{'index ms':>12}{'speedup':>10}{'ilike hits':>12}{'index hits':>12}")
+        with Session(bench_engine) as session:
+            for text_query in SEARCH_QUERIES:
+                ilike_ms, ilike_hits = _time(lambda: _run_search(session, _ilike_statement(text_query)), repeat)
+                index_ms, index_hits = _time(lambda: _run_search(session, _index_statement(text_query)), repeat)
+                print(
+                    f"{text_query:<24}{ilike_ms:>12.2f}{index_ms:>12.2f}"
+                    f"{ilike_ms / max(index_ms, 1e-6):>9.1f}x{ilike_hits:>12}{index_hits:>12}"
+                )
+        bench_engine.dispose()
+
+
+@contextlib.contextmanager
+def temp_app():
+    """import main.py โดยให้ใช้ DB เปล่าใน temp dir แทน FIIT.db จริง
+    คืน (main, statements) — statements[0] = จำนวน SQL ที่วิ่งไปแล้ว (ตั้งเป็น 0 ใหม่ได้)
+    ต้องเรียกก่อนมีใคร import database.py ใน process นี้
+
+    ตั้ง env FIIT_BENCH_DATABASE_URL (เช่น postgresql://localhost/fiit_bench) เพื่อรันกับ Postgres แทน
+    DB นั้นถูกล้างทั้ง schema ก่อนเริ่ม — ใช้ DB ที่สร้างไว้ทดสอบเท่านั้น
+    connection ของ asyncpg ผูกกับ event loop ที่สร้าง แต่ TestClient เปิด loop ใหม่ทุก request → ปิด pool (FIIT_POOL_SIZE=0)
+    """
+    from sqlalchemy import event
+
+    assert "database" not in sys.modules, "database.py was imported before temp_app()"
+    bench_url = os.environ.get("FIIT_BENCH_DATABASE_URL")
+    with tempfile.TemporaryDirectory() as tmp:
+        if bench_url:
+            reset_engine = create_engine(bench_url)
+            with reset_engine.begin() as conn:
+                conn.exec_driver_sql("DROP SCHEMA public CASCADE")
+                conn.exec_driver_sql("CREATE SCHEMA public")
+            reset_engine.dispose()
+            os.environ["FIIT_POOL_SIZE"] = "0"
+        os.environ["FIIT_DATABASE_URL"] = bench_url or f"sqlite:///{os.path.join(tmp, 'FIIT.db')}"
+        try:
+            import main
+
+            statements = [0]
+            count = lambda *args: statements.__setitem__(0, statements[0] + 1)
+            for engine in (main.engine, main.async_engine.sync_engine):  # นับทั้ง handler (async) และงานเบื้องหลัง (sync)
+                event.listen(engine, "before_cursor_execute", count)
+            yield main, statements
+            main.engine.dispose()
+            asyncio.run(main.async_engine.dispose())
+        finally:
+            del os.environ["FIIT_DATABASE_URL"]
+            if bench_url:
+                del os.environ["FIIT_POOL_SIZE"]
+
+
+def seed_community(session: Session, posts: int, comments_per_post: int, customers: int = 20):
+    from models import CommentDB, CustomerDB, PostDB
+
+    people = [
+        CustomerDB(username=f"user{i}", email=f"user{i}@fiit.test", customer_phone="0", password="x", display_name=f"User {i}")
+        for i in range(customers)
+    ]
+    session.add_all(people)
+    session.flush()
+    post_rows = [
+        PostDB(content=f"post {i}", customer_id=people[i % customers].customer_id, comments_count=comments_per_post)
+        for i in range(posts)
+    ]
+    session.add_all(post_rows)
+    session.flush()
+    session.add_all(
+        CommentDB(text=f"comment {j}", post_id=post.post_id, customer_id=people[(i + j) % customers].customer_id)
+        for i, post in enumerate(post_rows)
+        for j in range(comments_per_post)
+    )
+    session.commit()
+    return people, post_rows
+
+
+def bench_coalesce(levels: list[int]):
+    """ยิง GET สินค้า/โพสต์เดียวกันพร้อมกัน n request แล้วนับจำนวน SQL ที่วิ่งจริง เปิด/ปิด coalescing"""
+    import httpx
+
+    with temp_app() as (main, statements):
+        with Session(main.engine) as session:
+            _, (post,) = seed_community(session, posts=1, comments_per_post=20)
+            product = ProductDB(**next(generate_products(1)))
+            session.add(product)
+            session.commit()
+            product_id, post_id = product.product_id, post.post_id
+
+        main.product_cache.ttl = 0  # ปิด cache ให้เห็นผลของ coalescing อย่างเดียว
+
+        async def burst(client, url, n):
+            responses = await asyncio.gather(*(client.get(url) for _ in range(n)))
+            assert all(r.status_code == 200 for r in responses)
+
+        async def run():
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                print(f"{'route':<28}{'coalescing':>12}" + "".join(f"{f'n={n}':>10}" for n in levels))
+                for flight, url in ((main.product_flight, f"/products/{product_id}"), (main.post_flight, f"/posts/{post_id}")):
+                    for enabled in (False, True):
+                        flight.enabled = enabled
+                        counts = []
+                        for n in levels:
+                            statements[0] = 0
+                            await burst(client, url, n)
+                            counts.append(statements[0])
+                        print(f"{flight.route:<28}{'on' if enabled else 'off':>12}" + "".join(f"{c:>10}" for c in counts))
+
+        asyncio.run(run())
+
+
+def feed_query_counts(main, statements) -> list[tuple[int, int]]:
+    """เพิ่มโพสต์/คอมเมนต์ทีละชุด แล้วนับ SQL ของ GET /posts/ แต่ละรอบ คืน [(จำนวนโพสต์ใน feed, จำนวน SQL)]
+    ใช้ทั้ง feed-queries และ tests/test_feed_queries.py
+    """
+    from fastapi.testclient import TestClient
+
+    client = TestClient(main.app)
+    counts = []
+    for posts, comments in ((1, 1), (20, 5), (200, 20)):
+        with Session(main.engine) as session:
+            seed_community(session, posts, comments)
+        statements[0] = 0
+        response = client.get("/posts/")
+        assert response.status_code == 200
+        counts.append((len(response.json()), statements[0]))
+    return counts
+
+
+def check_feed_queries() -> bool:
+    """จำนวน query ของ GET /posts/ ต้องไม่โตตามจำนวนโพสต์/คอมเมนต์ (กัน N+1 กลับมา)"""
+    with temp_app() as (main, statements):
+        counts = feed_query_counts(main, statements)
+    for posts, count in counts:
+        print(f"feed with {posts:>4} posts: {count} SQL statements")
+    flat = len({count for _, count in counts}) == 1
+    print("OK: query count is constant" if flat else "FAIL: query count grows with feed size")
+    return flat
+
+
+def _contend(worker_id: int, threads: int, product_ids: list[int], barrier, results):
+    """process หนึ่งตัว: เปิด threads thread แต่ละ thread ยิง POST /create-order/ ทุกรอบพร้อมคนอื่น (รอ barrier)"""
+    from fastapi.testclient import TestClient
+    import main
+
+    def buyer(cus_id):
+        client = TestClient(main.app, raise_server_exceptions=False)  # 5xx นับเป็นผลลัพธ์ ไม่ให้ thread ตาย
+        outcomes = []
+        for product_id in product_ids:
+            body = {"cus_id": cus_id, "shipping_cost": 50, "items": [{"product_id": product_id, "qty": 1}]}
+            barrier.wait(timeout=60)
+            started = time.time()  # wall clock: เทียบข้าม process ได้
+            status = client.post("/create-order/", json=body).status_code
+            outcomes.append((product_id, status, started, time.time()))
+        results.put(outcomes)
+
+    pool = [threading.Thread(target=buyer, args=(worker_id * threads + i + 1,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    main.engine.dispose()
+    asyncio.run(main.async_engine.dispose())
+
+
+def contend(main, processes: int, threads: int, rounds: int):
+    """processes × threads คนแย่งซื้อสินค้าชิ้นเดียวกันพร้อมกัน rounds รอบ (รอบละชิ้น) บน DB ของ main
+    คืน (product_ids, outcomes [(product_id, status, เริ่ม, จบ)], {product_id: จำนวน order item})
+    ใช้ทั้ง contention และ tests/test_contention.py
+    """
+    from models import OrderItemDB
+
+    with Session(main.engine) as session:
+        products = [ProductDB(**{**row, "product_status": "available"}) for row in generate_products(rounds)]
+        session.add_all(products)
+        session.commit()
+        product_ids = [p.product_id for p in products]
+
+    # spawn: process ลูก import main ใหม่เอง (ได้ engine/connection ของตัวเอง) ชี้ DB เดียวกันผ่าน env
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(processes * threads)
+    results = context.Queue()
+    workers = [
+        context.Process(target=_contend, args=(i, threads, product_ids, barrier, results))
+        for i in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    outcomes = [outcome for _ in range(processes * threads) for outcome in results.get()]
+    for worker in workers:
+        worker.join()
+
+    with Session(main.engine) as session:
+        order_counts = dict(
+            session.exec(
+                select(OrderItemDB.product_id, func.count())
+                .where(OrderItemDB.product_id.in_(product_ids))
+                .group_by(OrderItemDB.product_id)
+            ).all()
+        )
+    return product_ids, outcomes, order_counts
+
+
+def check_contention(processes: int, threads: int, rounds: int) -> bool:
+    """ผ่านเมื่อทุกชิ้นมี order เดียว คนที่เหลือได้ 409 และไม่มี 5xx (ดู contend)"""
+    with temp_app() as (main, _):
+        product_ids, outcomes, order_counts = contend(main, processes, threads, rounds)
+
+    # นับเวลาเฉพาะช่วงแย่งซื้อ ไม่รวมเวลาเปิด process/import main
+    elapsed = max(end for *_, end in outcomes) - min(start for _, _, start, _ in outcomes)
+    statuses = {}
+    for _, status, _, _ in outcomes:
+        statuses[status] = statuses.get(status, 0) + 1
+    wins = {product_id for product_id, status, _, _ in outcomes if status == 200}
+    won_ms = sorted((end - start) * 1000 for _, status, start, end in outcomes if status == 200)
+    lost_ms = sorted((end - start) * 1000 for _, status, start, end in outcomes if status == 409)
+
+    def pct(samples, q):
+        return samples[min(int(len(samples) * q), len(samples) - 1)] if samples else 0.0
+
+    print(f"{processes} processes × {threads} threads, {rounds} products, {len(outcomes)} attempts in {elapsed:.2f}s")
+    print(f"responses: {dict(sorted(statuses.items()))}")
+    print(f"throughput: {len(outcomes) / elapsed:.0f} attempts/s, {len(wins) / elapsed:.1f} orders/s")
+    print(f"winner latency ms p50={pct(won_ms, 0.5):.1f} p99={pct(won_ms, 0.99):.1f}")
+    print(f"loser  latency ms p50={pct(lost_ms, 0.5):.1f} p99={pct(lost_ms, 0.99):.1f}")
+
+    ok = (
+        statuses.get(200, 0) == rounds
+        and statuses.get(409, 0) == len(outcomes) - rounds
+        and all(order_counts.get(product_id) == 1 for product_id in product_ids)
+    )
+    print("OK: exactly one order per product" if ok else "FAIL: double-sold products or unexpected responses")
+    return ok
+
+
+def bench_sweep(orders: int, items_per_order: int):
+    """สร้าง order pending ที่หมดเวลาแล้ว orders รายการ (ครึ่งหนึ่งยังไม่หมดเวลา) แล้วจับเวลา sweep 1 รอบ"""
+    from datetime import datetime, timedelta
+    from models import OrderDB, OrderItemDB
+
+    with temp_app() as (main, statements):
+        from sweeper import sweep_expired_orders
+
+        old = datetime.now() - timedelta(days=1)
+        with Session(main.engine) as session:
+            rows = [{**row, "product_status": "reserved"} for row in generate_products(orders * 2 * items_per_order)]
+            session.execute(insert(ProductDB), rows)
+            session.execute(insert(OrderDB), [
+                {"cus_id": 1, "total_price": 100, "grand_total": 150, "created_at": old if i < orders else datetime.now()}
+                for i in range(orders * 2)
+            ])
+            session.execute(insert(OrderItemDB), [
+                {"order_id": i // items_per_order + 1, "product_id": i + 1, "qty": 1, "price": 100}
+                for i in range(orders * 2 * items_per_order)
+            ])
+            session.commit()
+
+        statements[0] = 0
+        sweep = sweep_expired_orders(ttl=3600)
+        print(f"{orders * 2} pending orders ({orders} expired), {items_per_order} items each")
+        print(
+            f"cancelled {sweep['orders_cancelled']} orders, released {sweep['products_released']} products "
+            f"in {sweep['duration_ms']:.1f} ms ({sweep['batches']} batches, {statements[0]} SQL statements)"
+        )
+        again = sweep_expired_orders(ttl=3600)
+        print(f"second sweep (nothing to do): {again['duration_ms']:.1f} ms")
+
+
+def bench_checkout(orders: int, items_per_cart: int):
+    """ลูกค้า orders คน ตะกร้าละ items_per_cart ชิ้น checkout ทีละคน (DB เป็นไฟล์ใน temp dir มี fsync จริง)"""
+    from fastapi.testclient import TestClient
+    from models import CartItemDB
+
+    with temp_app() as (main, statements):
+        with Session(main.engine) as session:
+            rows = [{**row, "product_status": "available"} for row in generate_products(orders * items_per_cart)]
+            session.execute(insert(ProductDB), rows)
+            session.execute(insert(CartItemDB), [
+                {"cus_id": i // items_per_cart + 1, "product_id": i + 1, "qty": 1}
+                for i in range(orders * items_per_cart)
+            ])
+            session.commit()
+
+        client = TestClient(main.app)
+        statements[0] = 0
+        samples = []
+        for cus_id in range(1, orders + 1):
+            started = time.perf_counter()
+            response = client.post(f"/orders/checkout/{cus_id}")
+            samples.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == 200, response.text
+        elapsed = sum(samples) / 1000
+
+        samples.sort()
+        print(f"{orders} checkouts × {items_per_cart} items on {main.engine.url.database}")
+        print(f"{orders / elapsed:.0f} orders/s, p50={samples[len(samples) // 2]:.2f} ms p99={samples[int(len(samples) * 0.99)]:.2f} ms")
+        print(f"{statements[0] / orders:.1f} SQL statements per checkout")
+
+
+def bench_event_loop(hold_ms: int, writers: int, readers: int, clients: list[int], requests: int):
+    """sync Session ใน async def (แบบเดิม) vs AsyncSession (แบบปัจจุบัน) สองแบบ
+    1. throughput: clients ตัวยิงพร้อมกันคนละ requests ครั้ง (1 ใน write_every ครั้งเป็นการเขียน ที่เหลืออ่าน)
+       ระหว่างนั้น connection อื่น (sweeper / worker ตัวอื่น) ถือ write lock เป็นช่วงๆ → req/s
+       blocking = คนเขียนที่รอ lock ค้างทั้ง event loop ทุก request รอด้วย / async = รอแค่ตัวเอง
+    2. ระหว่างมีคนถือ write lock อยู่ hold_ms: ยิง request ที่ต้องเขียน writers ตัว (ต้องรอ lock) พร้อม GET readers ตัว
+       blocking = รอ lock ใน event loop → ทั้ง process ค้าง GET ก็รอด้วย / async = ตัวที่รอ lock ไม่กวน GET ตัวอื่น
+    """
+    import sqlite3
+    import httpx
+    from sqlalchemy import text, update
+
+    write_every = 10                  # 1 ใน 10 request เป็นการเขียน
+    busy_ms, idle_ms = 20, 30         # writer ภายนอกถือ lock 20 ms ทุกๆ 50 ms
+
+    with temp_app() as (main, statements):
+        from database import write_session
+
+        with Session(main.engine) as session:
+            session.execute(insert(ProductDB), list(generate_products(1000)))
+            session.commit()
+
+        touch = update(ProductDB).where(ProductDB.product_id == 1).values(price=ProductDB.price + 0)
+        point = text("SELECT pname FROM productdb WHERE product_id = 1")
+
+        async def blocking_write():
+            with write_session() as session:
+                session.exec(touch)
+                session.commit()
+
+        async def blocking_read():
+            with Session(main.engine) as session:
+                return session.exec(point).scalar()
+
+        async def async_write():
+            async with main.async_write_session() as session:
+                await session.exec(touch)
+                await session.commit()
+
+        async def async_read():
+            async with main.async_session() as session:
+                return (await session.exec(point)).scalar()
+
+        for name, endpoint in (("blocking-write", blocking_write), ("blocking-read", blocking_read),
+                               ("async-write", async_write), ("async-read", async_read)):
+            main.app.add_api_route(f"/_bench/{name}", endpoint, methods=["GET"])
+
+        def hold_lock(locked):
+            # writer อีก process/connection (เช่น sweeper หรือ worker ตัวอื่น) ถือ lock อยู่ hold_ms
+            conn = sqlite3.connect(main.engine.url.database, isolation_level=None)
+            conn.execute("BEGIN IMMEDIATE")
+            locked.set()
+            time.sleep(hold_ms / 1000)
+            conn.execute("COMMIT")
+            conn.close()
+
+        async def timed(client, url, issued):
+            # นับจากตอนยิงทั้งชุด: ถ้า event loop โดนบล็อก request ที่รอคิวก็ต้องนับเวลารอด้วย
+            response = await client.get(url)
+            assert response.status_code == 200, response.text
+            return (time.perf_counter() - issued) * 1000
+
+        async def run(mode):
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                await timed(client, f"/_bench/{mode}-read", time.perf_counter())  # warm up connection pool
+                locked = threading.Event()
+                holder = threading.Thread(target=hold_lock, args=(locked,))
+                holder.start()
+                locked.wait()
+                started = time.perf_counter()
+                write_tasks = [asyncio.create_task(timed(client, f"/_bench/{mode}-write", started)) for _ in range(writers)]
+                read_samples = await asyncio.gather(*(timed(client, f"/_bench/{mode}-read", started) for _ in range(readers)))
+                write_samples = await asyncio.gather(*write_tasks)
+                holder.join()
+                return sorted(read_samples), write_samples
+
+        def busy_writer(stop):
+            conn = sqlite3.connect(main.engine.url.database, isolation_level=None)
+            while not stop.is_set():
+                conn.execute("BEGIN IMMEDIATE")
+                time.sleep(busy_ms / 1000)
+                conn.execute("COMMIT")
+                time.sleep(idle_ms / 1000)
+            conn.close()
+
+        async def throughput(mode, concurrency):
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                await client.get(f"/_bench/{mode}-read")  # warm up connection pool
+
+                async def client_loop():
+                    for i in range(requests):
+                        response = await client.get(f"/_bench/{mode}-{'write' if i % write_every == 0 else 'read'}")
+                        assert response.status_code == 200, response.text
+
+                stop = threading.Event()
+                writer = threading.Thread(target=busy_writer, args=(stop,))
+                writer.start()
+                started = time.perf_counter()
+                await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+                elapsed = time.perf_counter() - started
+                stop.set()
+                writer.join()
+                return concurrency * requests / elapsed
+
+        print(f"{requests} requests per client (1 in {write_every} writes); another connection holds the write lock "
+              f"{busy_ms} ms of every {busy_ms + idle_ms} ms; {os.cpu_count()} CPU")
+        print(f"{'clients':<10}{'blocking req/s':>16}{'async req/s':>14}{'async/blocking':>16}")
+        for concurrency in clients:
+            rates = {}
+            for mode in ("blocking", "async"):
+                rates[mode] = asyncio.run(throughput(mode, concurrency))
+                asyncio.run(main.async_engine.dispose())  # connection ของ aiosqlite ผูกกับ event loop ของรอบนั้น
+            print(f"{concurrency:<10}{rates['blocking']:>16.0f}{rates['async']:>14.0f}{rates['async'] / rates['blocking']:>15.2f}x")
+
+        print()
+        print(f"write lock held {hold_ms} ms; {writers} writes + {readers} reads fired while it is held")
+        print(f"{'mode':<10}{'read p50 ms':>13}{'read p99 ms':>13}{'write max ms':>14}")
+        for mode in ("blocking", "async"):
+            read_samples, write_samples = asyncio.run(run(mode))
+            asyncio.run(main.async_engine.dispose())  # connection ของ aiosqlite ผูกกับ event loop ของรอบนั้น
+            print(
+                f"{mode:<10}{read_samples[len(read_samples) // 2]:>13.1f}"
+                f"{read_samples[int(len(read_samples) * 0.99)]:>13.1f}{max(write_samples):>14.1f}"
+            )
+
+def _workload(bench_engine, write_ratio: float, threads: int, seconds: float, products: int):
+    """threads thread ยิง DB ตรงๆ seconds วินาที: อ่าน (ดูสินค้า 1 ชิ้น + หน้ารายการ) หรือเขียน (สร้าง order + จองสินค้า)"""
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError
+
+    point = text("SELECT * FROM productdb WHERE product_id = :id")
+    page = text("SELECT * FROM productdb WHERE product_status = 'available' ORDER BY product_id DESC LIMIT 20 OFFSET :offset")
+    new_order = text(
+        "INSERT INTO orderdb (cus_id, total_price, shipping_cost, grand_total, order_status, created_at) "
+        "VALUES (:cus_id, 100, 50, 150, 'pending', CURRENT_TIMESTAMP)"
+    )
+    reserve = text("UPDATE productdb SET product_status = 'reserved' WHERE product_id = :id")
+    reads, writes, errors = [], [], [0]
+    deadline = time.perf_counter() + seconds
+
+    def worker(seed):
+        rng = random.Random(seed)
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                if rng.random() < write_ratio:
+                    with bench_engine.connect().execution_options(sqlite_begin="IMMEDIATE") as conn, conn.begin():
+                        conn.execute(new_order, {"cus_id": seed})
+                        conn.execute(reserve, {"id": rng.randint(1, products)})
+                    writes.append(time.perf_counter() - started)
+                else:
+                    with bench_engine.connect() as conn:
+                        conn.execute(point, {"id": rng.randint(1, products)}).all()
+                        conn.execute(page, {"offset": rng.randint(0, 50) * 20}).all()
+                    reads.append(time.perf_counter() - started)
+            except OperationalError:  # database is locked เกิน busy timeout
+                errors[0] += 1
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return reads, writes, errors[0]
+
+
+def bench_engine_profile(products: int, threads: int, seconds: float):
+    """เทียบ PRAGMA ของ SQLite (ค่าเดิมของ SQLite vs WAL vs ค่า default ใน database.py) กับงานอ่านเยอะ/เขียนเยอะ"""
+    from database import SQLITE_PRAGMAS, make_engine
+
+    profiles = {
+        "sqlite defaults": {"journal_mode": "DELETE", "synchronous": "FULL", "mmap_size": 0, "cache_size": -2000, "temp_store": "DEFAULT"},
+        "WAL, synchronous=FULL": {**SQLITE_PRAGMAS, "journal_mode": "WAL", "synchronous": "FULL"},
+        "database.py defaults": SQLITE_PRAGMAS,
+    }
+    workloads = {"read-heavy (5% writes)": 0.05, "write-heavy": 1.0}
+
+    def pct(samples, q):
+        return sorted(samples)[min(len(samples) - 1, int(len(samples) * q))] * 1000 if samples else float("nan")
+
+    print(f"{products} products, {threads} threads, {seconds:g}s per run")
+    print(f"{'workload':<24}{'profile':<24}{'ops/s':>8}{'read p99 ms':>13}{'write p99 ms':>14}{'locked':>8}")
+    for workload, write_ratio in workloads.items():
+        for name, pragmas in profiles.items():
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "bench.db")
+                make_database(path, products).dispose()
+                bench_engine = make_engine(f"sqlite:///{path}", pragmas=pragmas, pool_size=threads)
+                reads, writes, errors = _workload(bench_engine, write_ratio, threads, seconds, products)
+                bench_engine.dispose()
+            print(
+                f"{workload:<24}{name:<24}{(len(reads) + len(writes)) / seconds:>8.0f}"
+                f"{pct(reads, 0.99):>13.2f}{pct(writes, 0.99):>14.2f}{errors:>8}"
+            )
+
+
+def hot_queries(main):
+    """query ที่วิ่งบ่อย (ต้องใช้ index เสมอ) — สร้างแบบเดียวกับใน main.py / sweeper.py"""
+    from datetime import datetime
+    from sqlalchemy import update
+    from sqlalchemy.orm import aliased
+    from models import CartItemDB, CommentDB, CustomerDB, OrderDB, OrderItemDB, OrderStatus, PaymentDB, PostDB, SellerDB
+
+    listing = select(ProductDB).where(ProductDB.product_status == "available")
+    ranked = select(
+        CommentDB, func.row_number().over(partition_by=CommentDB.post_id, order_by=CommentDB.comment_id.desc()).label("rn")
+    ).where(CommentDB.post_id.in_([1, 2, 3])).subquery()
+    expired = (
+        select(OrderDB.order_id)
+        .where(OrderDB.order_status == OrderStatus.pending, OrderDB.created_at < datetime.now())
+        .order_by(OrderDB.order_id)
+        .limit(1000)
+    )
+    return {
+        "product by id": select(ProductDB).where(ProductDB.product_id == 1),
+        "search newest": listing.order_by(ProductDB.product_id.desc()).limit(20),
+        "search category newest": listing.where(ProductDB.categoryID == 3).order_by(ProductDB.product_id.desc()).limit(20),
+        "search price_low": listing.order_by(ProductDB.price.asc().nulls_first(), ProductDB.product_id).limit(20),
+        "search price range": listing.where(ProductDB.price >= 100, ProductDB.price <= 500).limit(20),
+        "products of seller": select(ProductDB).where(ProductDB.seller_id == 101),
+        "reserve products": update(ProductDB).where(ProductDB.product_id.in_([1, 2]), ProductDB.product_status == "available").values(product_status="reserved"),
+        "orders of customer": select(OrderDB).where(OrderDB.cus_id == 1).order_by(OrderDB.order_id).limit(20),
+        "items of order": select(OrderItemDB).where(OrderItemDB.order_id == 1),
+        "payment of order": select(PaymentDB).where(PaymentDB.order_id == 1),
+        "sweeper expired orders": expired,
+        "sweeper release products": select(OrderItemDB.product_id).where(OrderItemDB.order_id.in_(expired)),
+        "cart of customer": select(CartItemDB).where(CartItemDB.cus_id == 1),
+        "cart item lookup": select(CartItemDB).where(CartItemDB.cus_id == 1, CartItemDB.product_id == 2),
+        "carts holding product": select(CartItemDB).where(CartItemDB.product_id == 2),
+        "comments of post": select(CommentDB).where(CommentDB.post_id == 1),
+        "latest comments per post": select(aliased(CommentDB, ranked)).where(ranked.c.rn <= 3),
+        "posts of customer": select(PostDB).where(PostDB.customer_id == 1),
+        "customer sign-in": select(CustomerDB).where(CustomerDB.email == "a@b.c", CustomerDB.password == "x"),
+        "seller sign-in": select(SellerDB).where(SellerDB.email == "a@b.c"),
+    }
+
+
+def query_plans(main) -> dict[str, tuple[list[str], list[str]]]:
+    """EXPLAIN QUERY PLAN ของ hot_queries() คืน {ชื่อ: (ขั้นตอนของ plan, ขั้นตอนที่อ่านทั้งตาราง)}
+    Postgres: ดู "Seq Scan on" จาก EXPLAIN แทน / ใช้ทั้ง query-plans และ tests/test_query_plans.py
+    """
+    plans = {}
+    with main.engine.connect() as conn:
+        postgres = conn.dialect.name == "postgresql"
+        if postgres:
+            conn.exec_driver_sql("SET enable_seqscan = off")  # ตารางว่าง planner เลือก seq scan เสมอ → ดูแค่ว่ามี index ให้ใช้ไหม
+        for name, statement in hot_queries(main).items():
+            compiled = statement.compile(dialect=conn.dialect, compile_kwargs={"render_postcompile": True})
+            if postgres:
+                plan = [row[0].strip(" ->") for row in conn.exec_driver_sql(f"EXPLAIN {compiled}", compiled.params)]
+                plan = [step for step in plan if "Scan" in step]
+                scans = [step for step in plan if step.startswith("Seq Scan on ")]
+            else:
+                params = tuple(compiled.params[key] for key in compiled.positiontup)
+                plan = [row[3] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params)]
+                # SCAN ของ subquery / CTE / virtual table (FTS) ไม่ใช่การอ่านตารางทั้งตาราง
+                scans = [step for step in plan if step.startswith("SCAN ") and not step.startswith(("SCAN (", "SCAN CONSTANT")) and " VIRTUAL TABLE" not in step
+                         and step.split()[1] in SQLModel.metadata.tables]
+            plans[name] = (plan, scans)
+    return plans
+
+
+def check_query_plans() -> bool:
+    """ถ้า hot query ไหนมี SCAN ตารางจริง (อ่านทั้งตาราง) ถือว่าพัง (ดู query_plans)"""
+    with temp_app() as (main, statements):
+        plans = query_plans(main)
+    failures = []
+    for name, (plan, scans) in plans.items():
+        print(f"{'FAIL' if scans else 'ok':<6}{name:<28}{' | '.join(plan)}")
+        if scans:
+            failures.append(name)
+    if failures:
+        print(f"FAIL: full table scan in {', '.join(failures)}")
+        return False
+    print("OK: every hot query uses an index")
+    return True
+
+
+def check_replica_routing() -> bool:
+    """ใช้ไฟล์ SQLite ที่ copy จาก primary เป็น replica (copy ใหม่ = replica ตามทัน)
+    GET /posts/ ต้องอ่านจาก replica ตอนที่ยังสดอยู่ และกลับไปอ่าน primary เมื่อเก่าเกิน max_lag
+    POST ต้องเขียนลง primary เสมอ
+    """
+    import sqlite3
+    import httpx
+
+    if os.environ.get("FIIT_BENCH_DATABASE_URL"):
+        print("replicas: SQLite only (the replica is a file copy), unset FIIT_BENCH_DATABASE_URL")
+        return False
+    max_lag = 0.5
+    with tempfile.TemporaryDirectory() as replica_dir:
+        replica_path = os.path.join(replica_dir, "replica.db")
+        os.environ["FIIT_REPLICA_URLS"] = f"sqlite:///{replica_path}"
+        try:
+            with temp_app() as (main, statements):
+                router = main.replica_router
+                (replica,) = router.replicas
+                router.max_lag = max_lag
+                with Session(main.engine) as session:
+                    people, _ = seed_community(session, posts=3, comments_per_post=2)
+                    author = people[0].customer_id
+                primary_path = main.engine.url.database
+
+                async def catch_up():
+                    # beat ก่อน copy → replica มี heartbeat ของตอนที่ copy
+                    await router.beat()
+                    with contextlib.closing(sqlite3.connect(primary_path)) as src, contextlib.closing(sqlite3.connect(replica_path)) as dst:
+                        src.backup(dst)
+                    await router.refresh()
+
+                async def feed(client):
+                    reads, primary_reads = replica.reads, router.primary_reads
+                    response = await client.get("/posts/")
+                    assert response.status_code == 200
+                    source = "replica" if replica.reads > reads else "primary" if router.primary_reads > primary_reads else "?"
+                    return len(response.json()), source
+
+                async def run():
+                    results = []
+
+                    def expect(name, got, want):
+                        results.append(got == want)
+                        print(f"{'ok' if got == want else 'FAIL':<6}{name:<44}{got}")
+
+                    transport = httpx.ASGITransport(app=main.app)
+                    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                        expect("before first heartbeat", await feed(client), (3, "primary"))
+                        await catch_up()
+                        expect("fresh replica", await feed(client), (3, "replica"))
+                        reads = replica.reads
+                        response = await client.post("/posts/", json={"content": "new", "customer_id": author})
+                        expect("write goes to primary", (response.status_code, replica.reads - reads), (200, 0))
+                        expect("stale read within max_lag", await feed(client), (3, "replica"))
+                        await asyncio.sleep(max_lag + 0.1)
+                        expect("replica older than max_lag", await feed(client), (4, "primary"))
+                        await catch_up()
+                        expect("replica caught up", await feed(client), (4, "replica"))
+                    print(router.stats())
+                    await router.dispose()
+                    return all(results)
+
+                ok = asyncio.run(run())
+        finally:
+            del os.environ["FIIT_REPLICA_URLS"]
+    print("OK: reads follow replica freshness" if ok else "FAIL: replica routing")
+    return ok
+
+
+#ขนาดข้อมูลสังเคราะห์ของ load test (ปรับทีละตัวได้ด้วย --products ฯลฯ)
+#comments = เฉลี่ยต่อโพสต์, carts = ลูกค้าที่มีของในตะกร้า (checkout ได้ตะกร้าละครั้ง)
+DATASET_SCALES = {
+    "small": {"products": 2_000, "customers": 500, "orders": 1_000, "posts": 200, "comments": 5, "carts": 300},
+    "medium": {"products": 50_000, "customers": 5_000, "orders": 20_000, "posts": 5_000, "comments": 10, "carts": 2_000},
+    "large": {"products": 500_000, "customers": 50_000, "orders": 200_000, "posts": 50_000, "comments": 10, "carts": 10_000},
+}
+INSERT_BATCH_SIZE = 5000
+ORDER_STATUS_WEIGHTS = {"delivered": 50, "paid": 20, "shipping": 10, "cancelled": 10, "pending": 10}
+PAYMENT_METHODS = ["promptpay", "credit_card", "bank_transfer", "cod"]
+POST_TEXTS = ["ได้ของแล้ว สภาพดีมาก", "หาเสื้อวินเทจไซซ์ L ค่ะ", "ลดราคาทั้งร้าน", "ใครเคยซื้อร้านนี้บ้าง", "OOTD วันนี้", "ส่งไวมาก แนะนำเลย"]
+COMMENT_TEXTS = ["สวยมาก", "ยังอยู่ไหมคะ", "สนใจค่ะ", "ราคาเท่าไร", "👍", "ส่งต่างจังหวัดได้ไหม"]
+
+
+def _bulk_insert(session: Session, model, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == INSERT_BATCH_SIZE:
+            session.execute(insert(model), batch)
+            batch = []
+    if batch:
+        session.execute(insert(model), batch)
+
+
+def generate_dataset(bind, products: int, customers: int, orders: int, posts: int, comments: int, carts: int, seed: int = 411) -> dict:
+    """ข้อมูลสังเคราะห์ของทุกตารางที่ hot path ใช้ ลง DB เปล่า (id เริ่มที่ 1) แล้วสร้าง search index + ANALYZE
+    order ใช้สินค้าที่ sold แล้ว / ตะกร้าใช้สินค้า available ไม่ซ้ำกันเลย → checkout ได้สำเร็จทุกตะกร้า
+    order pending อายุไม่เกิน 10 นาที ไม่โดน sweeper ยกเลิกระหว่างวัด
+    คืนจำนวนแถวจริงของแต่ละตาราง + id ที่ load test ใช้
+    """
+    from datetime import datetime, timedelta
+    from database import analyze_database
+    from models import CartItemDB, CategoryDB, CommentDB, CustomerDB, OrderDB, OrderItemDB, PaymentDB, PostDB, SellerDB
+    from search import rebuild_search_index
+
+    rng = random.Random(seed)
+    now = datetime.now()
+    product_rows = list(generate_products(products, seed))
+    sold = [i + 1 for i, row in enumerate(product_rows) if row["product_status"] == "sold"]
+    available = [i + 1 for i, row in enumerate(product_rows) if row["product_status"] == "available"]
+    rng.shuffle(available)
+
+    cart_rows, cart_customers = [], []
+    for cus_id in range(1, min(carts, customers) + 1):
+        size = rng.randint(1, 4)
+        if len(available) < size:
+            break
+        cart_customers.append(cus_id)
+        cart_rows.extend({"cus_id": cus_id, "product_id": available.pop(), "qty": 1} for _ in range(size))
+
+    order_rows, item_rows, payment_rows = [], [], []
+    statuses, weights = list(ORDER_STATUS_WEIGHTS), list(ORDER_STATUS_WEIGHTS.values())
+    for order_id in range(1, orders + 1 if sold else 1):
+        status = rng.choices(statuses, weights)[0]
+        age = timedelta(seconds=rng.randint(0, 600)) if status == "pending" else timedelta(days=rng.uniform(0, 365))
+        items = rng.sample(sold, min(len(sold), rng.randint(1, 3)))
+        total = sum(product_rows[product_id - 1]["price"] for product_id in items)
+        order_rows.append({
+            "cus_id": rng.randint(1, customers), "total_price": total, "shipping_cost": 50.0, "grand_total": total + 50,
+            "order_status": status, "created_at": now - age,
+        })
+        item_rows.extend(
+            {"order_id": order_id, "product_id": product_id, "qty": 1, "price": product_rows[product_id - 1]["price"]}
+            for product_id in items
+        )
+        if status in ("paid", "shipping", "delivered"):
+            payment_rows.append({
+                "order_id": order_id, "payment_method": rng.choice(PAYMENT_METHODS), "payment_amount": total + 50,
+                "payment_status": "success", "payment_date": (now - age).date().isoformat(), "transaction_no": rng.randint(10**8, 10**9),
+            })
+
+    post_rows, comment_rows = [], []
+    for post_id in range(1, posts + 1):
+        count = rng.randint(0, comments * 2)
+        post_rows.append({
+            "content": rng.choice(POST_TEXTS), "customer_id": rng.randint(1, customers), "likes": rng.randint(0, 500),
+            "reposts": rng.randint(0, 50), "shares": rng.randint(0, 50), "comments_count": count,
+        })
+        comment_rows.extend(
+            {"text": rng.choice(COMMENT_TEXTS), "post_id": post_id, "customer_id": rng.randint(1, customers), "time_str": "Just now"}
+            for _ in range(count)
+        )
+
+    with Session(bind) as session:
+        _bulk_insert(session, CategoryDB, ({"category_name": f"category {i}"} for i in range(1, 16)))
+        _bulk_insert(session, SellerDB, (
+            {"seller_name": f"Seller {i}", "email": f"seller{i}@fiit.test", "seller_phone": "0", "store_name": f"Shop {i}",
+             "verification_status": "verified"}
+            for i in range(1, 501)  # generate_products สุ่ม seller_id 1–500
+        ))
+        _bulk_insert(session, CustomerDB, (
+            {"username": f"user{i}", "email": f"user{i}@fiit.test", "customer_phone": "0", "password": "x",
+             "display_name": f"User {i}", "avatar": f"https://placehold.co/100x100?text={i}"}
+            for i in range(1, customers + 1)
+        ))
+        for model, rows in ((ProductDB, product_rows), (OrderDB, order_rows), (OrderItemDB, item_rows), (PaymentDB, payment_rows),
+                            (CartItemDB, cart_rows), (PostDB, post_rows), (CommentDB, comment_rows)):
+            _bulk_insert(session, model, rows)
+        session.commit()
+
+    rebuild_search_index(bind)
+    if bind.dialect.name == "postgresql":
+        with bind.begin() as conn:
+            conn.exec_driver_sql("ANALYZE")
+    analyze_database(bind)
+    return {
+        "counts": {
+            "products": len(product_rows), "customers": customers, "orders": len(order_rows), "order_items": len(item_rows),
+            "payments": len(payment_rows), "posts": len(post_rows), "comments": len(comment_rows),
+            "carts": len(cart_customers), "cart_items": len(cart_rows),
+        },
+        "cart_customers": cart_customers,
+        "order_ids": range(1, len(order_rows) + 1),
+    }
+
+
+def _percentile(samples: list[float], percent: float) -> float:
+    """nearest-rank ของ samples ที่เรียงแล้ว"""
+    return samples[max(0, min(len(samples) - 1, math.ceil(len(samples) * percent / 100) - 1))]
+
+
+def _summarize(latencies: list[float], errors: int, seconds: float, statements: int) -> dict:
+    samples = sorted(latencies)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "throughput_rps": round(len(samples) / seconds, 1) if seconds else None,
+        "mean_ms": round(statistics.fmean(samples), 2),
+        "p50_ms": round(_percentile(samples, 50), 2),
+        "p95_ms": round(_percentile(samples, 95), 2),
+        "p99_ms": round(_percentile(samples, 99), 2),
+        "max_ms": round(samples[-1], 2),
+        "sql_per_request": round(statements / len(samples), 1),
+    }
+
+
+def _load_scenarios(data: dict, rng: random.Random) -> dict:
+    """scenario → ฟังก์ชันที่คืน (method, url, json) ของ request ถัดไป
+    get_cart มาก่อน checkout (checkout ทำให้ตะกร้าว่าง) / checkout ใช้ตะกร้าละครั้ง
+    """
+    carts = iter(data["cart_customers"])
+    sorts = [sort.value for sort in SortBy]
+    return {
+        "search_products": lambda: ("POST", "/products/search", {
+            "query": rng.choice(SEARCH_QUERIES), "sort_by": rng.choice(sorts), "page_size": 20,
+            "category_id": rng.choice([None, None, rng.randint(1, 15)]),
+        }),
+        "get_all_posts": lambda: ("GET", "/posts/?limit=20&newest_first=true&preview_comments=3", None),
+        "get_cart": lambda: ("GET", f"/cart/{rng.choice(data['cart_customers'])}", None),
+        "get_order_item": lambda: ("GET", f"/order_items/{rng.choice(data['order_ids'])}", None),
+        "checkout": lambda: ("POST", f"/orders/checkout/{next(carts)}", None),
+    }
+
+
+async def _drive(client, next_request, count: int, concurrency: int):
+    """ยิง count request ด้วย concurrency ตัวพร้อมกัน คืน (latency ms ทุกตัว, จำนวน error, เวลารวม)"""
+    latencies, errors, remaining = [], 0, count
+
+    async def worker():
+        nonlocal errors, remaining
+        while remaining > 0:
+            remaining -= 1
+            method, url, body = next_request()
+            started = time.perf_counter()
+            response = await client.request(method, url, json=body)
+            latencies.append((time.perf_counter() - started) * 1000)
+            errors += response.status_code >= 400
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+
+@contextlib.contextmanager
+def _http_server(app):
+    """uvicorn บน port ว่างของเครื่องนี้ (thread แยก) คืน base url"""
+    import socket
+    import uvicorn
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("uvicorn failed to start")
+        time.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+def _git_commit() -> str | None:
+    import subprocess
+
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_load(dataset: dict, mode: str, requests: int, concurrency: int, warmup: int, scenarios: list[str], seed: int) -> dict:
+    """สร้างข้อมูลตาม dataset แล้วยิง hot path ทีละ scenario
+    mode: inprocess = httpx.ASGITransport (ไม่ผ่าน network) / http = uvicorn จริงบน localhost
+    """
+    import platform
+    import httpx
+
+    with temp_app() as (main, statements):
+        started = time.perf_counter()
+        data = generate_dataset(main.engine, seed=seed, **dataset)
+        print(f"generated {data['counts']} in {time.perf_counter() - started:.1f}s")
+        rng = random.Random(seed)
+        next_requests = _load_scenarios(data, rng)
+
+        async def run(client) -> dict:
+            results = {}
+            for name in (name for name in next_requests if name in scenarios):
+                count = requests
+                if name == "checkout":
+                    count = min(requests, len(data["cart_customers"]) - warmup)
+                await _drive(client, next_requests[name], warmup, concurrency)
+                statements[0] = 0
+                latencies, errors, seconds = await _drive(client, next_requests[name], count, concurrency)
+                results[name] = _summarize(latencies, errors, seconds, statements[0])
+            return results
+
+        async def run_in_process():
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+                return await run(client)
+
+        async def run_over_http(base_url):
+            limits = httpx.Limits(max_connections=concurrency)
+            async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+                return await run(client)
+
+        if mode == "http":
+            with _http_server(main.app) as base_url:
+                scenario_results = asyncio.run(run_over_http(base_url))
+        else:
+            scenario_results = asyncio.run(run_in_process())
+
+        return {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "backend": main.engine.dialect.name,
+            "mode": mode,
+            "concurrency": concurrency,
+            "warmup": warmup,
+            "seed": seed,
+            "dataset": data["counts"],
+            "scenarios": scenario_results,
+        }
+
+
+def print_load_report(report: dict, baseline: dict | None = None):
+    """ตารางผล load test — ส่ง baseline (JSON ของรอบก่อน) มา = แสดง % ที่เปลี่ยนไปของ p95 และ throughput ด้วย"""
+    print(f"{report['mode']} / {report['backend']} / concurrency {report['concurrency']} / commit {report['commit']}")
+    header = f"{'scenario':<18}{'req':>6}{'err':>5}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'SQL/req':>9}"
+    print(header + (f"{'p95 Δ':>9}{'req/s Δ':>9}" if baseline else ""))
+    for name, result in report["scenarios"].items():
+        line = (
+            f"{name:<18}{result['requests']:>6}{result['errors']:>5}{result['throughput_rps']:>9.1f}"
+            f"{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}{result['p99_ms']:>9.2f}{result['sql_per_request']:>9.1f}"
+        )
+        before = (baseline or {}).get("scenarios", {}).get(name)
+        if before:
+            change = lambda key: f"{(result[key] - before[key]) / before[key] * 100:+.0f}%" if before[key] else "-"
+            line += f"{change('p95_ms'):>9}{change('throughput_rps'):>9}"
+        print(line)
+
+
+def bench_metrics_overhead(requests: int, concurrency: int, rounds: int, threads: int):
+    """ต้นทุนของ metrics.py
+    1. observe() ของ histogram ต่อครั้ง: thread เดียว และหลาย thread พร้อมกัน (ต้องไม่มีค่าหาย ถึงไม่มี lock)
+    2. req/s ของ route เบาๆ สลับเปิด/ปิด MetricsMiddleware ทีละรอบ (route เบา = overhead เห็นชัดสุด)
+    3. เวลา render /metrics
+    """
+    import httpx
+    from metrics import Histogram
+
+    per_thread = 100_000
+    histogram = Histogram("bench_seconds", "bench", ("method", "route", "status"))
+    started = time.perf_counter()
+    for _ in range(per_thread):
+        histogram.observe(0.003, "GET", "/posts/", 200)
+    single_ns = (time.perf_counter() - started) / per_thread * 1e9
+
+    def observe_many():
+        for _ in range(per_thread):
+            histogram.observe(0.003, "GET", "/posts/", 200)
+
+    workers = [threading.Thread(target=observe_many) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    threaded_ns = (time.perf_counter() - started) / (per_thread * threads) * 1e9
+    total = sum(histogram.collect()[("GET", "/posts/", 200)][:-1])  # ทุกช่อง bucket (ช่องสุดท้ายคือ sum)
+    expected = per_thread * (threads + 1)
+    print(f"observe(): {single_ns:.0f} ns/op on one thread, {threaded_ns:.0f} ns/op across {threads} threads")
+    print(f"{'ok' if total == expected else 'FAIL'}: {total} of {expected} observations counted")
+
+    with temp_app() as (main, statements):
+        with Session(main.engine) as session:
+            seed_community(session, posts=50, comments_per_post=5)
+        routes = {"/categories/": [], "/posts/?limit=20&preview_comments=3": []}
+
+        async def run():
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                for url in routes:
+                    next_request = lambda url=url: ("GET", url, None)
+                    await _drive(client, next_request, requests, concurrency)  # warmup
+                    results = {False: [], True: []}
+                    for _ in range(rounds):
+                        for enabled in (False, True):
+                            main.registry.enabled = enabled
+                            latencies, errors, seconds = await _drive(client, next_request, requests, concurrency)
+                            assert not errors
+                            results[enabled].append(seconds / requests)
+                    off, on = statistics.median(results[False]), statistics.median(results[True])
+                    print(
+                        f"{url:<40} off {1 / off:>8.0f} req/s  on {1 / on:>8.0f} req/s  "
+                        f"overhead {(on - off) * 1e6:>+6.1f} µs/request ({(on - off) / off * 100:+.1f}%)"
+                    )
+            main.registry.enabled = True
+
+        asyncio.run(run())
+        started = time.perf_counter()
+        for _ in range(100):
+            body = main.registry.render()
+        print(f"render /metrics: {(time.perf_counter() - started) * 10:.2f} ms, {len(body)} bytes, {body.count(chr(10))} lines")
+
+
+def bench_serialize(products: int, repeat: int):
+    """GET /products/ ทั้งรายการ: ทางเดิม (ORM → ProductOut.model_validate → response_model → json) vs ทางใหม่ (คอลัมน์ดิบ → orjson)
+    แยกเวลาโหลดจาก DB กับเวลา encode, body ต้องเหมือนกันทุก byte, ขนาด/เวลาบีบอัดของแต่ละ encoding
+    แล้วยิงผ่าน app จริง: cold (cache ว่าง) กับ warm (cache hit) ของ identity / gzip / br
+    """
+    import json
+    import httpx
+    from pydantic import TypeAdapter
+    import responses
+
+    print(f"json encoder: {'orjson' if responses.orjson else 'json (stdlib)'}, brotli: {'yes' if responses.brotli else 'no'}")
+    with temp_app() as (main, statements):
+        from database import stream_all, stream_rows
+        from models import ProductOut
+
+        generate_dataset(main.engine, products=products, customers=100, orders=0, posts=0, comments=0, carts=0)
+        adapter = TypeAdapter(list[ProductOut])
+
+        async def load_models():
+            async with main.async_session() as session:
+                return [ProductOut.model_validate(p, from_attributes=True) for p in await stream_all(session, select(ProductDB))]
+
+        async def load_rows():
+            async with main.async_session() as session:
+                return await stream_rows(session, select(*ProductDB.__table__.columns))
+
+        def encode_models(models):
+            # response_model ตรวจ list อีกรอบ แล้ว JSONResponse ของ Starlette dumps
+            content = adapter.dump_python(adapter.validate_python(models), mode="json")
+            return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+
+        load_old_ms, models = _time(lambda: asyncio.run(load_models()), repeat)
+        load_new_ms, rows = _time(lambda: asyncio.run(load_rows()), repeat)
+        encode_old_ms, old_body = _time(lambda: encode_models(models), repeat)
+        encode_new_ms, new_body = _time(lambda: responses.dumps(rows), repeat)
+        print(f"{len(rows)} products")
+        print(f"{'':<28}{'load':>10}{'encode':>10}{'total':>10}")
+        print(f"{'ORM + model_validate':<28}{load_old_ms:>8.1f}ms{encode_old_ms:>8.1f}ms{load_old_ms + encode_old_ms:>8.1f}ms")
+        print(f"{'rows + fast encoder':<28}{load_new_ms:>8.1f}ms{encode_new_ms:>8.1f}ms{load_new_ms + encode_new_ms:>8.1f}ms")
+        print(f"{'ok' if json.loads(old_body) == json.loads(new_body) else 'FAIL'}: same JSON from both paths")
+
+        print(f"{'encoding':<10}{'bytes':>12}{'ratio':>8}{'compress':>11}")
+        print(f"{'identity':<10}{len(new_body):>12}{1:>8.2f}{'-':>11}")
+        for encoding in ("gzip", "br") if responses.brotli else ("gzip",):
+            compress_ms, body = _time(lambda: responses.compress(new_body, encoding), repeat)
+            print(f"{encoding:<10}{len(body):>12}{len(body) / len(new_body):>8.2f}{compress_ms:>9.1f}ms")
+
+        async def run():
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+                for encoding in ("identity", "gzip", "br") if responses.brotli else ("identity", "gzip"):
+                    cold, warm = [], []
+                    for _ in range(repeat):
+                        main.product_list_cache.invalidate("all")
+                        for samples in (cold, warm):
+                            started = time.perf_counter()
+                            response = await client.get("/products/", headers={"accept-encoding": encoding})
+                            samples.append((time.perf_counter() - started) * 1000)
+                            assert response.status_code == 200
+                    size = response.num_bytes_downloaded
+                    print(f"GET /products/ {encoding:<9} cold {statistics.median(cold):>8.1f}ms  warm {statistics.median(warm):>7.1f}ms  {size:>10} bytes on the wire")
+
+        asyncio.run(run())
+
+
+async def _asgi_get(app, url: str) -> tuple[int, int]:
+    """ยิง GET ตรงเข้า ASGI app แล้วทิ้ง body ทีละก้อน (httpx.ASGITransport เก็บ body ทั้งหมดไว้ → วัด memory ไม่ได้)
+    คืน (status, จำนวน byte)
+    """
+    path, _, query = url.partition("?")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": query.encode(), "root_path": "",
+        "headers": [(b"host", b"bench"), (b"accept-encoding", b"identity")], "server": ("bench", 80), "client": ("127.0.0.1", 1),
+    }
+    requested = False
+    never = asyncio.Event()
+    status, size = 0, 0
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await never.wait()  # client ไม่ตัดการเชื่อมต่อ
+
+    async def send(message):
+        nonlocal status, size
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            size += len(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status, size
+
+
+def check_export_memory(products: int, orders: int) -> bool:
+    """memory สูงสุด (tracemalloc) ของ /export/... ต้องไม่โตตามจำนวนแถว
+    export order ตามช่วงวันที่ที่กว้างขึ้นเรื่อยๆ (~1/12, ~1/3, ทั้งปี) ใน DB เดียว + GET /orders/ (stream เป็น JSON array แบบเดียวกัน)
+    ผ่านเมื่อ peak ของช่วงที่ใหญ่สุดไม่เกิน 2 เท่าของช่วงที่เล็กสุด
+    """
+    import tracemalloc
+    from datetime import datetime, timedelta
+
+    with temp_app() as (main, statements):
+        counts = generate_dataset(main.engine, products=products, customers=1000, orders=orders, posts=0, comments=0, carts=0)["counts"]
+        print(f"{counts['products']} products, {counts['orders']} orders, {counts['payments']} payments")
+        now = datetime.now()
+        urls = [f"/export/orders?created_from={(now - timedelta(days=days)).date()}" for days in (30, 120, 366)]
+        urls += ["/export/orders?format=csv", "/export/products", "/export/products?format=csv", "/export/payments", "/orders/"]
+
+        def measure(url):
+            tracemalloc.start()
+            started = time.perf_counter()
+            status, size = asyncio.run(_asgi_get(main.app, url))
+            seconds = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            assert status == 200, (url, status)
+            return size, seconds, peak
+
+        measure(urls[0])  # warmup: import / compile ของ route แรก ไม่นับ
+        print(f"{'url':<44}{'bytes':>12}{'seconds':>9}{'peak':>11}")
+        peaks = {}
+        for url in urls:
+            size, seconds, peak = measure(url)
+            peaks[url] = peak
+            print(f"{url:<44}{size:>12}{seconds:>9.2f}{peak / 1024:>9.0f}KB")
+
+    smallest, largest = peaks[urls[0]], peaks[urls[2]]
+    ok = largest <= smallest * 2
+    print(f"{'OK' if ok else 'FAIL'}: export peak {largest / 1024:.0f}KB for the whole year vs {smallest / 1024:.0f}KB for the last 30 days")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FIIT API benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    search_cmd = commands.add_parser("search", help="ilike scan vs FTS n-gram index")
+    search_cmd.add_argument("--products", type=int, default=200_000)
+    search_cmd.add_argument("--repeat", type=int, default=5)
+
+    coalesce_cmd = commands.add_parser("coalesce", help="SQL statements per burst of concurrent identical GETs")
+    coalesce_cmd.add_argument("--levels", type=int, nargs="+", default=[1, 10, 50, 200])
+
+    commands.add_parser("feed-queries", help="fail if GET /posts/ query count grows with the feed")
+
+    contention_cmd = commands.add_parser("contention", help="fail if one product can be ordered twice under concurrency")
+    contention_cmd.add_argument("--processes", type=int, default=4)
+    contention_cmd.add_argument("--threads", type=int, default=8)
+    contention_cmd.add_argument("--rounds", type=int, default=50)
+
+    sweep_cmd = commands.add_parser("sweep", help="time one reservation-expiry sweep")
+    sweep_cmd.add_argument("--orders", type=int, default=10_000)
+    sweep_cmd.add_argument("--items", type=int, default=2)
+
+    checkout_cmd = commands.add_parser("checkout", help="checkout throughput on a file-backed database")
+    checkout_cmd.add_argument("--orders", type=int, default=1000)
+    checkout_cmd.add_argument("--items", type=int, default=3)
+
+    event_loop_cmd = commands.add_parser("event-loop", help="req/s under concurrent clients and GET latency while writers wait on the lock, sync vs async session")
+    event_loop_cmd.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32])
+    event_loop_cmd.add_argument("--requests", type=int, default=50, help="requests per client")
+    event_loop_cmd.add_argument("--hold-ms", type=int, default=300)
+    event_loop_cmd.add_argument("--writers", type=int, default=5)
+    event_loop_cmd.add_argument("--readers", type=int, default=50)
+
+    profile_cmd = commands.add_parser("engine-profile", help="SQLite PRAGMA profiles under read-heavy and write-heavy load")
+    profile_cmd.add_argument("--products", type=int, default=50_000)
+    profile_cmd.add_argument("--threads", type=int, default=8)
+    profile_cmd.add_argument("--seconds", type=float, default=5)
+
+    commands.add_parser("query-plans", help="fail if a hot query falls back to a full table scan")
+
+    commands.add_parser("replicas", help="fail if GETs ignore replica freshness (SQLite file copy as the replica)")
+
+    load_cmd = commands.add_parser("load", help="throughput and p50/p95/p99 of the hot paths on a synthetic dataset")
+    load_cmd.add_argument("--scale", choices=DATASET_SCALES, default="small")
+    for table in DATASET_SCALES["small"]:
+        load_cmd.add_argument(f"--{table}", type=int, help=f"override the {table} count of --scale")
+    load_cmd.add_argument("--mode", choices=["inprocess", "http"], default="inprocess")
+    load_cmd.add_argument("--requests", type=int, default=200, help="measured requests per scenario")
+    load_cmd.add_argument("--concurrency", type=int, default=8)
+    load_cmd.add_argument("--warmup", type=int, default=20)
+    load_cmd.add_argument("--scenarios", nargs="+", default=["search_products", "get_all_posts", "get_cart", "get_order_item", "checkout"])
+    load_cmd.add_argument("--seed", type=int, default=411)
+    load_cmd.add_argument("--output", help="write the results as JSON")
+    load_cmd.add_argument("--baseline", help="JSON from an earlier run to compare against")
+
+    metrics_cmd = commands.add_parser("metrics-overhead", help="cost of the /metrics instrumentation per request and per scrape")
+    metrics_cmd.add_argument("--requests", type=int, default=500, help="requests per round")
+    metrics_cmd.add_argument("--concurrency", type=int, default=8)
+    metrics_cmd.add_argument("--rounds", type=int, default=5)
+    metrics_cmd.add_argument("--threads", type=int, default=8, help="threads for the observe() contention check")
+
+    serialize_cmd = commands.add_parser("serialize", help="full product list: encode time and bytes on the wire, old path vs fast encoder")
+    serialize_cmd.add_argument("--products", type=int, default=50_000)
+    serialize_cmd.add_argument("--repeat", type=int, default=5)
+
+    export_cmd = commands.add_parser("export", help="fail if /export/ peak memory grows with the number of rows")
+    export_cmd.add_argument("--products", type=int, default=50_000)
+    export_cmd.add_argument("--orders", type=int, default=50_000)
+
+    args = parser.parse_args()
+    if args.command == "search":
+        bench_search(args.products, args.repeat)
+    elif args.command == "coalesce":
+        bench_coalesce(args.levels)
+    elif args.command == "feed-queries":
+        sys.exit(0 if check_feed_queries() else 1)
+    elif args.command == "contention":
+        sys.exit(0 if check_contention(args.processes, args.threads, args.rounds) else 1)
+    elif args.command == "sweep":
+        bench_sweep(args.orders, args.items)
+    elif args.command == "checkout":
+        bench_checkout(args.orders, args.items)
+    elif args.command == "event-loop":
+        bench_event_loop(args.hold_ms, args.writers, args.readers, args.clients, args.requests)
+    elif args.command == "engine-profile":
+        bench_engine_profile(args.products, args.threads, args.seconds)
+    elif args.command == "query-plans":
+        sys.exit(0 if check_query_plans() else 1)
+    elif args.command == "replicas":
+        sys.exit(0 if check_replica_routing() else 1)
+    elif args.command == "load":
+        import json
+
+        dataset = {table: getattr(args, table) or count for table, count in DATASET_SCALES[args.scale].items()}
+        report = bench_load(dataset, args.mode, args.requests, args.concurrency, args.warmup, args.scenarios, args.seed)
+        report["scale"] = args.scale
+        baseline = None
+        if args.baseline:
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+        print_load_report(report, baseline)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+    elif args.command == "metrics-overhead":
+        bench_metrics_overhead(args.requests, args.concurrency, args.rounds, args.threads)
+    elif args.command == "serialize":
+        bench_serialize(args.products, args.repeat)
+    elif args.command == "export":
+        sys.exit(0 if check_export_memory(args.products, args.orders) else 1)
@@ -0,0 +1,109 @@
+import threading
+import time
+from collections import OrderedDict
+
+#Read-through cache (TTL + LRU) สำหรับข้อมูลที่อ่านบ่อยแต่เปลี่ยนน้อย เช่น สินค้า / category
+#ใครแก้ข้อมูลต้องเรียก invalidate เองหลัง commit
+
+
+class TTLCache:
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key → (expires_at, value) เรียงจากใช้ล่าสุดไว้ท้าย
+        self._lock = threading.Lock()
+        self._generation = 0        # เพิ่มทุกครั้งที่ invalidate กันไม่ให้ค่าเก่าที่โหลดค้างอยู่ถูกเขียนทับกลับมา
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """คืนค่าใน cache หรือ None ถ้าไม่มี/หมดอายุ"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                del self._data[key]  # หมดอายุ
+            self.misses += 1
+            return None
+
+    def get_or_load(self, key, loader):
+        """คืนค่าจาก cache ถ้ามี ไม่งั้นเรียก loader() แล้วเก็บไว้ (None ไม่ถูกเก็บ)"""
+        value = self.get(key)
+        if value is not None:
+            return value
+        return self.load(key, loader)
+
+    def load(self, key, loader):
+        """เรียก loader() แล้วเก็บผลลง cache โดยไม่ดู cache ก่อน (ใช้ต่อจาก get() ที่ miss)"""
+        generation = self._generation
+        value = loader()
+        self._put(key, value, generation)
+        return value
+
+    async def get_or_load_async(self, key, loader):
+        """get_or_load สำหรับ loader ที่เป็น async function"""
+        value = self.get(key)
+        if value is not None:
+            return value
+        return await self.load_async(key, loader)
+
+    async def load_async(self, key, loader):
+        generation = self._generation
+        value = await loader()
+        self._put(key, value, generation)
+        return value
+
+    def _put(self, key, value, generation):
+        if value is None:
+            return
+        with self._lock:
+            if generation == self._generation:
+                self._data[key] = (time.monotonic() + self.ttl, value)
+                self._data.move_to_end(key)
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+                    self.evictions += 1
+
+    def invalidate(self, *keys):
+        """ลบ key ที่ระบุ หรือล้างทั้งหมดถ้าไม่ระบุ key"""
+        with self._lock:
+            self._generation += 1
+            if not keys:
+                self._data.clear()
+            for key in keys:
+                self._data.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+product_cache = TTLCache("product", maxsize=10_000, ttl=60)
+product_list_cache = TTLCache("product_list", maxsize=1, ttl=30)
+category_cache = TTLCache("categories", maxsize=1, ttl=3600)  # category แทบไม่เคยเปลี่ยน
+
+ALL_CACHES = (product_cache, product_list_cache, category_cache)
+
+
+def invalidate_products(*product_ids):
+    """เรียกหลัง commit ทุกครั้งที่สินค้าเปลี่ยน (ข้อมูลหรือ product_status)"""
+    product_cache.invalidate(*product_ids)
+    product_list_cache.invalidate()
+
+
+def cache_stats() -> dict:
+    return {cache.name: cache.stats() for cache in ALL_CACHES}
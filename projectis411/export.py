@@ -0,0 +1,119 @@
+import csv
+import io
+from datetime import datetime
+from enum import Enum
+from sqlmodel import select
+from starlette.responses import StreamingResponse
+from database import async_session, stream_batches
+from models import ExportFormat, OrderDB, OrderItemDB, PaymentDB, ProductDB
+from replicas import read_session
+from responses import dumps
+
+#export ทั้งตาราง (สินค้า / order / payment) สำหรับงาน analytics และเครื่องมือของ seller
+#ไม่โหลดทั้งตารางขึ้นมาก่อนเหมือน GET /products/ ฯลฯ: อ่านทีละ STREAM_BATCH_SIZE แถว (yield_per = server-side cursor)
+#→ encode เป็น NDJSON/CSV → ส่งออก → ค่อยอ่านก้อนถัดไป  memory สูงสุด = batch เดียว ไม่ว่าตารางจะใหญ่แค่ไหน
+#client อ่านช้า send ก็รอ (ไม่กองไว้ใน memory) / client ตัดกลางทาง generator ถูกปิด session ก็ปิดตาม
+#อ่านจาก replica ได้ (read_session) — SQLite: transaction อ่านค้างตลอด export คนเขียนไม่ติด (WAL) แต่ checkpoint รอจนจบ
+#json_array_response: แบบเดียวกันแต่เป็น JSON array ปกติ สำหรับ GET /orders/, /payments/, /customers/ (ผลเหมือน list เดิมทุก byte)
+
+MEDIA_TYPES = {ExportFormat.NDJSON: "application/x-ndjson", ExportFormat.CSV: "text/csv"}
+
+
+def _csv_value(value):
+    if isinstance(value, Enum):
+        return value.value  # str(OrderStatus.paid) = "OrderStatus.paid"
+    if isinstance(value, datetime):
+        return value.isoformat()  # ให้ตรงกับ NDJSON / GET /orders/
+    return value
+
+
+def _encode_ndjson(rows) -> bytes:
+    return b"".join(dumps(dict(row)) + b"\n" for row in rows)
+
+
+def _encode_csv(rows) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([_csv_value(value) for value in row] for row in rows)
+    return buffer.getvalue().encode()
+
+
+async def _stream(statement, format: ExportFormat):
+    async with read_session() as session:
+        if format == ExportFormat.CSV:
+            yield _encode_csv([[column.name for column in statement.selected_columns]])  # แถวหัวตาราง = ชื่อคอลัมน์
+        async for rows in stream_batches(session, statement):
+            yield _encode_csv([row.values() for row in rows]) if format == ExportFormat.CSV else _encode_ndjson(rows)
+
+
+async def _stream_json_array(statement):
+    # session ของตัวเอง: generator ทำงานต่อหลัง handler return ไปแล้ว
+    async with async_session() as session:
+        yield b"["
+        separator = b""
+        async for rows in stream_batches(session, statement):
+            yield separator + b",".join(dumps(dict(row)) for row in rows)
+            separator = b","
+        yield b"]"
+
+
+def json_array_response(statement) -> StreamingResponse:
+    """JSON array ของทุกแถวใน statement (select คอลัมน์ให้ตรงกับ response model) ส่งทีละ batch ไม่ต้องโหลดทั้งตาราง"""
+    return StreamingResponse(_stream_json_array(statement), media_type="application/json")
+
+
+def export_response(statement, format: ExportFormat, name: str) -> StreamingResponse:
+    """StreamingResponse ของ statement (select คอลัมน์ เรียงตาม primary key) เป็นไฟล์แนบ name-เวลา.ndjson/.csv"""
+    filename = f"{name}-{datetime.now():%Y%m%d-%H%M%S}.{format.value}"
+    return StreamingResponse(
+        _stream(statement, format),
+        media_type=MEDIA_TYPES[format],
+        headers={"content-disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+def order_filters(created_from: datetime | None, created_to: datetime | None, seller_id: int | None) -> list:
+    """เงื่อนไขบน OrderDB: created_from <= created_at < created_to, มีสินค้าของ seller_id อย่างน้อยหนึ่งชิ้น"""
+    conditions = []
+    if created_from is not None:
+        conditions.append(OrderDB.created_at >= created_from)
+    if created_to is not None:
+        conditions.append(OrderDB.created_at < created_to)
+    if seller_id is not None:
+        conditions.append(
+            select(OrderItemDB.orderitem_id)
+            .join(ProductDB, ProductDB.product_id == OrderItemDB.product_id)
+            .where(OrderItemDB.order_id == OrderDB.order_id, ProductDB.seller_id == seller_id)
+            .exists()
+        )
+    return conditions
+
+
+def products_query(seller_id: int | None, product_status: str | None, category_id: int | None):
+    statement = select(*ProductDB.__table__.columns)
+    if seller_id is not None:
+        statement = statement.where(ProductDB.seller_id == seller_id)
+    if product_status is not None:
+        statement = statement.where(ProductDB.product_status == product_status)
+    if category_id is not None:
+        statement = statement.where(ProductDB.categoryID == category_id)
+    return statement.order_by(ProductDB.product_id)
+
+
+def orders_query(created_from: datetime | None, created_to: datetime | None, seller_id: int | None, order_status: str | None, cus_id: int | None):
+    statement = select(*OrderDB.__table__.columns).where(*order_filters(created_from, created_to, seller_id))
+    if order_status is not None:
+        statement = statement.where(OrderDB.order_status == order_status)
+    if cus_id is not None:
+        statement = statement.where(OrderDB.cus_id == cus_id)
+    return statement.order_by(OrderDB.order_id)
+
+
+def payments_query(created_from: datetime | None, created_to: datetime | None, seller_id: int | None, payment_method: str | None):
+    """payment ของ order ที่ผ่าน order_filters (ช่วงวันที่ = วันที่สร้าง order — payment_date เป็น str ที่ client ส่งมา)"""
+    statement = select(*PaymentDB.__table__.columns)
+    conditions = order_filters(created_from, created_to, seller_id)
+    if conditions:
+        statement = statement.join(OrderDB, OrderDB.order_id == PaymentDB.order_id).where(*conditions)
+    if payment_method is not None:
+        statement = statement.where(PaymentDB.payment_method == payment_method)
+    return statement.order_by(PaymentDB.payment_id)
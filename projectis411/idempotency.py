@@ -0,0 +1,185 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, delete
+from database import engine
+from models import IdempotencyKeyDB
+
+#Idempotency-Key: client ที่ retry POST (เช่น mobile ที่ timeout) ส่ง header เดิมมา
+#→ ได้ response เดิมกลับไปจากตาราง idempotencykeydb โดยไม่ทำ logic ซ้ำ (ไม่เกิด order/payment ซ้ำ)
+#request ที่ไม่มี header นี้ทำงานเหมือนเดิมทุกอย่าง
+
+IDEMPOTENCY_HEADER = "idempotency-key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+IDEMPOTENCY_TTL = float(os.environ.get("FIIT_IDEMPOTENCY_TTL", "86400"))  # วินาที เก็บผลไว้นานเท่านี้
+IN_PROGRESS_WAIT = 10.0  # request ซ้ำที่มาระหว่างตัวแรกยังทำงาน รอผลได้นานสุดกี่วินาที
+POLL_INTERVAL = 0.05
+MAX_KEY_LENGTH = 255
+
+#endpoint ที่รองรับ (method, path regex)
+IDEMPOTENT_ROUTES = [
+    ("POST", re.compile(r"^/create-order/$")),
+    ("POST", re.compile(r"^/orders/checkout/[^/]+$")),
+    ("POST", re.compile(r"^/payments/$")),
+]
+
+
+def _json_response(status_code: int, detail: str):
+    return status_code, "application/json", json.dumps({"detail": detail}).encode()
+
+
+def _lookup(key: str, route: str) -> IdempotencyKeyDB | None:
+    """อ่านด้วย primary key ครั้งเดียว — ของที่หมดอายุแล้วถือว่าไม่มี"""
+    with Session(engine) as session:
+        record = session.get(IdempotencyKeyDB, (key, route))
+    if record is not None and record.expires_at <= datetime.now():
+        return None
+    return record
+
+
+def _claim(key: str, route: str, request_hash: str) -> bool:
+    """จองว่า request นี้เป็นตัวที่ได้ทำงานจริง — INSERT ได้คนเดียว คนอื่นชน primary key"""
+    now = datetime.now()
+    with Session(engine) as session:
+        # key เดิมที่หมดอายุแล้วลบทิ้งก่อน ให้ใช้ซ้ำได้
+        session.exec(
+            delete(IdempotencyKeyDB).where(
+                IdempotencyKeyDB.key == key, IdempotencyKeyDB.route == route, IdempotencyKeyDB.expires_at <= now
+            )
+        )
+        session.add(IdempotencyKeyDB(
+            key=key, route=route, request_hash=request_hash, created_at=now,
+            expires_at=now + timedelta(seconds=IDEMPOTENCY_TTL),
+        ))
+        try:
+            session.commit()
+            return True
+        except IntegrityError:
+            session.rollback()
+            return False
+
+
+def _store(key: str, route: str, status_code: int, content_type: str | None, body: bytes):
+    with Session(engine) as session:
+        record = session.get(IdempotencyKeyDB, (key, route))
+        record.status_code = status_code
+        record.content_type = content_type
+        record.response_body = body
+        session.add(record)
+        session.commit()
+
+
+def _release(key: str, route: str):
+    """request แรกพัง (5xx/exception) → ลบ key ให้ retry รอบหน้าทำงานใหม่ได้"""
+    with Session(engine) as session:
+        session.exec(delete(IdempotencyKeyDB).where(IdempotencyKeyDB.key == key, IdempotencyKeyDB.route == route))
+        session.commit()
+
+
+def purge_expired_keys(now: datetime | None = None) -> int:
+    """ลบผลที่หมดอายุแล้ว (sweeper เรียกเป็นระยะ) ใช้ index ของ expires_at"""
+    with Session(engine) as session:
+        deleted = session.exec(delete(IdempotencyKeyDB).where(IdempotencyKeyDB.expires_at <= (now or datetime.now()))).rowcount
+        session.commit()
+    return deleted
+
+
+class IdempotencyMiddleware:
+    """ASGI middleware สำหรับ endpoint ใน IDEMPOTENT_ROUTES
+
+    - key ใหม่: จอง key → เรียก endpoint ตามปกติ → เก็บ status/body ไว้ (5xx ไม่เก็บ ให้ retry ได้)
+    - key ที่มีผลแล้ว: ส่งผลเดิมกลับจากการอ่าน primary key ครั้งเดียว + header Idempotent-Replayed
+    - key ที่ request แรกยังทำงานอยู่ (ยิงซ้ำพร้อมกัน): รอผลของตัวแรก ไม่ทำซ้ำ เกิน IN_PROGRESS_WAIT → 409
+    - key เดิมแต่ body ต่างจากเดิม → 422
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not any(
+            scope["method"] == method and pattern.match(scope["path"]) for method, pattern in IDEMPOTENT_ROUTES
+        ):
+            return await self.app(scope, receive, send)
+
+        key = dict(scope["headers"]).get(IDEMPOTENCY_HEADER.encode(), b"").decode("latin-1").strip()
+        if not key:
+            return await self.app(scope, receive, send)
+        if len(key) > MAX_KEY_LENGTH:
+            return await self._respond(send, *_json_response(400, "Idempotency-Key too long"))
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        route = f"{scope['method']} {scope['path']}"
+        request_hash = hashlib.sha256(body).hexdigest()
+
+        # helper เป็น sync (engine ตัว sync) → รันใน thread ไม่บล็อก event loop
+        record = await asyncio.to_thread(_lookup, key, route)
+        if record is None and await asyncio.to_thread(_claim, key, route, request_hash):
+            return await self._run(scope, body, send, key, route)
+        return await self._replay(send, key, route, request_hash, record)
+
+    async def _run(self, scope, body, send, key, route):
+        sent_body = False
+        response = {"status": 500, "content_type": None, "body": b""}
+
+        async def replay_receive():
+            nonlocal sent_body
+            if sent_body:
+                return {"type": "http.disconnect"}
+            sent_body = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["content_type"] = dict(message.get("headers", [])).get(b"content-type", b"").decode() or None
+            elif message["type"] == "http.response.body":
+                response["body"] += message.get("body", b"")
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        except Exception:
+            await asyncio.to_thread(_release, key, route)
+            raise
+        if response["status"] >= 500:
+            await asyncio.to_thread(_release, key, route)
+        else:
+            await asyncio.to_thread(_store, key, route, response["status"], response["content_type"], response["body"])
+
+    async def _replay(self, send, key, route, request_hash, record):
+        waited = 0.0
+        while record is None or record.status_code is None:
+            if record is not None and record.request_hash != request_hash:
+                break
+            if waited >= IN_PROGRESS_WAIT:
+                return await self._respond(send, *_json_response(409, "A request with this Idempotency-Key is still in progress"))
+            await asyncio.sleep(POLL_INTERVAL)
+            waited += POLL_INTERVAL
+            record = await asyncio.to_thread(_lookup, key, route)
+            if record is None:
+                # request แรกพังแล้วปล่อย key ทิ้ง (หรือหมดอายุ) → ให้ client retry ใหม่เอง ไม่แย่งทำแทน
+                return await self._respond(send, *_json_response(409, "The original request failed, please retry"))
+
+        if record.request_hash != request_hash:
+            return await self._respond(send, *_json_response(422, "Idempotency-Key was already used with a different request"))
+        await self._respond(send, record.status_code, record.content_type, record.response_body or b"", replayed=True)
+
+    @staticmethod
+    async def _respond(send, status_code: int, content_type: str | None, body: bytes, replayed: bool = False):
+        headers = [(b"content-length", str(len(body)).encode())]
+        if content_type:
+            headers.append((b"content-type", content_type.encode()))
+        if replayed:
+            headers.append((REPLAYED_HEADER.lower().encode(), b"true"))
+        await send({"type": "http.response.start", "status": status_code, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
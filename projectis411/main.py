@@ -1,12 +1,66 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+from collections import defaultdict
+from contextlib import asynccontextmanager, suppress
 from datetime import datetime
-from fastapi import FastAPI, HTTPException
-from sqlmodel import SQLModel, Session, select, or_, func
-from database import engine, init_db
-from models import (ProductDB, Product, ProductOut, ProductSearchRequest, SortBy,  OrderDB, OrderOut, OrderCreate, OrderStatus, OrderItemDB, PaymentDB, Payment, PaymentOut, CustomerDB, Customer, CustomerOut, SellerDB, Seller, SellerOut, CategoryDB, CartItemDB, CartItemCreate, CustomerDB, PostDB, Post, PostOut, CommentDB, Comment, CommentOut,SigninRequest)
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse
+from sqlmodel import SQLModel, Session, select, func, update, insert, delete
+from sqlalchemy import false
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import aliased
+from sqlmodel.ext.asyncio.session import AsyncSession
+from database import engine, init_db, fetch_in, async_session, async_write_session, get_session, async_engine, run_analyzer, ANALYZE_INTERVAL, stream_all, stream_rows, is_retryable_lock_error, IN_CHUNK_SIZE
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, paginate, set_next_cursor
+from search import init_search_index, index_product, match_subquery, tag_filter, compute_facets
+from suggest import TOP_K, suggest_index
+from cache import ALL_CACHES, product_cache, product_list_cache, category_cache, invalidate_products, cache_stats
+from singleflight import SingleFlight
+from sweeper import SWEEP_INTERVAL, run_sweeper, sweep_stats
+from idempotency import REPLAYED_HEADER, IdempotencyMiddleware
+from replicas import REPLICA_URLS, get_read_session, read_session, replica_router, run_replica_monitor
+from profiling import PROFILE_ENABLED, ProfilingMiddleware, instrument_engines
+from responses import CompressionMiddleware, EncodedJSON, FastJSONResponse
+from export import export_response, json_array_response, orders_query, payments_query, products_query
+from metrics import CHECKOUTS, CONTENT_TYPE, ORDERS_CREATED, PAYMENTS, RESERVATION_CONFLICTS, MetricsMiddleware, registry, track_pools, track_stats
+from models import (ProductDB, Product, ProductOut, ProductSearchRequest, SortBy, TotalMode, ExportFormat, OrderDB, OrderOut, OrderCreate, OrderStatus, OrderItemDB, PaymentDB, Payment, PaymentOut, CustomerDB, Customer, CustomerOut, SellerDB, Seller, SellerOut, CategoryDB, CartItemDB, CartItemCreate, CustomerDB, PostDB, Post, PostOut, CommentDB, Comment, CommentOut,SigninRequest)
 from fastapi.middleware.cors import CORSMiddleware
 
+#log ของ app อยู่ใต้ logger "fiit" — FIIT_LOG_LEVEL=DEBUG เห็นของที่ handler โหลดจาก DB ด้วย / WARNING เหลือแค่ request ที่ช้า (ดู profiling.py)
+#library อื่น (httpx ฯลฯ) ให้เหลือแค่ WARNING ตาม root
+logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s %(message)s")
+logger = logging.getLogger("fiit")
+logger.setLevel(os.environ.get("FIIT_LOG_LEVEL", "INFO").upper())
+
 init_db()
-app = FastAPI()
+init_search_index()
+with Session(engine) as _session:
+    suggest_index.load(_session)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    #ยกเลิก order pending ที่หมดเวลาจอง (ดู sweeper.py)
+    sweeper = asyncio.create_task(run_sweeper()) if SWEEP_INTERVAL > 0 else None
+    #อัปเดตสถิติให้ query planner ของ SQLite เป็นระยะ (ดู analyze_database)
+    analyzer = asyncio.create_task(run_analyzer()) if ANALYZE_INTERVAL > 0 else None
+    #เขียน heartbeat + วัด lag ของ read replica (ดู replicas.py)
+    replica_monitor = asyncio.create_task(run_replica_monitor()) if REPLICA_URLS else None
+    yield
+    for task in (sweeper, analyzer, replica_monitor):
+        if task:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+    await replica_router.dispose()
+    await async_engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
+
+#retry ที่ส่ง Idempotency-Key เดิมมา ได้ response เดิมโดยไม่สร้าง order/payment ซ้ำ (ต้องอยู่ใน CORS ให้ replay มี header CORS ด้วย)
+app.add_middleware(IdempotencyMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -14,8 +68,55 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"], # อนุญาตทุก Method (รวมถึง OPTIONS ที่ทำให้เกิด 405)
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, REPLAYED_HEADER], # ให้หน้าเว็บอ่าน cursor หน้าถัดไป / รู้ว่าเป็นผลที่ส่งซ้ำได้
 )
 
+#gzip/brotli ให้ response ใหญ่ๆ ตาม Accept-Encoding (ดู responses.py)
+app.add_middleware(CompressionMiddleware)
+
+#เวลา/status ของทุก request สำหรับ GET /metrics (ดู metrics.py)
+app.add_middleware(MetricsMiddleware)
+
+#FIIT_PROFILE=1: log เวลา/จำนวน SQL ทุก request + header Server-Timing (ใส่ทีหลังสุด = ตัวนอกสุด วัดรวม middleware อื่นด้วย)
+if PROFILE_ENABLED:
+    instrument_engines(engine, async_engine.sync_engine, *(replica.engine.sync_engine for replica in replica_router.replicas))
+    app.add_middleware(ProfilingMiddleware)
+
+APPROX_TOTAL_CAP = 1000 # total_mode=approximate นับไม่เกินเท่านี้
+
+#รอ write lock เกิน LOCK_TIMEOUT → 503 + Retry-After แบบสุ่ม ให้ client ไม่ยิงซ้ำพร้อมกันทั้งก้อน
+@app.exception_handler(DBAPIError)
+async def database_busy(request: Request, exc: DBAPIError):
+    if not is_retryable_lock_error(exc):
+        raise exc
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Database busy, please retry"},
+        headers={"Retry-After": str(random.randint(1, 3))},
+    )
+
+#request ที่อ่านสินค้า/โพสต์เดียวกันพร้อมกัน ใช้ผล query ก้อนเดียวกัน (เปิด/ปิดแต่ละ route ด้วย FIIT_COALESCE_ROUTES ดู singleflight.py)
+product_flight = SingleFlight("GET /products/{product_id}")
+post_flight = SingleFlight("GET /posts/{post_id}")
+
+#ตัวเลขที่นับไว้อยู่แล้ว อ่านสดตอน GET /metrics
+track_pools({"sync": engine, "async": async_engine, **{f"replica{i}": r.engine for i, r in enumerate(replica_router.replicas)}})
+track_stats("fiit_cache", "cache", {cache.name: cache for cache in ALL_CACHES}, {
+    "hits": ("counter", "Cache lookups served from memory"),
+    "misses": ("counter", "Cache lookups that went to the loader"),
+    "evictions": ("counter", "Entries dropped to stay under maxsize"),
+    "size": ("gauge", "Entries currently cached"),
+})
+track_stats("fiit_singleflight", "route", {flight.route: flight for flight in (product_flight, post_flight)}, {
+    "calls": ("counter", "Loads that went to the database"),
+    "shared": ("counter", "Requests that reused a concurrent load"),
+})
+track_stats("fiit_sweeper", None, {"sweeper": sweep_stats}, {
+    "orders_cancelled": ("counter", "Pending orders cancelled after the reservation TTL"),
+    "products_released": ("counter", "Products of expired orders made available again"),
+    "errors": ("counter", "Sweeper runs that failed"),
+})
+
 #Product
 RUN_SEED_DATA = True #ตอนจะinsertค่อยเปลี่ยนเป็นTrue #เป็น flag variable
 #เพิ่มสินค้าใหม่
@@ -54,12 +155,16 @@ def insert_product():
         product_status= "reserved"
     )
 
+    products = [product_1, product_2, product_3]
     with Session(engine) as session:
-        session.add(product_1)
-        session.add(product_2)
-        session.add(product_3)
+        session.add_all(products)
+        session.flush()  # ได้ product_id ก่อนเอาไปลง search index
+        for product in products:
+            index_product(session, product)
         session.commit()
-        print("✅ Inserted products successfully!")
+        for product in products:  # autocomplete หลัง commit สำเร็จ (เหมือน create_product)
+            suggest_index.add_product(product)
+    print("✅ Inserted products successfully!")
 
 #เพิ่มประเภทของ category
 def insert_categories():
@@ -87,105 +192,185 @@ if __name__ == "__main__":
 
 @app.get("/categories/")
 async def get_all_categories():
-    with Session(engine) as session:
-        categories = session.exec(select(CategoryDB)).all()
-        return categories
+    return await category_cache.get_or_load_async("all", load_categories)
+
+async def load_categories():
+    async with async_session() as session:
+        categories = (await session.exec(select(CategoryDB))).all()
+        return [c.model_dump() for c in categories]
+
+#ดูสถิติ cache (hit / miss)
+@app.get("/cache/stats")
+async def get_cache_stats():
+    return cache_stats()
 
 
 #post product
+@app.get("/sweeper/stats")
+async def get_sweeper_stats():
+    return sweep_stats.stats()
+
+@app.get("/replicas/stats")
+async def get_replica_stats():
+    return replica_router.stats()
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text format"""
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
 @app.post("/products/")
-async def create_product(product: Product) -> ProductOut:
-    with Session(engine) as session:
-        db_product = ProductDB(
-            pname=product.pname,
-            price=product.price,
-            brand=product.brand,
-            description=product.description,
-            categoryID=product.categoryID,
-            seller_id=product.seller_id,
-            tags=product.tags,
-            product_status=product.product_status,
-            image_url=product.image_url
-        )
-        session.add(db_product)
-        session.commit()
-        session.refresh(db_product)
-        return db_product
+async def create_product(product: Product, session: AsyncSession = Depends(get_session)) -> ProductOut:
+    db_product = ProductDB(
+        pname=product.pname,
+        price=product.price,
+        brand=product.brand,
+        description=product.description,
+        categoryID=product.categoryID,
+        seller_id=product.seller_id,
+        tags=product.tags,
+        product_status=product.product_status,
+        image_url=product.image_url
+    )
+    session.add(db_product)
+    await session.flush()  # ได้ product_id ก่อนเอาไปลง search index
+    await session.run_sync(index_product, db_product)
+    await session.commit()
+    invalidate_products(db_product.product_id)
+    suggest_index.add_product(db_product)
+    return db_product
 
 #อัพเดตรูปสินค้าที่มีอยู่แล้ว (ได้แค่รูปเดียว)
 @app.patch("/products/{product_id}/image")
-async def update_product_image(product_id: int, image_url: str):
-    with Session(engine) as session:
-        product = session.get(ProductDB, product_id)
-        if not product:
-            raise HTTPException(status_code=404, detail="Product not found")
-        product.image_url = image_url
-        session.add(product)
-        session.commit()
-        session.refresh(product)
-        return {"image_url": product.image_url}
+async def update_product_image(product_id: int, image_url: str, session: AsyncSession = Depends(get_session)):
+    product = await session.get(ProductDB, product_id)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    product.image_url = image_url
+    session.add(product)
+    await session.commit()
+    invalidate_products(product_id)
+    return {"image_url": product.image_url}
+
+#autocomplete ช่องค้นหา (ต้องประกาศก่อน /products/{product_id} ไม่งั้นโดนจับเป็น product_id)
+@app.get("/products/suggest")
+async def suggest_products(q: str, limit: int = Query(TOP_K, ge=1, le=TOP_K)):
+    return {"query": q, "suggestions": suggest_index.suggest(q, limit)}
 
 #endpoints ดึงสินค้าตามid
 @app.get("/products/{product_id}")
 async def Get_product_by_ID(product_id: int) -> ProductOut:
-    with Session(engine) as s:
-        statement = select(ProductDB).where(ProductDB.product_id == product_id)
-        product = s.exec(statement).first()
-       
-        if product != None:
-            print(product)
-            return product
-       
+    product = product_cache.get(product_id)
+    if product == None:
+        product = await product_flight.do(
+            product_id, lambda: product_cache.load_async(product_id, lambda: load_product(product_id))
+        )
+    if product != None:
+        return product
+
     raise HTTPException(
         status_code=404,
         detail="Product not found"
     )
+
+async def load_product(product_id: int) -> ProductOut | None:
+    async with async_session() as s:
+        statement = select(ProductDB).where(ProductDB.product_id == product_id)
+        product = (await s.exec(statement)).first()
+
+        if product != None:
+            logger.debug("loaded product %s", product)
+            return ProductOut.model_validate(product, from_attributes=True)
+    return None
+
 #endpoint ดึงสินค้าทั้งหมด
 @app.get("/products/")
-async def get_all_products() -> list[ProductOut]:
-    """Get all products from database"""
-    with Session(engine) as session:
+async def get_all_products(
+    request: Request,
+    response: Response,
+    limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
+) -> list[ProductOut]:
+    """Get all products from database
+
+    ส่ง limit/cursor มา = แบ่งหน้าแบบ cursor (หน้าถัดไปอยู่ใน header X-Next-Cursor)
+    """
+    if limit is None and cursor is None:
+        #รายการทั้งหมดอ่านจาก primary: โหลดใหม่หลัง invalidate_products ถ้าอ่าน replica ที่ยังตามไม่ทัน จะได้ของเก่าค้างใน cache ไปทั้ง TTL
+        #cache เก็บ JSON ที่ encode (และบีบอัด) แล้ว — hit ส่ง bytes เดิมได้เลย (จึงต้องมีทั้งก้อนใน memory ไม่ stream แบบ /orders/)
+        products = await product_list_cache.get_or_load_async("all", load_all_products)
+        return await products.response(request)
+
+    async with read_session() as session:
         statement = select(ProductDB)
-        products = session.exec(statement).all()
+        products, next_cursor = await session.run_sync(
+            paginate, statement, [(ProductDB.product_id, False)], limit or DEFAULT_PAGE_SIZE, cursor, "products"
+        )
+        set_next_cursor(response, next_cursor)
         return products
 
+async def load_all_products() -> EncodedJSON:
+    async with async_session() as session:
+        # คอลัมน์ของ ProductDB = field ของ ProductOut พอดี ไม่ต้อง validate ทีละแถว
+        return EncodedJSON(await stream_rows(session, select(*ProductDB.__table__.columns)))
+
 
 #อัพเดตข้อมูลสินค้า
 @app.put("/products/{product_id}")
-async def update_product(product_id: int, new_product: Product):
-    with Session(engine) as session:
-        product = session.get(ProductDB, product_id)
+async def update_product(product_id: int, new_product: Product, session: AsyncSession = Depends(get_session)):
+    product = await session.get(ProductDB, product_id)
 
-        if (product != None):
-            product.pname = new_product.pname
-            #อยากอัพอันไหน ใส่ข้อมูลอันนั้น กันหาย
+    if (product != None):
+        old_entries = suggest_index.product_entries(product)  # ค่าเดิมใน autocomplete ไว้เอาออกหลัง commit
+        product.pname = new_product.pname
+        #อยากอัพอันไหน ใส่ข้อมูลอันนั้น กันหาย
 
-            session.add(product)
-            session.commit()
-            session.refresh(product)
-            return {"message"  : "Product update succesfully"}
+        session.add(product)
+        await session.run_sync(index_product, product)
+        await session.commit()
+        invalidate_products(product_id)
+        suggest_index.replace_product(old_entries, product)
+        return {"message"  : "Product update succesfully"}
 
-        raise HTTPException(
-            status_code=404,
-            detail="Product not found"
-        )
+    raise HTTPException(
+        status_code=404,
+        detail="Product not found"
+    )
 
 ###Order
+def product_not_available() -> HTTPException:
+    """409 ตอนแย่งซื้อสินค้าชิ้นเดียวกันไม่ทัน (นับลง /metrics ด้วย)"""
+    RESERVATION_CONFLICTS.inc()
+    return HTTPException(status_code=409, detail="Product not available")
+
 #สร้าง order พร้อม orderitem + คำนวณ total price
 def validate_product_for_order(product: ProductDB, item_qty: int):
     if product.product_status != "available":
-        raise HTTPException(status_code=400, detail="Product not available")
+        raise product_not_available()
 
     if product.price is None or product.price <= 0:
         raise HTTPException(status_code=400, detail="Invalid product price")
 
     return True
 
-def process_order_logic(session, cus_id, items_to_process, shipping_cost):
-    total_price = 0
+def process_order_logic(session, cus_id, items_to_process, shipping_cost, product_status="reserved"):
+    """สร้าง order + order items แล้วจองสินค้า ด้วยจำนวน statement คงที่ไม่ว่าจะมีกี่ชิ้น
+
+    ดึงสินค้าครั้งเดียว → insert order → insert order items ทีเดียว → UPDATE สถานะทีเดียว
+    UPDATE มีเงื่อนไข product_status = 'available' ถ้าจำนวนแถวที่เปลี่ยนไม่ครบ = มีคนตัดหน้าไปแล้ว
+    """
+    product_ids = [item.product_id for item in items_to_process]
+    if len(set(product_ids)) != len(product_ids):
+        raise HTTPException(status_code=400, detail="Duplicate product in order")
 
+    # ← ดึงสินค้าทั้งหมดทีเดียว
+    products = {p.product_id: p for p in fetch_in(session, ProductDB, ProductDB.product_id, product_ids)}
+
+    total_price = 0
     for item in items_to_process:
-        product = session.get(ProductDB, item.product_id)
+        product = products.get(item.product_id)
+        if product is None:
+            raise HTTPException(status_code=404, detail="Product not found")
         validate_product_for_order(product, item.qty)
         total_price += product.price * item.qty
 
@@ -200,162 +385,190 @@ def process_order_logic(session, cus_id, items_to_process, shipping_cost):
     session.add(new_order)
     session.flush()  # ได้ order_id ก่อน commit
 
-    # ← สร้าง order items
-    for item in items_to_process:
-        product = session.get(ProductDB, item.product_id)
-        order_item = OrderItemDB(
-            order_id=new_order.order_id,
-            product_id=item.product_id,
-            qty=item.qty,
-            price=product.price
-        )
-        session.add(order_item)
-        product.product_status = "reserved"
-        session.add(product)
+    if not product_ids:
+        return new_order  # ไม่มีสินค้า (items: []) = order เปล่าแบบเดิม — insert ด้วย list ว่างจะกลายเป็น INSERT ... DEFAULT VALUES
+
+    # ← สร้าง order items (insert ทีเดียว)
+    session.execute(insert(OrderItemDB), [
+        {
+            "order_id": new_order.order_id,
+            "product_id": item.product_id,
+            "qty": item.qty,
+            "price": products[item.product_id].price,
+        }
+        for item in items_to_process
+    ])
+
+    # ← จองสินค้าทั้งหมดด้วย UPDATE เดียว
+    reserve_products(session, product_ids, product_status)
 
     return new_order  # ← return กลับไปให้ checkout
 
+def reserve_products(session, product_ids, product_status="reserved"):
+    """เปลี่ยนสถานะสินค้าที่ยัง available ทั้งหมดในคำสั่งเดียว — ถ้าได้ไม่ครบทุกชิ้นคือแพ้ → 409
+
+    ต้องเรียกใน async_write_session() (BEGIN IMMEDIATE) สินค้าแต่ละชิ้นมีชิ้นเดียว จึงมีผู้ชนะได้คนเดียวเสมอ
+    Postgres: lock แถวที่ยังว่างก่อนด้วย SKIP LOCKED — ชิ้นที่คนอื่นกำลังจองอยู่ถูกข้าม แพ้ทันทีไม่ต้องรอ transaction นั้นจบ
+    """
+    if session.get_bind().dialect.name == "postgresql":
+        locked = session.exec(
+            select(ProductDB.product_id)
+            .where(ProductDB.product_id.in_(product_ids), ProductDB.product_status == "available")
+            .with_for_update(skip_locked=True)
+        ).all()
+        if len(locked) != len(product_ids):
+            raise product_not_available()
+    result = session.exec(
+        update(ProductDB)
+        .where(ProductDB.product_id.in_(product_ids), ProductDB.product_status == "available")
+        .values(product_status=product_status)
+    )
+    if result.rowcount != len(product_ids):
+        raise product_not_available()
+
+#สินค้าที่ request ใน process นี้กำลังจองอยู่ (ยังไม่ commit)
+_claimed_products = set()
+_claimed_lock = threading.Lock()
+
+@asynccontextmanager
+async def claim_products(product_ids, check_status: bool = True):
+    """ด่านหน้าก่อนเข้าคิว write lock — คนแพ้ส่วนใหญ่ได้ 409 ทันทีโดยไม่ต้องรอ lock ของ DB
+
+    1. ชิ้นไหนมี request อื่นใน process เดียวกันกำลังจองอยู่ → 409 เลย
+    2. ชิ้นไหนใน DB ไม่ available แล้ว (คนอื่น commit ไปแล้ว) → 409
+    ผ่านด่านนี้ไม่ได้แปลว่าชนะ (อีก worker อาจแย่งอยู่) — reserve_products ตัดสินอีกทีใน transaction
+    """
+    product_ids = set(product_ids)
+    with _claimed_lock:
+        if not _claimed_products.isdisjoint(product_ids):
+            raise product_not_available()
+        _claimed_products.update(product_ids)
+    try:
+        if check_status:  # ผู้เรียกเช็คสถานะมาเองแล้วก็ข้ามได้ (เช่น checkout อ่านมาพร้อมตะกร้า)
+            # session แยกที่ปิดทันที — ถ้าค้าง transaction อ่านไว้ จะไปขวาง commit ของ write session ตัวเอง
+            async with async_session() as session:
+                taken = (await session.exec(
+                    select(func.count()).select_from(ProductDB)
+                    .where(ProductDB.product_id.in_(product_ids), ProductDB.product_status != "available")
+                )).one()
+            if taken:
+                raise product_not_available()
+        yield
+    finally:
+        with _claimed_lock:
+            _claimed_products.difference_update(product_ids)
+
 #ซื้อเลย (Buy Now)
 @app.post("/create-order/")
 async def create_order(order: OrderCreate):
-    with Session(engine) as session:
+    product_ids = [item.product_id for item in order.items]
+    async with claim_products(product_ids), async_write_session() as session:
         try:
-            # เรียกใช้ "กุ๊ก" (Helper Function) ตรงนี้ครับ!
-            new_order = process_order_logic(session, order.cus_id, order.items, order.shipping_cost)
-            session.commit()
-            session.refresh(new_order)
-            return {"message": "Order created via Buy Now", "order_id": new_order.order_id}
+            # เรียกใช้ "กุ๊ก" (Helper Function) ตรงนี้ครับ! (helper เป็น sync ใช้ run_sync ไม่บล็อก event loop)
+            new_order = await session.run_sync(process_order_logic, order.cus_id, order.items, order.shipping_cost)
+            order_id = new_order.order_id
+            await session.commit()
+            invalidate_products(*product_ids)
+            ORDERS_CREATED.inc("buy_now")
+            return {"message": "Order created via Buy Now", "order_id": order_id}
         except Exception as e:
-            session.rollback()
+            await session.rollback()
             raise e
 
 #หน้าตะกร้า (Checkout)
 @app.post("/orders/checkout/{cus_id}")
 async def checkout(cus_id: int):
-    with Session(engine) as session:
-        cart_items = session.exec(select(CartItemDB).where(CartItemDB.cus_id == cus_id)).all()
-        
+    # อ่านตะกร้าพร้อมสถานะสินค้าใน query เดียว ของที่ถูกจองไปแล้วตอบ 409 ได้เลยก่อนเข้าคิว write lock
+    async with async_session() as session:
+        cart = (await session.exec(
+            select(CartItemDB.product_id, ProductDB.product_status)
+            .join(ProductDB, ProductDB.product_id == CartItemDB.product_id, isouter=True)
+            .where(CartItemDB.cus_id == cus_id)
+        )).all()
+
+    if not cart:
+        raise HTTPException(status_code=400, detail="ตะกร้าว่างเปล่าจ้า")
+    if any(status not in (None, "available") for _, status in cart):
+        raise product_not_available()
+
+    claimed = {product_id for product_id, _ in cart}
+    async with claim_products(claimed, check_status=False), async_write_session() as session:
+        # อ่านตะกร้าอีกรอบตอนถือ write lock แล้ว — order สร้างจากรอบนี้เท่านั้น
+        cart_items = (await session.exec(select(CartItemDB).where(CartItemDB.cus_id == cus_id))).all()
+
         if not cart_items:
             raise HTTPException(status_code=400, detail="ตะกร้าว่างเปล่าจ้า")
 
-        # คำนวณ total ก่อน
-        total_price = 0
-        for item in cart_items:
-            product = session.get(ProductDB, item.product_id)
-            if product:
-                total_price += product.price * item.qty
-
         shipping_cost = 50.0
-
-        # สร้าง order พร้อม field ครบ
-        new_order = OrderDB(
-            cus_id=cus_id,
-            total_price=total_price,
-            shipping_cost=shipping_cost,
-            grand_total=total_price + shipping_cost,
-            order_status="pending"
-        )
-        session.add(new_order)
-        session.commit()
-        session.refresh(new_order)
-
-        # สร้าง order items + ลบ cart
-        for item in cart_items:
-            product = session.get(ProductDB, item.product_id)
-            order_item = OrderItemDB(
-                order_id=new_order.order_id,
-                product_id=item.product_id,
-                qty=item.qty,
-                price=product.price if product else 0
-            )
-            session.add(order_item)
-            session.delete(item)
-
-            if product:
-                product.product_status = "sold"
-                session.add(product)
-
-        session.commit()
-        return {"message": "สั่งซื้อสำเร็จ", "order_id": new_order.order_id}
+        product_ids = [item.product_id for item in cart_items]
+
+        # ตะกร้าถูกเพิ่มของระหว่างรอ lock → claim ชิ้นที่เพิ่มมาด้วย ให้ทุกชิ้นใน order ผ่าน claim เหมือนกัน
+        async with claim_products(set(product_ids) - claimed, check_status=False):
+            # สร้าง order + order items + เปลี่ยนสถานะสินค้าเป็น sold (ใช้ logic เดียวกับ Buy Now)
+            new_order = await session.run_sync(process_order_logic, cus_id, cart_items, shipping_cost, "sold")
+
+            # ลบเฉพาะของในตะกร้าที่อ่านมาและอยู่ใน order แล้ว ด้วย DELETE เดียว
+            # (Postgres ไม่มี write lock ทั้ง DB — ของที่เพิ่งหยิบใส่ตะกร้าหลังอ่านต้องยังอยู่ ไม่หายไปโดยไม่ได้สั่ง)
+            await session.exec(delete(CartItemDB).where(CartItemDB.cartitem_id.in_([item.cartitem_id for item in cart_items])))
+
+            order_id = new_order.order_id
+            await session.commit()
+        invalidate_products(*product_ids)
+        ORDERS_CREATED.inc("checkout")
+        CHECKOUTS.inc()
+        return {"message": "สั่งซื้อสำเร็จ", "order_id": order_id}
         
 #get all order
 @app.get("/orders/")
 async def get_all_orders() -> list[OrderOut]:
-    with Session(engine) as session:
-        statement = select(OrderDB)
-        orders = session.exec(statement).all()
-        return orders       
+    statement = select(*OrderDB.__table__.columns)  # = field ของ OrderOut
+    return json_array_response(statement)
 
 #get order by id   
 @app.get("/orders/{order_id}")
-async def Get_order_by_id(order_id: int) -> OrderOut:
-    with Session(engine) as s:
-        statement = select(OrderDB).where(OrderDB.order_id == order_id)
-        order = s.exec(statement).first()
-       
-        if order != None:
-            print(order)
-            return order
-       
+async def Get_order_by_id(order_id: int, s: AsyncSession = Depends(get_session)) -> OrderOut:
+    statement = select(OrderDB).where(OrderDB.order_id == order_id)
+    order = (await s.exec(statement)).first()
+
+    if order != None:
+        logger.debug("loaded order %s", order)
+        return order
+
     raise HTTPException(
         status_code=404,
         detail="Order not found"
     )
 
 @app.get("/orders/customer/{cus_id}")
-async def get_orders_by_customer(cus_id: int):
-    with Session(engine) as session:
-        orders = session.exec(
-            select(OrderDB).where(OrderDB.cus_id == cus_id)
-        ).all()
-        return orders
+async def get_orders_by_customer(
+    cus_id: int,
+    response: Response,
+    limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    session: AsyncSession = Depends(get_read_session),
+):
+    statement = select(OrderDB).where(OrderDB.cus_id == cus_id)
+    if limit is None and cursor is None:
+        return await stream_all(session, statement)
+
+    orders, next_cursor = await session.run_sync(
+        paginate, statement, [(OrderDB.order_id, False)], limit or DEFAULT_PAGE_SIZE, cursor, f"orders:{cus_id}"
+    )
+    set_next_cursor(response, next_cursor)
+    return orders
 #get order พร้อม item ใช้ where แทนการวน loop
 
 @app.get("/order_items/{order_id}")
-async def get_order_item(order_id: int):
-    with Session(engine) as session:
-        db_order = session.get(OrderDB, order_id)
-        if not db_order:
-            raise HTTPException(status_code=404, detail="Order not found")
-        
-        # ดึง Order Items
-        items_statement = select(OrderItemDB).where(OrderItemDB.order_id == order_id)
-        order_items = session.exec(items_statement).all()
-
-        if not order_items:
-            return {
-                "order_id": db_order.order_id,
-                "cus_id": db_order.cus_id,
-                "total_price": float(db_order.total_price),
-                "shipping_cost": float(db_order.shipping_cost),
-                "grand_total": float(db_order.grand_total),
-                "order_status": db_order.order_status,
-                "created_at": db_order.created_at.isoformat(),
-                "items": []
-            }
+async def get_order_item(order_id: int, session: AsyncSession = Depends(get_session)):
+    db_order = await session.get(OrderDB, order_id)
+    if not db_order:
+        raise HTTPException(status_code=404, detail="Order not found")
 
-        # ดึง Products ทั้งหมดพร้อมกัน (1 query)
-        product_ids = [item.product_id for item in order_items]
-        products_statement = select(ProductDB).where(ProductDB.product_id.in_(product_ids))
-        products = session.exec(products_statement).all()
-        # สร้าง dict สำหรับ lookup
-        products_dict = {p.product_id: p for p in products}
-        
-        # ใช้ products_dict แทนการ unpack tuple
-        items_with_details = [
-            {
-                "orderitem_id": item.orderitem_id,
-                "order_id": item.order_id,
-                "product_id": item.product_id,
-                "product_name": products_dict.get(item.product_id).pname if products_dict.get(item.product_id) else "Product Deleted",  # ✅ ใช้ .get()
-                "brand": products_dict.get(item.product_id).brand if products_dict.get(item.product_id) else "Unknown",  # ✅ ใช้ .get()
-                "qty": item.qty,
-                "price": float(item.price),
-                "subtotal": float(item.price * item.qty)
-            }
-            for item in order_items  # ✅ loop item เดียว
-        ]
-        
+    # ดึง Order Items
+    items_statement = select(OrderItemDB).where(OrderItemDB.order_id == order_id)
+    order_items = (await session.exec(items_statement)).all()
+
+    if not order_items:
         return {
             "order_id": db_order.order_id,
             "cus_id": db_order.cus_id,
@@ -364,60 +577,88 @@ async def get_order_item(order_id: int):
             "grand_total": float(db_order.grand_total),
             "order_status": db_order.order_status,
             "created_at": db_order.created_at.isoformat(),
-            "items": items_with_details
+            "items": []
+        }
+
+    # ดึง Products ทั้งหมดพร้อมกัน (1 query)
+    product_ids = [item.product_id for item in order_items]
+    products_statement = select(ProductDB).where(ProductDB.product_id.in_(product_ids))
+    products = (await session.exec(products_statement)).all()
+    # สร้าง dict สำหรับ lookup
+    products_dict = {p.product_id: p for p in products}
+
+    # ใช้ products_dict แทนการ unpack tuple
+    items_with_details = [
+        {
+            "orderitem_id": item.orderitem_id,
+            "order_id": item.order_id,
+            "product_id": item.product_id,
+            "product_name": products_dict.get(item.product_id).pname if products_dict.get(item.product_id) else "Product Deleted",  # ✅ ใช้ .get()
+            "brand": products_dict.get(item.product_id).brand if products_dict.get(item.product_id) else "Unknown",  # ✅ ใช้ .get()
+            "qty": item.qty,
+            "price": float(item.price),
+            "subtotal": float(item.price * item.qty)
         }
+        for item in order_items  # ✅ loop item เดียว
+    ]
+
+    return {
+        "order_id": db_order.order_id,
+        "cus_id": db_order.cus_id,
+        "total_price": float(db_order.total_price),
+        "shipping_cost": float(db_order.shipping_cost),
+        "grand_total": float(db_order.grand_total),
+        "order_status": db_order.order_status,
+        "created_at": db_order.created_at.isoformat(),
+        "items": items_with_details
+    }
 
 #cancel order
 @app.put("/orders/{order_id}/cancel")
 async def cancel_order(order_id: int):
-    with Session(engine) as session:
-        order = session.get(OrderDB, order_id)
-        
+    async with async_write_session() as session:  # กันจ่ายเงิน/sweeper แทรกระหว่างยกเลิก
+        # Postgres: write session ไม่ได้กันใคร → lock แถว order เอง (sweeper ข้ามด้วย SKIP LOCKED, จ่ายเงินรอ) / SQLite: ไม่มีผล
+        order = await session.get(OrderDB, order_id, with_for_update=True)
+        if not order:
+            raise HTTPException(
+                status_code=404,
+                detail="Order no found"
+            )
+
         if order.order_status == "cancelled" :
             return {"message": "Order is already cancelled"}
-        
+
         order.order_status = "cancelled"
         session.add(order)
-            
-        statement = select(OrderItemDB).where(OrderItemDB.order_id == order_id)
-        order_items = session.exec(statement).all()
-
-        for item in order_items:
-            product = session.get(ProductDB, item.product_id)
-            if product:
-                
-                product.product_status = "available" 
-                session.add(product)    
-            
-        session.commit()
-        session.refresh(order)
+
+        statement = select(OrderItemDB.product_id).where(OrderItemDB.order_id == order_id)
+        product_ids = (await session.exec(statement)).all()
+
+        # ปล่อยสินค้าทุกชิ้นของ order ด้วย UPDATE เดียว
+        await session.exec(update(ProductDB).where(ProductDB.product_id.in_(product_ids)).values(product_status="available"))
+
+        await session.commit()
+        invalidate_products(*product_ids)
         return order
-    
-        raise HTTPException(
-            status_code=404,
-            detail="Order no found"
-        )
-    
+
 #เปลี่ยนสถานะ order
 @app.patch("/orders/{order_id}/status")
-async def update_order_status(order_id: int, status: OrderStatus):
-    with Session(engine) as session:
-        order = session.get(OrderDB, order_id)
-        
-        if not order:
-            raise HTTPException(status_code=404, detail="Order not found")
-        
-        order.order_status = status
-        session.add(order)
-        session.commit()
-        session.refresh(order)
-        return order
+async def update_order_status(order_id: int, status: OrderStatus, session: AsyncSession = Depends(get_session)):
+    order = await session.get(OrderDB, order_id)
+
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+
+    order.order_status = status
+    session.add(order)
+    await session.commit()
+    return order
 
 
 #Payment
 @app.post("/payments/")
 async def create_payment(payment_data: Payment) -> PaymentOut:
-    with Session(engine) as session:
+    async with async_write_session() as session:  # กันจ่ายเงินแทรกตอน sweeper กำลังยกเลิก order เดียวกัน
         #สร้างลิสต์รายการที่อนุญาต
         allowed_methods = ["credit_card", "qr_code", "bank_transfer"]
     
@@ -429,12 +670,15 @@ async def create_payment(payment_data: Payment) -> PaymentOut:
         )
 
         #ตรวจสอบว่า Order มีอยู่จริงไหม (Validation)
-        order = session.get(OrderDB, payment_data.order_id)
+        # lock แถว order จน commit (Postgres) — sweeper ที่ยกเลิกไปก่อน เราจะรอแล้วเห็น cancelled / ถ้าเราได้ก่อน sweeper ข้ามไป
+        order = await session.get(OrderDB, payment_data.order_id, with_for_update=True)
         if not order:
             raise HTTPException(
             status_code=404,
             detail="Order not found"
         )
+        if order.order_status == "cancelled":
+            raise HTTPException(status_code=409, detail="Order is cancelled")
 
         #บันทึกการชำระเงิน
         db_payment = PaymentDB(
@@ -450,354 +694,438 @@ async def create_payment(payment_data: Payment) -> PaymentOut:
         #อัปเดตสถานะ Order เป็น "paid" 
         order.order_status = "paid"  
         session.add(order)
-        session.commit()
-        session.refresh(db_payment)
+        await session.commit()
+        PAYMENTS.inc(payment_data.payment_method)
         return db_payment
     
 # get all Payment    
 @app.get("/payments/")
 async def get_all_payments():
-    with Session(engine) as session:
-        
-        statement = select(PaymentDB)
-        results = session.exec(statement).all()
-        return results
+    statement = select(*PaymentDB.__table__.columns)
+    return json_array_response(statement)
 
 # get id Payment   
 @app.get("/payments/{payment_id}")
-async def get_payment_by_id(payment_id: int):
-    with Session(engine) as session:
-        payment = session.get(PaymentDB, payment_id)
-
-        if not payment:
-            raise HTTPException(status_code=404, detail="Payment record not found")
-        return payment
-
+async def get_payment_by_id(payment_id: int, session: AsyncSession = Depends(get_session)):
+    payment = await session.get(PaymentDB, payment_id)
+
+    if not payment:
+        raise HTTPException(status_code=404, detail="Payment record not found")
+    return payment
+
+
+#Export: ดึงทั้งตารางแบบ stream เป็น NDJSON/CSV (memory คงที่ไม่ว่าตารางจะใหญ่แค่ไหน ดู export.py)
+#created_from/created_to = ช่วงวันที่สร้าง order (from <= created_at < to) เช่น ?created_from=2026-01-01&created_to=2026-02-01
+@app.get("/export/products")
+async def export_products(
+    format: ExportFormat = ExportFormat.NDJSON,
+    seller_id: int | None = None,
+    product_status: str | None = None,
+    category_id: int | None = None,
+):
+    return export_response(products_query(seller_id, product_status, category_id), format, "products")
+
+@app.get("/export/orders")
+async def export_orders(
+    format: ExportFormat = ExportFormat.NDJSON,
+    created_from: datetime | None = None,
+    created_to: datetime | None = None,
+    seller_id: int | None = Query(None, description="order ที่มีสินค้าของ seller นี้"),
+    order_status: OrderStatus | None = None,
+    cus_id: int | None = None,
+):
+    return export_response(orders_query(created_from, created_to, seller_id, order_status, cus_id), format, "orders")
+
+@app.get("/export/payments")
+async def export_payments(
+    format: ExportFormat = ExportFormat.NDJSON,
+    created_from: datetime | None = None,
+    created_to: datetime | None = None,
+    seller_id: int | None = Query(None, description="payment ของ order ที่มีสินค้าของ seller นี้"),
+    payment_method: str | None = None,
+):
+    return export_response(payments_query(created_from, created_to, seller_id, payment_method), format, "payments")
 
 #Customer
 #post
 @app.post("/customers/")
-async def create_customers(customers: list[Customer]) -> list[CustomerOut]:
-    with Session(engine) as session:
-        created_customers = []
-        
-        for customer_data in customers:
-            # เช็ค Email ซ้ำเบื้องต้น
-            existing = session.exec(
-                select(CustomerDB).where(CustomerDB.email == customer_data.email)
-            ).first()
-            
-            if not existing:
-                db_customer = CustomerDB(
-                    username=customer_data.username,
-                    email=customer_data.email,
-                    customer_phone=customer_data.customer_phone,
-                    password=customer_data.password,
-                    display_name=customer_data.display_name,
-                    avatar=customer_data.avatar
-                )
-                session.add(db_customer)
-                created_customers.append(db_customer)
-        
-        session.commit()
-        # Refresh ข้อมูลเพื่อให้ได้ ID กลับมาโชว์
-        for c in created_customers:
-            session.refresh(c)
-            
-        return created_customers
+async def create_customers(customers: list[Customer], session: AsyncSession = Depends(get_session)) -> list[CustomerOut]:
+    created_customers = []
+
+    for customer_data in customers:
+        # เช็ค Email ซ้ำเบื้องต้น
+        existing = (await session.exec(
+            select(CustomerDB).where(CustomerDB.email == customer_data.email)
+        )).first()
+
+        if not existing:
+            db_customer = CustomerDB(
+                username=customer_data.username,
+                email=customer_data.email,
+                customer_phone=customer_data.customer_phone,
+                password=customer_data.password,
+                display_name=customer_data.display_name,
+                avatar=customer_data.avatar
+            )
+            session.add(db_customer)
+            created_customers.append(db_customer)
+
+    await session.commit()
+    # Refresh ข้อมูลเพื่อให้ได้ ID กลับมาโชว์
+    for c in created_customers:
+        await session.refresh(c)
+
+    return created_customers
 
 
 #get all
 @app.get("/customers/")
-def get_all_customers():
-    with Session(engine) as session:
-        customers = session.exec(select(CustomerDB)).all()
-        return customers
-    
+async def get_all_customers():
+    return json_array_response(select(*CustomerDB.__table__.columns))
+
 #get by id
 @app.get("/customers/{cus_id}")
-def get_customer_by_id(cus_id: int):
-    with Session(engine) as session:
-        customer = session.get(CustomerDB, cus_id)
+async def get_customer_by_id(cus_id: int, session: AsyncSession = Depends(get_session)):
+    customer = await session.get(CustomerDB, cus_id)
 
-        if not customer:
-            raise HTTPException(status_code=404, detail="Customer not found")
+    if not customer:
+        raise HTTPException(status_code=404, detail="Customer not found")
 
-        return customer 
+    return customer 
 
 #Seller
 @app.post("/sellers/")
-async def create_seller(seller: Seller) -> SellerOut :
-    with Session(engine) as session:
-        db_seller = SellerDB(
-            seller_name=seller.seller_name,
-            email=seller.email,
-            seller_phone=seller.seller_phone,
-            store_name=seller.store_name,
-            verification_status=seller.verification_status
-        )
+async def create_seller(seller: Seller, session: AsyncSession = Depends(get_session)) -> SellerOut :
+    db_seller = SellerDB(
+        seller_name=seller.seller_name,
+        email=seller.email,
+        seller_phone=seller.seller_phone,
+        store_name=seller.store_name,
+        verification_status=seller.verification_status
+    )
 
-        session.add(db_seller)
-        session.commit()
-        session.refresh(db_seller)
+    session.add(db_seller)
+    await session.commit()
 
-        return db_seller
+    return db_seller
 
 #Get all seller
 @app.get("/sellers/")
-async def get_all_sellers() -> list[SellerOut]:
-    with Session(engine) as session:
-        statement = select(SellerDB)
-        sellers = session.exec(statement).all()
-        return sellers
+async def get_all_sellers(session: AsyncSession = Depends(get_session)) -> list[SellerOut]:
+    statement = select(SellerDB)
+    sellers = (await session.exec(statement)).all()
+    return sellers
 
 #Get seller by id
 @app.get("/sellers/{seller_id}")
-async def get_seller_by_id(seller_id: int) -> SellerOut:
-    with Session(engine) as session:
-        seller = session.get(SellerDB, seller_id)
+async def get_seller_by_id(seller_id: int, session: AsyncSession = Depends(get_session)) -> SellerOut:
+    seller = await session.get(SellerDB, seller_id)
 
-        if seller is None:
-            raise HTTPException(
-                status_code=404,
-                detail="Seller not found"
-            )
+    if seller is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Seller not found"
+        )
 
-        return seller
+    return seller
 
 ###Search product
 @app.post("/products/search")
-async def search_products(search: ProductSearchRequest):
+async def search_products(search: ProductSearchRequest, session: AsyncSession = Depends(get_read_session)):
     """
     🔍 Smart Search สินค้า
-    
+
     Features:
     - Search by text (ชื่อ, brand, description)
     - Filter by: category, brand, tags
-    - Sort by: price (low/high), newest, oldest
+    - Sort by: price (low/high), newest, oldest, relevance
     - Pagination
     """
-    
-    with Session(engine) as session:
-        # เริ่มต้น query
-        query = select(ProductDB)
-        
-        # ===== 1. TEXT SEARCH =====
-        if search.query:
-            search_term = f"%{search.query}%"
-            query = query.where(
-                or_(
-                    ProductDB.pname.ilike(search_term),
-                    ProductDB.brand.ilike(search_term),
-                    ProductDB.description.ilike(search_term)
-                )
-            )
-        
-        # ===== 2. FILTER BY CATEGORY =====
-        if search.category_id:
-            query = query.where(ProductDB.categoryID == search.category_id)
-        
-        # ===== 3. FILTER BY BRAND =====
-        if search.brand:
-            query = query.where(ProductDB.brand.ilike(f"%{search.brand}%"))
-        
-        # ===== 4. FILTER BY TAGS =====
-        if search.tags:
-            # ค้นหาสินค้าที่มี tag ใดๆ ที่ระบุ
-            tag_conditions = [
-                ProductDB.tags.ilike(f"%{tag}%") for tag in search.tags
-            ]
-            query = query.where(or_(*tag_conditions))
-        
-        # ===== 5. PRICE RANGE (Optional) =====
-        if search.min_price is not None:
-            query = query.where(ProductDB.price >= search.min_price)
-        
-        if search.max_price is not None:
-            query = query.where(ProductDB.price <= search.max_price)
-        
-        # ===== 6. DEFAULT: แสดงเฉพาะ available =====
-        query = query.where(ProductDB.product_status == "available")
-        
-        # ===== 7. SORTING =====
-        if search.sort_by == SortBy.PRICE_LOW:
-            query = query.order_by(ProductDB.price.asc())
-        elif search.sort_by == SortBy.PRICE_HIGH:
-            query = query.order_by(ProductDB.price.desc())
-        elif search.sort_by == SortBy.NEWEST:
-            query = query.order_by(ProductDB.product_id.desc())
-        elif search.sort_by == SortBy.OLDEST:
-            query = query.order_by(ProductDB.product_id.asc())
-        
-        # ===== 8. COUNT TOTAL =====
-        count_query = select(func.count()).select_from(query.subquery())
-        total = session.exec(count_query).one()
-        
-        # ===== 9. PAGINATION =====
-        offset = (search.page - 1) * search.page_size
-        query = query.offset(offset).limit(search.page_size)
-        
-        # ===== 10. EXECUTE =====
-        products = session.exec(query).all()
-        
-        # ===== 11. BUILD RESPONSE =====
-        total_pages = (total + search.page_size - 1) // search.page_size
-        
-        return {
-            "total": total,
-            "page": search.page,
-            "page_size": search.page_size,
-            "total_pages": total_pages,
-            "products": [
-                {
-                    "product_id": p.product_id,
-                    "pname": p.pname,
-                    "price": float(p.price) if p.price else None,
-                    "brand": p.brand,
-                    "description": p.description,
-                    "categoryID": p.categoryID,
-                    "seller_id": p.seller_id,
-                    "tags": p.tags,
-                    "product_status": p.product_status,
-                    "image_url": p.image_url or "https://placehold.co/400x400"
-                }
-                for p in products
-            ]
-        }
-    
+
+    # เริ่มต้น query
+    query = select(ProductDB)
+    fts = None
+
+    # ===== 1. TEXT SEARCH (FTS5 index แทน ilike ที่ต้อง scan ทั้งตาราง) =====
+    if search.query:
+        fts = match_subquery(search.query)
+        if fts is not None:
+            query = query.join(fts, ProductDB.product_id == fts.c.product_id)
+        elif search.query.strip():
+            # มีคำค้นแต่ไม่เหลือ token เลย (เช่น "!!!") — ilike เดิมได้ 0 แถว ไม่ใช่สินค้าทั้งหมด
+            query = query.where(false())
+
+    # ===== 2. FILTER BY CATEGORY =====
+    if search.category_id:
+        query = query.where(ProductDB.categoryID == search.category_id)
+
+    # ===== 3. FILTER BY BRAND =====
+    if search.brand:
+        query = query.where(ProductDB.brand.ilike(f"%{search.brand}%"))
+
+    # ===== 4. FILTER BY TAGS =====
+    if search.tags:
+        # any = มี tag ใดๆ ที่ระบุ / all = ต้องมีครบทุก tag (lookup จาก producttagdb)
+        condition = tag_filter(search.tags, search.tag_match)
+        if condition is not None:
+            query = query.where(condition)
+
+    # ===== 5. PRICE RANGE (Optional) =====
+    if search.min_price is not None:
+        query = query.where(ProductDB.price >= search.min_price)
+
+    if search.max_price is not None:
+        query = query.where(ProductDB.price <= search.max_price)
+
+    # ===== 6. DEFAULT: แสดงเฉพาะ available =====
+    facet_query = query  # facet product_status ต้องนับทุกสถานะ เลยเก็บ query ก่อนกรองไว้
+    query = query.where(ProductDB.product_status == "available")
+
+    # ===== 7. COUNT TOTAL (exact / approximate / none) =====
+    total, total_is_exact = None, None
+    if search.total_mode == TotalMode.EXACT:
+        total = (await session.exec(select(func.count()).select_from(query.subquery()))).one()
+        total_is_exact = True
+    elif search.total_mode == TotalMode.APPROXIMATE:
+        # นับแค่ไม่เกิน APPROX_TOTAL_CAP แถว พอให้หน้าเว็บขึ้น "1000+ รายการ"
+        capped = query.limit(APPROX_TOTAL_CAP + 1).subquery()
+        total = (await session.exec(select(func.count()).select_from(capped))).one()
+        total_is_exact = total <= APPROX_TOTAL_CAP
+        total = min(total, APPROX_TOTAL_CAP)
+
+    # ===== 8. SORTING (product_id เป็นตัวตัดสินเมื่อค่าเท่ากัน ให้ cursor ไม่ข้าม/ซ้ำแถว) =====
+    sort_by = search.sort_by or SortBy.NEWEST
+    if sort_by == SortBy.RELEVANCE and fts is None:
+        sort_by = SortBy.NEWEST
+
+    if sort_by == SortBy.PRICE_LOW:
+        sort_keys = [(ProductDB.price, False), (ProductDB.product_id, False)]
+    elif sort_by == SortBy.PRICE_HIGH:
+        sort_keys = [(ProductDB.price, True), (ProductDB.product_id, True)]
+    elif sort_by == SortBy.OLDEST:
+        sort_keys = [(ProductDB.product_id, False)]
+    elif sort_by == SortBy.RELEVANCE:
+        sort_keys = [(fts.c.score, False), (ProductDB.product_id, True)]
+    else:
+        sort_keys = [(ProductDB.product_id, True)]
+
+    # ===== 9. PAGINATION + EXECUTE (ส่ง cursor มา = keyset, ไม่ส่ง = ใช้เลขหน้าแบบเดิม) =====
+    offset = 0 if search.cursor else (search.page - 1) * search.page_size
+    products, next_cursor = await session.run_sync(
+        paginate, query, sort_keys, search.page_size, search.cursor, f"search:{sort_by.value}", offset
+    )
+
+    # ===== 10. FACETS (opt-in, GROUP BY query เดียว) =====
+    facets = await session.run_sync(compute_facets, facet_query, search.price_buckets) if search.facets else None
+
+    # ===== 11. BUILD RESPONSE =====
+    total_pages = (total + search.page_size - 1) // search.page_size if total is not None else None
+
+    return {
+        "total": total,
+        "total_is_exact": total_is_exact,
+        "page": None if search.cursor else search.page,
+        "page_size": search.page_size,
+        "total_pages": total_pages,
+        "next_cursor": next_cursor,
+        "facets": facets,
+        "products": [
+            {
+                "product_id": p.product_id,
+                "pname": p.pname,
+                "price": float(p.price) if p.price else None,
+                "brand": p.brand,
+                "description": p.description,
+                "categoryID": p.categoryID,
+                "seller_id": p.seller_id,
+                "tags": p.tags,
+                "product_status": p.product_status,
+                "image_url": p.image_url or "https://placehold.co/400x400"
+            }
+            for p in products
+        ]
+    }
+
 #Cart
 #"เพิ่ม" สินค้าลงตะกร้า
 @app.post("/cart/add")
-async def add_to_cart(item: CartItemCreate):
-    with Session(engine) as session:
-        # เช็กก่อนว่าเคยหยิบชิ้นนี้ใส่ตะกร้าหรือยัง
-        statement = select(CartItemDB).where(
-            CartItemDB.cus_id == item.cus_id, 
-            CartItemDB.product_id == item.product_id
-        )
-        existing_item = session.exec(statement).first()
-
-        if existing_item:
-            # ถ้ามีแล้ว ไม่ต้องทำอะไร หรือจะเพิ่มจำนวนก็ได้ (แต่โปรเจกต์นี้เสื้อผ้ามีชิ้นเดียว เลยข้ามไป)
-            return {"message": "มีสินค้านี้ในตะกร้าแล้ว"}
-        else:
-            # ถ้ายังไม่มี ให้บันทึกลง Database
-            db_item = CartItemDB(cus_id=item.cus_id, product_id=item.product_id, qty=item.qty)
-            session.add(db_item)
-            session.commit()
-            return {"message": "เพิ่มลงตะกร้าสำเร็จ"}
+async def add_to_cart(item: CartItemCreate, session: AsyncSession = Depends(get_session)):
+    # เช็กก่อนว่าเคยหยิบชิ้นนี้ใส่ตะกร้าหรือยัง
+    statement = select(CartItemDB).where(
+        CartItemDB.cus_id == item.cus_id, 
+        CartItemDB.product_id == item.product_id
+    )
+    existing_item = (await session.exec(statement)).first()
+
+    if existing_item:
+        # ถ้ามีแล้ว ไม่ต้องทำอะไร หรือจะเพิ่มจำนวนก็ได้ (แต่โปรเจกต์นี้เสื้อผ้ามีชิ้นเดียว เลยข้ามไป)
+        return {"message": "มีสินค้านี้ในตะกร้าแล้ว"}
+    else:
+        # ถ้ายังไม่มี ให้บันทึกลง Database
+        db_item = CartItemDB(cus_id=item.cus_id, product_id=item.product_id, qty=item.qty)
+        session.add(db_item)
+        await session.commit()
+        return {"message": "เพิ่มลงตะกร้าสำเร็จ"}
 
 #"ดึงข้อมูล" ตะกร้าของลูกค้าแต่ละคน
 @app.get("/cart/{cus_id}")
-async def get_cart(cus_id: int):
-    with Session(engine) as session:
-        # ดึงสินค้าในตะกร้า
-        statement = select(CartItemDB).where(CartItemDB.cus_id == cus_id)
-        cart_items = session.exec(statement).all()
-
-        # ดึงรายละเอียดสินค้า (ชื่อ, ราคา, รูป) มาประกอบกัน
-        results = []
-        for item in cart_items:
-            product = session.get(ProductDB, item.product_id)
-            if product:
-                results.append({
-                    "cartitem_id": item.cartitem_id,
-                    "product_id": product.product_id,
-                    "name": product.pname,
-                    "price": product.price,
-                    "shop": product.brand,
-                    "description": product.description,
-                    "selected": True, # ให้ติ๊กถูกไว้เลยตั้งแต่แรก
-                    "img": product.image_url or 'https://placehold.co/400x400'
-                })
-        return results
+async def get_cart(cus_id: int, session: AsyncSession = Depends(get_session)):
+    # ดึงสินค้าในตะกร้า
+    statement = select(CartItemDB).where(CartItemDB.cus_id == cus_id)
+    cart_items = (await session.exec(statement)).all()
+
+    # ดึงรายละเอียดสินค้า (ชื่อ, ราคา, รูป) ทีเดียว แล้วมาประกอบกัน
+    products = {p.product_id: p for p in await session.run_sync(fetch_in, ProductDB, ProductDB.product_id, [i.product_id for i in cart_items])}
+    results = []
+    for item in cart_items:
+        product = products.get(item.product_id)
+        if product:
+            results.append({
+                "cartitem_id": item.cartitem_id,
+                "product_id": product.product_id,
+                "name": product.pname,
+                "price": product.price,
+                "shop": product.brand,
+                "description": product.description,
+                "selected": True, # ให้ติ๊กถูกไว้เลยตั้งแต่แรก
+                "img": product.image_url or 'https://placehold.co/400x400'
+            })
+    return results
 
 #"ลบ" สินค้าออกจากตะกร้า
 @app.delete("/cart/remove/{cartitem_id}")
-async def remove_from_cart(cartitem_id: int):
-    with Session(engine) as session:
-        item = session.get(CartItemDB, cartitem_id)
-        if item:
-            session.delete(item)
-            session.commit()
-            return {"message": "ลบสำเร็จ"}
-        return {"message": "ไม่พบข้อมูล"}
+async def remove_from_cart(cartitem_id: int, session: AsyncSession = Depends(get_session)):
+    item = await session.get(CartItemDB, cartitem_id)
+    if item:
+        await session.delete(item)
+        await session.commit()
+        return {"message": "ลบสำเร็จ"}
+    return {"message": "ไม่พบข้อมูล"}
 
 
 ###Community
 # 1. ดึงโพสต์ทั้งหมด (สำหรับหน้า Feed)
 @app.get("/posts/")
-async def get_all_posts() -> list[dict]:
-    with Session(engine) as session:
-        # 1. ดึงโพสต์ทั้งหมดจาก DB (เรียงจากใหม่ไปเก่า หรือตาม ID)
-        statement = select(PostDB).order_by(PostDB.post_id.asc())
-        posts_db = session.exec(statement).all()
-
-        final_result = []
-
-        for p in posts_db:
-            # 2. หาข้อมูลเจ้าของโพสต์ (name, username, avatar)
-            user = session.get(CustomerDB, p.customer_id)
-            
-            # 3. หาคอมเมนต์ทั้งหมดของโพสต์นี้ เพื่อทำเป็น staticComments
-            comment_statement = select(CommentDB).where(CommentDB.post_id == p.post_id)
-            comments_db = session.exec(comment_statement).all()
-            
-            static_comments = []
-            for c in comments_db:
-                c_user = session.get(CustomerDB, c.customer_id)
-                static_comments.append({
-                    "name": c_user.display_name if c_user else "Unknown",
-                    "avatar": c_user.avatar if c_user else "",
-                    "text": c.text,
-                    "time": c.time_str  # เช่น "2 hrs"
-                })
-
-            # 4. ประกอบร่างให้เหมือนโครงสร้างใน data.js
-            post_obj = {
-                "id": p.post_id,
-                "name": user.display_name if user else "Unknown",
-                "username": f"@{user.username}" if user else "@unknown",
-                "avatar": user.avatar if user else "",
-                "content": p.content,
-                "image": p.image_url, # เปลี่ยนชื่อจาก image_url เป็น image ตาม data.js
-                "likes": p.likes,
-                "reposts": p.reposts,
-                "shares": p.shares,
-                "staticComments": static_comments,
-                "comments": len(static_comments) # นับจำนวนคอมเมนต์
-            }
-            final_result.append(post_obj)
+async def get_all_posts(
+    response: Response,
+    limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    newest_first: bool = False,
+    preview_comments: int | None = Query(None, ge=0, le=20),
+    session: AsyncSession = Depends(get_read_session),
+) -> list[dict]:
+    """Feed ของหน้า community
+
+    limit/cursor = แบ่งหน้า, newest_first = โพสต์ใหม่ขึ้นก่อน
+    preview_comments = แนบแค่ N คอมเมนต์ล่าสุดต่อโพสต์ (ไม่ส่ง = แนบทั้งหมดแบบเดิม)
+    """
+    # 1. ดึงโพสต์จาก DB (เรียงตาม ID เก่า→ใหม่ หรือใหม่→เก่า)
+    if limit is None and cursor is None:
+        order = PostDB.post_id.desc() if newest_first else PostDB.post_id.asc()
+        posts_db = (await session.exec(select(PostDB).order_by(order))).all()
+    else:
+        posts_db, next_cursor = await session.run_sync(
+            paginate, select(PostDB), [(PostDB.post_id, newest_first)], limit or DEFAULT_PAGE_SIZE, cursor,
+            "posts:newest" if newest_first else "posts",
+        )
+        set_next_cursor(response, next_cursor)
+
+    # 2. ดึงคอมเมนต์ของทุกโพสต์ในหน้านี้ทีเดียว แล้วจัดกลุ่มตาม post_id
+    comments_by_post = defaultdict(list)
+    post_ids = [p.post_id for p in posts_db]
+    if preview_comments is None:
+        all_comments = await session.run_sync(fetch_in, CommentDB, CommentDB.post_id, post_ids)
+    else:
+        all_comments = await session.run_sync(fetch_latest_comments, post_ids, preview_comments)
+    for c in sorted(all_comments, key=lambda c: c.comment_id):
+        comments_by_post[c.post_id].append(c)
+
+    # 3. ดึงข้อมูลคน (เจ้าของโพสต์ + คนคอมเมนต์) ทีเดียว → จำนวน query คงที่ ไม่โตตามจำนวนโพสต์/คอมเมนต์
+    customer_ids = [p.customer_id for p in posts_db] + [c.customer_id for c in all_comments]
+    customers = {c.customer_id: c for c in await session.run_sync(fetch_in, CustomerDB, CustomerDB.customer_id, customer_ids)}
+
+    final_result = []
+
+    for p in posts_db:
+        # หาข้อมูลเจ้าของโพสต์ (name, username, avatar)
+        user = customers.get(p.customer_id)
+
+        # คอมเมนต์ทั้งหมดของโพสต์นี้ เพื่อทำเป็น staticComments
+        static_comments = []
+        for c in comments_by_post[p.post_id]:
+            c_user = customers.get(c.customer_id)
+            static_comments.append({
+                "name": c_user.display_name if c_user else "Unknown",
+                "avatar": c_user.avatar if c_user else "",
+                "text": c.text,
+                "time": c.time_str  # เช่น "2 hrs"
+            })
 
-        return final_result
+        # ประกอบร่างให้เหมือนโครงสร้างใน data.js
+        post_obj = {
+            "id": p.post_id,
+            "name": user.display_name if user else "Unknown",
+            "username": f"@{user.username}" if user else "@unknown",
+            "avatar": user.avatar if user else "",
+            "content": p.content,
+            "image": p.image_url, # เปลี่ยนชื่อจาก image_url เป็น image ตาม data.js
+            "likes": p.likes,
+            "reposts": p.reposts,
+            "shares": p.shares,
+            "staticComments": static_comments,
+            "comments": p.comments_count # จำนวนคอมเมนต์ทั้งหมด (ไม่ใช่แค่ที่แนบมา)
+        }
+        final_result.append(post_obj)
+
+    # สร้างเป็น dict ครบแล้ว ไม่ต้องให้ response_model ตรวจซ้ำ (header ที่ set_next_cursor ใส่ไว้ต้องส่งต่อเอง)
+    return FastJSONResponse(final_result, headers=dict(response.headers))
+
+def fetch_latest_comments(session, post_ids, per_post: int):
+    """คอมเมนต์ล่าสุดไม่เกิน per_post อันต่อโพสต์ ด้วย window function (ไม่ต้องโหลดคอมเมนต์ทั้งหมด)"""
+    if per_post == 0:
+        return []
+    comments = []
+    for start in range(0, len(post_ids), IN_CHUNK_SIZE):
+        ranked = select(
+            CommentDB,
+            func.row_number().over(partition_by=CommentDB.post_id, order_by=CommentDB.comment_id.desc()).label("rn"),
+        ).where(CommentDB.post_id.in_(post_ids[start:start + IN_CHUNK_SIZE])).subquery()
+        latest = aliased(CommentDB, ranked)
+        comments.extend(session.exec(select(latest).where(ranked.c.rn <= per_post)).all())
+    return comments
 
 
 # 2. ดึงรายละเอียดโพสต์รายอัน พร้อมเม้นท์ (สำหรับหน้า Post Detail)
 # ในไฟล์ main.py
 @app.get("/posts/{post_id}")
 async def get_post_detail(post_id: int):
-    with Session(engine) as session:
+    return await post_flight.do(post_id, lambda: load_post_detail(post_id))
+
+async def load_post_detail(post_id: int):
+    async with read_session() as session:  # session ของตัวเอง: ผลนี้แชร์ให้หลาย request (post_flight)
         # 1. ดึงข้อมูลโพสต์ (ใช้ post_id ตามในรูปของคุณ)
         # ในรูปคอลัมน์ชื่อ post_id ดังนั้นเราต้องใช้คำสั่งดึงให้ถูก
         statement = select(PostDB).where(PostDB.post_id == post_id)
-        db_post = session.exec(statement).first()
-       
+        db_post = (await session.exec(statement)).first()
+
         if not db_post:
             raise HTTPException(status_code=404, detail="Post not found")
 
 
         # 2. ไปดึงข้อมูลคนโพสต์จาก CustomerDB โดยใช้ customer_id จากตารางโพสต์
-        author = session.get(CustomerDB, db_post.customer_id)
+        author = await session.get(CustomerDB, db_post.customer_id)
 
 
         # 3. ดึงคอมเมนต์ (เหมือนเดิม)
         comment_stmt = select(CommentDB).where(CommentDB.post_id == post_id)
-        db_comments = session.exec(comment_stmt).all()
+        db_comments = (await session.exec(comment_stmt)).all()
 
 
+        commenters = {c.customer_id: c for c in await session.run_sync(fetch_in, CustomerDB, CustomerDB.customer_id, [c.customer_id for c in db_comments])}
+
         comments_list = []
         for c in db_comments:
-            c_user = session.get(CustomerDB, c.customer_id)
+            c_user = commenters.get(c.customer_id)
             comments_list.append({
                 "name": c_user.display_name if c_user else "Guest",
                 "avatar": c_user.avatar if c_user else "https://placehold.co/100x100",
@@ -825,91 +1153,88 @@ async def get_post_detail(post_id: int):
 
 # 3. สร้างโพสต์ใหม่
 @app.post("/posts/")
-async def create_post(post: Post) -> PostOut:
-    with Session(engine) as session:
-        db_post = PostDB(**post.dict())
-        session.add(db_post)
-        session.commit()
-        session.refresh(db_post)
-        
-        customer = session.get(CustomerDB, db_post.customer_id)
-        return PostOut(
-            **db_post.dict(),
-            customer_name=customer.display_name if customer else "Unknown",
-            customer_username=f"@{customer.username}" if customer else "@unknown",
-            customer_avatar=customer.avatar if customer else "",
-            comments_count=0
-        )
+async def create_post(post: Post, session: AsyncSession = Depends(get_session)) -> PostOut:
+    db_post = PostDB(**post.dict())
+    session.add(db_post)
+    await session.commit()
+
+    customer = await session.get(CustomerDB, db_post.customer_id)
+    return PostOut(
+        **db_post.dict(),
+        customer_name=customer.display_name if customer else "Unknown",
+        customer_username=f"@{customer.username}" if customer else "@unknown",
+        customer_avatar=customer.avatar if customer else ""
+    )
 
 # 4. เพิ่มคอมเมนต์ใหม่
 @app.post("/posts/{post_id}/comments")
-async def add_comment(post_id: int, comment: Comment) -> dict:
-    with Session(engine) as session:
-        # ตรวจสอบว่ามีโพสต์อยู่จริงไหม
-        db_post = session.get(PostDB, post_id)
-        if not db_post:
-            raise HTTPException(status_code=404, detail="Post not found")
+async def add_comment(post_id: int, comment: Comment, session: AsyncSession = Depends(get_session)) -> dict:
+    # ตรวจสอบว่ามีโพสต์อยู่จริงไหม
+    db_post = await session.get(PostDB, post_id)
+    if not db_post:
+        raise HTTPException(status_code=404, detail="Post not found")
+
+    db_comment = CommentDB(
+        text=comment.text,
+        post_id=post_id,
+        customer_id=comment.customer_id,
+        time_str="Just now"
+    )
+    session.add(db_comment)
+    # บวกจำนวนคอมเมนต์ใน DB ตรงๆ (ไม่อ่านมาบวกใน Python) กันนับพลาดตอนคอมเมนต์พร้อมกัน
+    await session.exec(
+        update(PostDB)
+        .where(PostDB.post_id == post_id)
+        .values(comments_count=PostDB.comments_count + 1)
+    )
+    await session.commit()
 
-        db_comment = CommentDB(
-            text=comment.text,
-            post_id=post_id,
-            customer_id=comment.customer_id,
-            time_str="Just now"
-        )
-        session.add(db_comment)
-        session.commit()
-        session.refresh(db_comment)
-
-        customer = session.get(CustomerDB, comment.customer_id)
-        return {
-            "comment_id": db_comment.comment_id,
-            "name": customer.display_name if customer else "You",
-            "avatar": customer.avatar if customer else "",
-            "text": db_comment.text,
-            "time": "Just now"
-        }
+    customer = await session.get(CustomerDB, comment.customer_id)
+    return {
+        "comment_id": db_comment.comment_id,
+        "name": customer.display_name if customer else "You",
+        "avatar": customer.avatar if customer else "",
+        "text": db_comment.text,
+        "time": "Just now"
+    }
 
 
 @app.post("/signin")
-def login(credentials: SigninRequest):
-    
-    with Session(engine) as session:
-        
-        statement = select(CustomerDB).where(
-            CustomerDB.email == credentials.email,
-            CustomerDB.password == credentials.password
-        )
-        
-        user = session.exec(statement).first()
+async def login(credentials: SigninRequest, session: AsyncSession = Depends(get_session)):
+    statement = select(CustomerDB).where(
+        CustomerDB.email == credentials.email,
+        CustomerDB.password == credentials.password
+    )
 
-        if not user:
-            raise HTTPException(
-                status_code=401, 
-                detail="อีเมลหรือรหัสผ่านไม่ถูกต้อง"
-            )
-        # หา seller ที่ผูกกับ email นี้
-        seller = session.exec(
-            select(SellerDB).where(SellerDB.email == credentials.email)
-        ).first()
-
-        # ถ้ายังไม่มี seller → สร้างให้อัตโนมัติเลย
-        if not seller:
-            seller = SellerDB(
-                seller_name=user.display_name or user.username,
-                email=user.email,
-                seller_phone=user.customer_phone or "",
-                store_name=f"{user.display_name or user.username}'s Shop",
-                verification_status="verified"
-            )
-            session.add(seller)
-            session.commit()
-            session.refresh(seller)
+    user = (await session.exec(statement)).first()
 
-        return {
-            "message": "Login successful",
-            "customer_id": user.customer_id,
-            "username": user.username,
-            "display_name": user.display_name, 
-            "avatar": user.avatar,             
-            "seller_id": seller.seller_id if seller else None
-        }
\ No newline at end of file
+    if not user:
+        raise HTTPException(
+            status_code=401, 
+            detail="อีเมลหรือรหัสผ่านไม่ถูกต้อง"
+        )
+    # หา seller ที่ผูกกับ email นี้
+    seller = (await session.exec(
+        select(SellerDB).where(SellerDB.email == credentials.email)
+    )).first()
+
+    # ถ้ายังไม่มี seller → สร้างให้อัตโนมัติเลย
+    if not seller:
+        seller = SellerDB(
+            seller_name=user.display_name or user.username,
+            email=user.email,
+            seller_phone=user.customer_phone or "",
+            store_name=f"{user.display_name or user.username}'s Shop",
+            verification_status="verified"
+        )
+        session.add(seller)
+        await session.commit()
+
+    return {
+        "message": "Login successful",
+        "customer_id": user.customer_id,
+        "username": user.username,
+        "display_name": user.display_name, 
+        "avatar": user.avatar,             
+        "seller_id": seller.seller_id if seller else None
+    }
\ No newline at end of file
@@ -0,0 +1,232 @@
+import bisect
+import os
+import threading
+import time
+
+#ตัวเลขสำหรับ Prometheus (GET /metrics) — เปิดทิ้งไว้บน production ได้ (FIIT_METRICS=0 ปิดการวัด request)
+#เขียนค่าไม่มี lock: แต่ละ thread มีช่อง (shard) ของตัวเอง handler ทั้งหมดอยู่ thread ของ event loop เดียวกัน
+#ส่วน sweeper/idempotency ที่รันใน thread อื่นก็เขียนช่องของมันเอง → ไม่มีใครรอใคร รวมทุกช่องตอน scrape เท่านั้น
+#ค่าที่มีเก็บอยู่แล้วที่อื่น (cache, pool, sweeper) อ่านสดตอน scrape ผ่าน callback ไม่ต้องนับซ้ำ
+
+METRICS_ENABLED = os.environ.get("FIIT_METRICS", "1") != "0"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+#ขอบบนของ bucket (วินาที) ครอบตั้งแต่ cache hit (<1ms) จนถึงรอ write lock นาน (LOCK_TIMEOUT 5s)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+#method แปลกๆ จาก client ไม่ให้กลายเป็น label ใหม่ไม่รู้จบ
+KNOWN_METHODS = {"GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "HEAD"}
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Sharded:
+    """ข้อมูลแยกช่องตาม thread ที่เขียน — ช่องของ thread ไหน thread นั้นเขียนคนเดียว ไม่ต้อง lock"""
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._shards = {}  # thread id → {label values: ค่า}
+
+    def _shard(self) -> dict:
+        ident = threading.get_ident()
+        shard = self._shards.get(ident)
+        if shard is None:
+            shard = self._shards[ident] = {}
+        return shard
+
+    def _snapshot(self):
+        """[(label values, ค่า)] ของทุกช่อง — copy ก่อนอ่าน (thread อื่นยังเขียนต่อได้ระหว่าง scrape)"""
+        for shard in list(self._shards.values()):
+            yield from list(shard.items())
+
+
+class Counter(_Sharded):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def collect(self) -> dict:
+        totals = {}
+        for labels, value in self._snapshot():
+            totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def render(self) -> list[str]:
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in sorted(self.collect().items())]
+
+
+class Gauge(Counter):
+    """ค่าที่ขึ้นลงได้ (เช่น request ที่กำลังทำงาน) — รวมทุกช่องแบบเดียวกับ Counter"""
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Sharded):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        shard = self._shard()
+        cells = shard.get(labels)
+        if cells is None:
+            cells = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]  # bucket ละช่อง + ช่อง +Inf + sum
+        cells[bisect.bisect_left(self.buckets, value)] += 1
+        cells[-1] += value
+
+    def collect(self) -> dict:
+        totals = {}
+        for labels, cells in self._snapshot():
+            total = totals.setdefault(labels, [0] * len(cells))
+            for i, value in enumerate(cells):
+                total[i] += value
+        return totals
+
+    def render(self) -> list[str]:
+        lines = []
+        for labels, cells in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), cells):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(cells[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Callback:
+    """metric ที่อ่านค่าสดจากที่อื่นตอน scrape — fn คืน [(label values, ค่า)]"""
+
+    def __init__(self, name: str, help: str, kind: str, labelnames: tuple, fn):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+
+    def render(self) -> list[str]:
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in self.fn()]
+
+
+class Registry:
+    def __init__(self):
+        self.enabled = METRICS_ENABLED
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: tuple = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: tuple = ()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name: str, help: str, kind: str, labelnames: tuple, fn) -> Callback:
+        return self.register(Callback(name, help, kind, labelnames, fn))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = metric.render()
+            except Exception:  # callback พัง (เช่น pool ถูก dispose) ไม่ให้ทั้ง /metrics พัง
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_DURATION = registry.histogram(
+    "fiit_http_request_duration_seconds", "Request latency by route and status (_count = requests)", ("method", "route", "status")
+)
+REQUESTS_IN_FLIGHT = registry.gauge("fiit_http_requests_in_flight", "Requests currently being handled")
+ORDERS_CREATED = registry.counter("fiit_orders_created_total", "Orders created, by buy_now or checkout", ("source",))
+CHECKOUTS = registry.counter("fiit_checkouts_total", "Completed cart checkouts")
+PAYMENTS = registry.counter("fiit_payments_total", "Recorded payments by method", ("method",))
+RESERVATION_CONFLICTS = registry.counter("fiit_reservation_conflicts_total", "Orders rejected with 409 because a product was already taken")
+
+
+def track_pools(engines: dict):
+    """การใช้ connection pool ของแต่ละ engine {ชื่อ: engine} — pool ที่ไม่มีขนาด (NullPool ฯลฯ) ข้ามไป
+    checked_out ใกล้ size + max_overflow = request กำลังรอ connection (ดู POOL_SETTINGS ใน database.py)
+    """
+    def read(attribute):
+        def samples():
+            for name, engine in engines.items():
+                pool = engine.pool  # อ่านใหม่ทุกครั้ง: dispose() เปลี่ยน pool
+                if hasattr(pool, "checkedout"):
+                    yield (name,), getattr(pool, attribute)()
+        return samples
+
+    registry.callback("fiit_db_pool_size", "Connections kept open by the pool", "gauge", ("engine",), read("size"))
+    registry.callback("fiit_db_pool_checked_out", "Connections currently in use", "gauge", ("engine",), read("checkedout"))
+    registry.callback("fiit_db_pool_overflow", "Connections opened beyond pool_size (negative = not yet opened)", "gauge", ("engine",), read("overflow"))
+
+
+def track_stats(prefix: str, label: str, sources: dict, fields: dict):
+    """ตัวเลขจาก .stats() ของ object ที่นับเองอยู่แล้ว (cache, single-flight, sweeper) {ชื่อ: object}
+    fields = {key ใน stats(): (ชนิด metric, คำอธิบาย)}
+    """
+    for field, (kind, help) in fields.items():
+        name = f"{prefix}_{field}_total" if kind == "counter" else f"{prefix}_{field}"
+        registry.callback(
+            name, help, kind, (label,) if label else (),
+            lambda field=field: (((key,) if label else (), source.stats()[field]) for key, source in sources.items()),
+        )
+
+
+class MetricsMiddleware:
+    """ASGI middleware: เวลา + status ของทุก request ลง REQUEST_DURATION ตาม route template (ไม่ใช่ path จริง)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not registry.enabled:
+            return await self.app(scope, receive, send)
+
+        status = 500
+
+        async def status_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, status_send)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            method = scope["method"] if scope["method"] in KNOWN_METHODS else "other"
+            route = getattr(scope.get("route"), "path", "unmatched")  # 404 ที่ไม่ตรง route ไหน ไม่ให้ path สุ่มๆ กลายเป็น label
+            REQUEST_DURATION.observe(time.perf_counter() - started, method, route, status)
@@ -1,4 +1,5 @@
 from pydantic import BaseModel, Field
+from sqlalchemy import Index
 from sqlmodel import Field, SQLModel
 from typing import List, Optional
 from datetime import datetime
@@ -16,19 +17,34 @@ class Product(BaseModel):
     product_status: str = "available"
     image_url: str | None = None
 
+#tag ของสินค้าแยกเป็นแถว (1 tag ต่อ 1 แถว) ค้นด้วย index แทน tags.ilike
+#primary key (tag, product_id) ใช้เป็น index ของการค้นหาตาม tag ได้เลย
+class ProductTagDB(SQLModel, table=True):
+    __tablename__ = "producttagdb"
+    tag: str = Field(primary_key=True)
+    product_id: int = Field(primary_key=True, index=True)
+
 class ProductOut(Product):
     product_id: int
     image_url: str | None = None
 
+#index ของตาราง (สร้างให้ DB เดิมด้วย ดู MIGRATIONS ใน database.py)
+#search_products กรอง product_status เสมอ → ขึ้นต้นด้วย status แล้วตามด้วย filter/sort
+#ทุก index มี product_id (rowid) ต่อท้ายอยู่แล้ว: status+category เรียง newest/oldest ได้จาก index เลย
 class ProductDB(SQLModel, table=True):
     __tablename__ = "productdb"
+    __table_args__ = (
+        Index("ix_productdb_status", "product_status"),  # newest/oldest ของสินค้าทั้งหมด
+        Index("ix_productdb_status_category", "product_status", "categoryID"),
+        Index("ix_productdb_status_price", "product_status", "price"),  # sort ตามราคา / ช่วงราคา
+    )
     product_id:int | None = Field(default=None, primary_key=True)
     pname: str
     price: float | None = None
     brand: str
     description: str
     categoryID: int
-    seller_id: int
+    seller_id: int = Field(index=True)
     tags: str
     product_status: str = "available"
     image_url: str | None = None
@@ -50,8 +66,12 @@ class Order(BaseModel):
 
 class OrderDB(SQLModel, table=True):
     __tablename__ = "orderdb"
+    __table_args__ = (
+        Index("ix_orderdb_status_created_at", "order_status", "created_at"),  # sweeper หา pending ที่หมดเวลา
+        Index("ix_orderdb_created_at", "created_at"),  # export ตามช่วงวันที่ (ทุกสถานะ)
+    )
     order_id: int | None = Field(default=None, primary_key=True)
-    cus_id: int
+    cus_id: int = Field(index=True)
     total_price: float
     shipping_cost: float = 50
     grand_total: float
@@ -77,8 +97,8 @@ class OrderItem(BaseModel):
 class OrderItemDB(SQLModel, table=True):
     __tablename__ = "orderitemdb"
     orderitem_id: int | None = Field(default=None, primary_key=True)
-    order_id: int
-    product_id: int 
+    order_id: int = Field(index=True)
+    product_id: int = Field(index=True)
     qty: int
     price: float
 
@@ -118,7 +138,7 @@ class PaymentOut(Payment):
 class PaymentDB(SQLModel, table=True):
     __tablename__ = "paymentdb"
     payment_id: int | None = Field(default=None, primary_key=True)
-    order_id: int
+    order_id: int = Field(index=True)
     payment_method: str
     payment_amount: float
     payment_status: str
@@ -141,7 +161,7 @@ class CustomerDB(SQLModel, table=True):
     __tablename__ = "customerdb"
     customer_id: int | None = Field(default=None, primary_key=True)
     username: str
-    email: str
+    email: str = Field(index=True)
     customer_phone: str
     password: str
     display_name: str | None = None
@@ -159,7 +179,7 @@ class Address(BaseModel):
 class AddressDB(SQLModel, table=True):
     __tablename__ = "addressdb"
     address_id: int | None = Field(default=None, primary_key=True)
-    cus_id: int
+    cus_id: int = Field(index=True)
     address_line: str
     district: str
     province: str
@@ -177,7 +197,7 @@ class Shipment(BaseModel):
 class ShipmentDB(SQLModel, table=True):
     __tablename__ = "shipmentdb"
     shipment_id: int | None = Field(default=None, primary_key=True)
-    order_id : int
+    order_id : int = Field(index=True)
     address_id : int
     carrier : str
     tracking_no : int
@@ -198,7 +218,7 @@ class SellerDB(SQLModel, table=True):
     __tablename__ = "sellerdb"
     seller_id : int | None = Field(default=None, primary_key=True)
     seller_name : str
-    email : str
+    email : str = Field(index=True)
     seller_phone : str
     store_name : str
     verification_status : str
@@ -209,7 +229,21 @@ class SortBy(str, Enum):
     PRICE_HIGH = "price_high"
     NEWEST = "newest"
     OLDEST = "oldest"
+    RELEVANCE = "relevance"  # เรียงตามความเกี่ยวข้อง (bm25) ใช้ได้เมื่อมี query
+
+class TagMatch(str, Enum):
+    ANY = "any"  # มี tag ใด tag หนึ่ง
+    ALL = "all"  # ต้องมีครบทุก tag
     
+class TotalMode(str, Enum):
+    EXACT = "exact"              # นับจริงทั้งหมด (ช้าสุดเมื่อผลลัพธ์เยอะ)
+    APPROXIMATE = "approximate"  # นับไม่เกิน cap แล้วบอกว่าเกินหรือไม่
+    NONE = "none"                # ไม่นับเลย (เหมาะกับ infinite scroll)
+
+class ExportFormat(str, Enum):
+    NDJSON = "ndjson"  # JSON 1 แถวต่อบรรทัด
+    CSV = "csv"
+
 class ProductSearchRequest(BaseModel):
     """Schema สำหรับ Search Request"""
     
@@ -220,6 +254,7 @@ class ProductSearchRequest(BaseModel):
     category_id: Optional[int] = None
     brand: Optional[str] = None
     tags: Optional[List[str]] = Field(None, description="เช่น ['streetwear', 'vintage']")
+    tag_match: TagMatch = Field(TagMatch.ANY, description="any = มี tag ใดก็ได้, all = ต้องมีครบทุก tag")
     
     # Price Range (ถ้าอยากมี)
     min_price: Optional[float] = Field(None, ge=0)
@@ -231,13 +266,22 @@ class ProductSearchRequest(BaseModel):
     # Pagination
     page: int = Field(1, ge=1, description="หน้าที่ต้องการ")
     page_size: int = Field(20, ge=1, le=100, description="จำนวนสินค้าต่อหน้า")  
+    cursor: Optional[str] = Field(None, description="next_cursor จากหน้าก่อน (ถ้าส่งมาจะไม่ใช้ page)")
+    total_mode: TotalMode = Field(TotalMode.EXACT, description="exact / approximate / none")
+
+    # Facets (นับจำนวนตาม category / brand / status / ช่วงราคา ไปพร้อมผลค้นหา)
+    facets: bool = Field(False, description="ส่ง true เพื่อขอ facet counts")
+    price_buckets: List[float] = Field([500, 1000, 2000, 5000], max_length=20, description="ขอบของช่วงราคา เช่น [500, 1000] → <500, 500-1000, >=1000 (ไม่เกิน 20 ขอบ = CASE ไม่เกิน 20 เงื่อนไข)")
 
 #Cart
 class CartItemDB(SQLModel, table=True):
     __tablename__ = "cartitemdb"
+    __table_args__ = (
+        Index("ix_cartitemdb_cus_id_product_id", "cus_id", "product_id"),  # ตะกร้าของลูกค้า + เช็คของซ้ำตอนหยิบ
+    )
     cartitem_id: int | None = Field(default=None, primary_key=True)
     cus_id: int        # ไอดีลูกค้าที่หยิบของ
-    product_id: int    # ไอดีสินค้าที่หยิบ
+    product_id: int = Field(index=True)    # ไอดีสินค้าที่หยิบ
     qty: int = 1       # จำนวน (ตั้งค่าเริ่มต้นเป็น 1) 
 
 class CartItemCreate(SQLModel):
@@ -267,7 +311,9 @@ class PostOut(Post):
 
 
 class PostDB(Post, table=True):
+    __table_args__ = (Index("ix_postdb_customer_id", "customer_id"),)
     post_id: Optional[int] = Field(default=None, primary_key=True)
+    comments_count: int = 0  # นับเก็บไว้เลย (add_comment บวกเพิ่ม) feed ไม่ต้องโหลดคอมเมนต์มานับ
 
 # --- Comment Model ---
 class Comment(SQLModel):
@@ -284,10 +330,30 @@ class CommentOut(Comment):
     time: str # ส่งเป็น string ที่ format แล้ว เช่น "10:30"
 
 class CommentDB(Comment, table=True):
+    #คอมเมนต์ของโพสต์เรียงตาม comment_id อยู่ใน index แล้ว (rowid ต่อท้าย) — ใช้กับ window function ใน feed ด้วย
+    __table_args__ = (Index("ix_commentdb_post_id", "post_id"),)
     comment_id: Optional[int] = Field(default=None, primary_key=True)
 
 
 #--- Signin ----
 class SigninRequest(BaseModel):
     email: str
-    password: str
\ No newline at end of file
+    password: str
+#--- Idempotency-Key ----
+#ผลลัพธ์ของ request ที่มี Idempotency-Key เก็บไว้ส่งซ้ำเมื่อ client retry (ดู idempotency.py)
+class IdempotencyKeyDB(SQLModel, table=True):
+    __tablename__ = "idempotencykeydb"
+    key: str = Field(primary_key=True)
+    route: str = Field(primary_key=True)  # เช่น "POST /create-order/" key เดียวกันคนละ endpoint ไม่ชนกัน
+    request_hash: str                     # sha256 ของ body กันเอา key เดิมไปใช้กับ request อื่น
+    status_code: int | None = None        # None = request แรกยังทำงานอยู่
+    content_type: str | None = None
+    response_body: bytes | None = None
+    created_at: datetime = Field(default_factory=datetime.now)
+    expires_at: datetime = Field(index=True)
+#--- Replica heartbeat ----
+#primary เขียนเวลาล่าสุดลงแถวเดียวนี้เป็นระยะ → อ่านแถวเดียวกันจาก replica แล้วรู้ว่า replica ตามหลังกี่วินาที (ดู replicas.py)
+class ReplicaHeartbeatDB(SQLModel, table=True):
+    __tablename__ = "replicaheartbeatdb"
+    id: int = Field(default=1, primary_key=True)
+    beat_at: float  # time.time() ตอน primary เขียน
@@ -0,0 +1,97 @@
+import base64
+import json
+from fastapi import HTTPException, Response
+from sqlalchemy import and_, false, or_
+
+#Keyset (cursor) pagination
+#แทนที่จะ offset ข้ามแถว (ยิ่งหน้าลึกยิ่งช้า) เราจำค่า sort key ของแถวสุดท้าย
+#แล้วหน้าถัดไปเริ่ม "หลัง" ค่านั้นเลย → ทุกหน้าเร็วเท่ากันถ้ามี index ตรงกับ sort
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(scope: str, values: list) -> str:
+    raw = json.dumps({"s": scope, "k": values}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, scope: str) -> list:
+    """ถอด cursor กลับเป็นค่า sort key — cursor ต้องมาจาก endpoint/การเรียงแบบเดียวกัน"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if data["s"] != scope or not isinstance(data["k"], list):
+            raise ValueError
+        return data["k"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_order(sort_keys):
+    """sort_keys = [(column, descending), ...] → order_by clauses
+
+    NULL อยู่ก่อนสุดเมื่อ ASC และท้ายสุดเมื่อ DESC (ค่า default ของ SQLite) ระบุไว้ชัดๆ
+    เพื่อให้ keyset_after คิดตรงกันทุก backend
+    """
+    return [
+        column.desc().nulls_last() if descending else column.asc().nulls_first()
+        for column, descending in sort_keys
+    ]
+
+
+def keyset_after(sort_keys, values):
+    """เงื่อนไข where ของแถวที่อยู่ "หลัง" values ตามลำดับ keyset_order"""
+    (column, descending), *rest = sort_keys
+    value, *rest_values = values
+    tail = keyset_after(rest, rest_values) if rest else None
+
+    if value is None:
+        same = column.is_(None)
+        later = None if descending else column.is_not(None)
+    else:
+        same = column == value
+        later = or_(column < value, column.is_(None)) if descending else column > value
+
+    parts = []
+    if later is not None:
+        parts.append(later)
+    if tail is not None:
+        parts.append(and_(same, tail))
+    return or_(*parts) if parts else false()
+
+
+def paginate(session, statement, sort_keys, limit: int, cursor: str | None, scope: str, offset: int = 0):
+    """ดึง 1 หน้าด้วย keyset แล้วคืน (rows, next_cursor)
+
+    statement ต้อง select entity เดียว (เช่น select(ProductDB)) — sort key ถูกดึงมาเป็นคอลัมน์เสริม
+    จึงใช้คอลัมน์จาก subquery (เช่น score ของ FTS) เป็น sort key ได้ด้วย
+    next_cursor เป็น None เมื่อถึงหน้าสุดท้ายแล้ว
+    """
+    if cursor:
+        values = decode_cursor(cursor, scope)
+        if len(values) != len(sort_keys):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        statement = statement.where(keyset_after(sort_keys, values))
+    elif offset:
+        statement = statement.offset(offset)
+
+    statement = (
+        statement.add_columns(*(column.label(f"_sort_key_{i}") for i, (column, _) in enumerate(sort_keys)))
+        .order_by(*keyset_order(sort_keys))
+        .limit(limit + 1)  # ขอเกิน 1 แถว ไว้รู้ว่ามีหน้าถัดไปไหม
+    )
+    rows = session.execute(statement).all()  # execute (ไม่ใช่ exec) เพื่อให้ได้ Row ที่มี sort key ติดมาด้วย
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(scope, list(rows[-1][1:]))
+    return [row[0] for row in rows], next_cursor
+
+
+def set_next_cursor(response: Response, next_cursor: str | None):
+    #endpoint แบบ list เดิมยังคืน list เหมือนเดิม cursor หน้าถัดไปจึงส่งทาง header
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
@@ -0,0 +1,146 @@
+import cProfile
+import logging
+import os
+import random
+import re
+import time
+from contextvars import ContextVar
+from sqlalchemy import event
+
+#request ไหนช้า ดูได้ว่าเวลาไปอยู่ที่ SQL หรือฝั่ง Python (loop ใน handler, serialize JSON)
+#เปิดด้วย FIIT_PROFILE=1 (ปิดอยู่ = ไม่ใส่ middleware/event เลย ไม่มี overhead)
+#- log 1 บรรทัดต่อ request ที่ logger "fiit.profile": INFO ปกติ, WARNING ถ้าช้ากว่า SLOW_REQUEST_MS
+#- header Server-Timing (sql / app) ดูได้ในแท็บ Network → Timing ของ browser
+#- สุ่ม PROFILE_SAMPLE_RATE ของ request มารัน profiler แล้วเขียนไฟล์ลง PROFILE_DIR
+#  cprofile → .prof (เปิดด้วย python -m pstats หรือ snakeviz) / pyinstrument → .html (ต้อง pip install pyinstrument)
+
+PROFILE_ENABLED = os.environ.get("FIIT_PROFILE", "0") == "1"
+SLOW_REQUEST_MS = float(os.environ.get("FIIT_SLOW_REQUEST_MS", "500"))
+PROFILE_SAMPLE_RATE = float(os.environ.get("FIIT_PROFILE_SAMPLE_RATE", "0"))  # 0–1, 0 = ไม่ dump
+PROFILER = os.environ.get("FIIT_PROFILER", "cprofile")                       # cprofile / pyinstrument
+PROFILE_DIR = os.environ.get("FIIT_PROFILE_DIR", "profiles")
+
+logger = logging.getLogger("fiit.profile")
+
+
+class RequestProfile:
+    __slots__ = ("sql_count", "sql_seconds")
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+
+
+#profile ของ request ที่กำลังทำงานใน task นี้ (run_sync / asyncio.to_thread ส่ง context ต่อให้เอง)
+_current: ContextVar[RequestProfile | None] = ContextVar("request_profile", default=None)
+
+
+def instrument_engines(*engines):
+    """นับจำนวน/เวลา SQL ของ engine เหล่านี้เข้า request ที่กำลังทำงาน (engine แบบ async ส่ง .sync_engine มา)"""
+    for bind in engines:
+        event.listen(bind, "before_cursor_execute", _before_cursor_execute)
+        event.listen(bind, "after_cursor_execute", _after_cursor_execute)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        context._profile_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current.get()
+    started = getattr(context, "_profile_started", None)
+    if profile is not None and started is not None:
+        profile.sql_count += 1
+        profile.sql_seconds += time.perf_counter() - started
+
+
+class ProfilingMiddleware:
+    """ASGI middleware วัดทุก request: route, เวลารวม, จำนวน/เวลา SQL, ขนาด response (ใส่เป็นตัวนอกสุด)"""
+
+    def __init__(self, app, sample_rate: float = PROFILE_SAMPLE_RATE, profiler: str = PROFILER, profile_dir: str = PROFILE_DIR):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.profiler = profiler
+        self.profile_dir = profile_dir
+        self._sampling = False  # profiler ของ Python จับได้ทีละตัว → dump ทีละ request
+        if profiler == "pyinstrument":
+            import pyinstrument  # noqa: F401 — ไม่มีให้พังตอนเปิด app ไม่ใช่ตอนสุ่มโดน
+        elif profiler != "cprofile":
+            raise ValueError(f"unknown FIIT_PROFILER {profiler!r} (cprofile / pyinstrument)")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        profile = RequestProfile()
+        token = _current.set(profile)
+        started = time.perf_counter()
+        status, size = 500, 0
+
+        async def timed_send(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                total = (time.perf_counter() - started) * 1000
+                sql = profile.sql_seconds * 1000
+                timing = f'sql;dur={sql:.1f};desc="{profile.sql_count} queries", app;dur={total - sql:.1f}'
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", timing.encode())]}
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        sampler = self._start_sampler()
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            _current.reset(token)
+            wall_ms = (time.perf_counter() - started) * 1000
+            route = getattr(scope.get("route"), "path", scope["path"])  # path แบบ template เช่น /posts/{post_id}
+            if sampler is not None:
+                self._dump(sampler, scope["method"], route, wall_ms)
+            record = {
+                "method": scope["method"],
+                "route": route,
+                "status": status,
+                "wall_ms": round(wall_ms, 2),
+                "sql_count": profile.sql_count,
+                "sql_ms": round(profile.sql_seconds * 1000, 2),
+                "bytes": size,
+            }
+            logger.log(
+                logging.WARNING if wall_ms >= SLOW_REQUEST_MS else logging.INFO,
+                " ".join(f"{key}={value}" for key, value in record.items()),
+                extra={"profile": record},
+            )
+
+    def _start_sampler(self):
+        if self._sampling or self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        self._sampling = True
+        if self.profiler == "pyinstrument":
+            from pyinstrument import Profiler
+
+            sampler = Profiler(async_mode="enabled")  # นับเฉพาะ task ของ request นี้
+            sampler.start()
+        else:
+            sampler = cProfile.Profile()  # จับทั้ง thread: request อื่นที่วิ่งสลับกันระหว่าง await ติดมาด้วย
+            sampler.enable()
+        return sampler
+
+    def _dump(self, sampler, method: str, route: str, wall_ms: float):
+        try:
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{method}-{re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'}-{wall_ms:.0f}ms"
+            os.makedirs(self.profile_dir, exist_ok=True)
+            if self.profiler == "pyinstrument":
+                sampler.stop()
+                path = os.path.join(self.profile_dir, f"{name}.html")
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(sampler.output_html())
+            else:
+                sampler.disable()
+                path = os.path.join(self.profile_dir, f"{name}.prof")
+                sampler.dump_stats(path)
+            logger.info("profile written to %s", path)
+        finally:
+            self._sampling = False
@@ -0,0 +1,133 @@
+import asyncio
+import itertools
+import os
+import time
+from sqlmodel import select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+from database import SQLITE_PRAGMAS, async_session, make_engine
+from models import ReplicaHeartbeatDB
+
+#GET ที่อ่านอย่างเดียวและไม่ต้องเห็นของที่เพิ่งเขียนทันที (feed, search, ประวัติ order) ส่งไปอ่านที่ read replica ได้
+#ตั้ง FIIT_REPLICA_URLS = url คั่นด้วย , (เช่น Postgres hot standby หรือไฟล์ SQLite ที่ copy มาจาก primary)
+#วัดว่า replica ตามหลังเท่าไรจากแถว heartbeat ที่ primary เขียนทุก HEARTBEAT_INTERVAL (ใช้ได้ทุก backend)
+#replica ที่ข้อมูลเก่ากว่า REPLICA_MAX_LAG วินาที หรือต่อไม่ได้ ไม่ถูกใช้ → อ่านจาก primary แทน
+#งานเขียน และ handler ที่อ่านแล้วเขียนต่อ/ต้องเห็นของที่เพิ่งเขียน (create_order, checkout ฯลฯ) ใช้ get_session (primary) เหมือนเดิม
+
+REPLICA_URLS = [url.strip() for url in os.environ.get("FIIT_REPLICA_URLS", "").split(",") if url.strip()]
+REPLICA_MAX_LAG = float(os.environ.get("FIIT_REPLICA_MAX_LAG", "5"))          # วินาที ยอมให้ข้อมูลที่อ่านเก่าได้เท่านี้
+HEARTBEAT_INTERVAL = float(os.environ.get("FIIT_REPLICA_HEARTBEAT", "1"))    # วินาที ต้องน้อยกว่า REPLICA_MAX_LAG พอสมควร
+
+
+class Replica:
+    def __init__(self, url: str):
+        #query_only: กันเผลอเขียนลงไฟล์ SQLite ที่เป็น replica (ต้องตั้งหลัง journal_mode) / Postgres standby เขียนไม่ได้อยู่แล้ว
+        self.engine = make_engine(url, use_async=True, pragmas={**SQLITE_PRAGMAS, "query_only": 1})
+        self.replayed_until = None  # beat_at ล่าสุดที่เห็นบน replica = replica มีทุกอย่างที่ primary commit ก่อนเวลานี้
+        self.last_error = None
+        self.reads = 0
+
+    def staleness(self, now: float) -> float | None:
+        return None if self.replayed_until is None else now - self.replayed_until
+
+    def is_fresh(self, now: float, max_lag: float) -> bool:
+        staleness = self.staleness(now)
+        return staleness is not None and staleness <= max_lag
+
+    async def check(self):
+        async with AsyncSession(self.engine) as session:
+            self.replayed_until = (await session.exec(select(ReplicaHeartbeatDB.beat_at))).first()
+
+
+class ReplicaRouter:
+    def __init__(self, urls: list[str], max_lag: float = REPLICA_MAX_LAG):
+        self.replicas = [Replica(url) for url in urls]
+        self.max_lag = max_lag
+        self._next = itertools.count()
+        self.primary_reads = 0  # read ที่ไม่มี replica ใช้ได้ เลยไปอ่าน primary
+        self.heartbeat_error = None
+
+    def pick(self) -> Replica | None:
+        """replica ที่ข้อมูลเก่าไม่เกิน max_lag วนกันไป (round-robin) ไม่มีเลย → None = ใช้ primary
+
+        เช็คกับเวลาตอนนี้ทุกครั้ง: ถ้า replica หยุดตาม (heartbeat ไม่ขยับ) จะหลุดออกเองเมื่อเกิน max_lag
+        """
+        now = time.time()
+        healthy = [r for r in self.replicas if r.is_fresh(now, self.max_lag)]
+        if not healthy:
+            self.primary_reads += 1
+            return None
+        replica = healthy[next(self._next) % len(healthy)]
+        replica.reads += 1
+        return replica
+
+    async def beat(self):
+        async with async_session() as session:
+            now = time.time()
+            updated = (await session.exec(
+                update(ReplicaHeartbeatDB).where(ReplicaHeartbeatDB.id == 1).values(beat_at=now)
+            )).rowcount
+            if not updated:
+                session.add(ReplicaHeartbeatDB(id=1, beat_at=now))
+            await session.commit()
+
+    async def refresh(self):
+        """เขียน heartbeat ที่ primary แล้วอ่านกลับจากทุก replica (replica ที่ค้างเกิน max_lag ถือว่าใช้ไม่ได้)"""
+        try:
+            await self.beat()
+            self.heartbeat_error = None
+        except Exception as e:  # primary ล็อกนาน ฯลฯ — replica ก็ยังวัดจาก beat เดิมได้
+            self.heartbeat_error = repr(e)
+        for replica in self.replicas:
+            try:
+                await asyncio.wait_for(replica.check(), timeout=self.max_lag)
+                replica.last_error = None
+            except Exception as e:
+                replica.replayed_until = None
+                replica.last_error = repr(e)
+
+    def stats(self) -> dict:
+        now = time.time()
+        return {
+            "max_lag": self.max_lag,
+            "heartbeat_interval": HEARTBEAT_INTERVAL,
+            "primary_reads": self.primary_reads,
+            "heartbeat_error": self.heartbeat_error,
+            "replicas": [
+                {
+                    "url": replica.engine.url.render_as_string(hide_password=True),
+                    "staleness": None if (s := replica.staleness(now)) is None else round(s, 3),
+                    "healthy": replica.is_fresh(now, self.max_lag),
+                    "reads": replica.reads,
+                    "last_error": replica.last_error,
+                }
+                for replica in self.replicas
+            ],
+        }
+
+    async def dispose(self):
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+
+replica_router = ReplicaRouter(REPLICA_URLS)
+
+
+def read_session() -> AsyncSession:
+    """AsyncSession สำหรับอ่านอย่างเดียว: replica ถ้ามีตัวที่ใช้ได้ ไม่งั้น primary"""
+    replica = replica_router.pick()
+    if replica is None:
+        return async_session()
+    return AsyncSession(replica.engine, expire_on_commit=False)
+
+
+async def get_read_session():
+    """dependency ของ FastAPI แบบ get_session แต่อ่านจาก replica ได้ — ห้ามใช้กับ handler ที่เขียน"""
+    async with read_session() as session:
+        yield session
+
+
+async def run_replica_monitor(interval: float = HEARTBEAT_INTERVAL):
+    """loop ใน background ของ app (เริ่ม/หยุดใน lifespan ของ main.py เมื่อมี FIIT_REPLICA_URLS)"""
+    while True:
+        await replica_router.refresh()
+        await asyncio.sleep(interval)
@@ -0,0 +1,174 @@
+import asyncio
+import gzip
+import json
+import os
+import zlib
+from fastapi.encoders import jsonable_encoder
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+
+#ส่ง list ก้อนใหญ่ (สินค้า/order/payment/ลูกค้า/โพสต์ทั้งหมด) ให้เร็วขึ้น
+#- FastJSONResponse: encode ด้วย orjson จาก dict ของคอลัมน์ตรงๆ ไม่ผ่าน response_model (ไม่ต้องสร้าง/validate pydantic ทีละแถว)
+#  handler ที่ใช้ต้อง select คอลัมน์ให้ตรงกับ model ที่ประกาศไว้เอง (ดู stream_rows ใน database.py)
+#- CompressionMiddleware: gzip / brotli ตาม Accept-Encoding เมื่อ body ใหญ่กว่า COMPRESS_MIN_BYTES (stream ก็บีบทีละก้อน)
+#orjson / brotli เป็นของเสริม (pip install orjson brotli) ไม่มีก็ใช้ json ของ Python / gzip แทน ผลเหมือนเดิมแค่ช้ากว่า
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get("FIIT_COMPRESS_MIN_BYTES", "1024"))  # เล็กกว่านี้บีบแล้วไม่คุ้ม CPU
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5             # 11 (ค่า default ของ brotli) ช้าเกินไปสำหรับ response สด
+OFFLOAD_BYTES = 256 * 1024     # body ใหญ่กว่านี้บีบใน thread (zlib/brotli ปล่อย GIL) ไม่บล็อก event loop
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+
+def _default(value):
+    return jsonable_encoder(value)  # ของที่ orjson/json ไม่รู้จัก (pydantic model, Decimal ฯลฯ)
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default)
+    # เหมือน JSONResponse ของ Starlette
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=_default).encode()
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def choose_encoding(accept_encoding: str) -> str | None:
+    """br ถ้ามี brotli และ client รับ ไม่งั้น gzip ไม่รับทั้งคู่ → None"""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip()] = quality
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", accepted.get("*", 0)) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+async def compress_async(body: bytes, encoding: str) -> bytes:
+    if len(body) >= OFFLOAD_BYTES:
+        return await asyncio.to_thread(compress, body, encoding)
+    return compress(body, encoding)
+
+
+class EncodedJSON:
+    """JSON ที่ encode แล้ว + ตัวที่บีบอัดแล้วของแต่ละ encoding — เก็บใน cache แทน list ของ model
+    cache hit ไม่ต้อง encode และไม่ต้องบีบอัดซ้ำ
+    """
+
+    def __init__(self, content):
+        self.body = dumps(content)
+        self._compressed = {}
+
+    async def response(self, request, headers: dict | None = None) -> Response:
+        encoding = choose_encoding(request.headers.get("accept-encoding", "")) if len(self.body) >= COMPRESS_MIN_BYTES else None
+        if encoding is None:
+            return Response(self.body, media_type="application/json", headers=headers)
+        body = self._compressed.get(encoding)
+        if body is None:
+            body = self._compressed[encoding] = await compress_async(self.body, encoding)
+        return Response(
+            body, media_type="application/json",
+            headers={**(headers or {}), "content-encoding": encoding, "vary": "Accept-Encoding"},
+        )
+
+
+class _StreamCompressor:
+    """บีบ response แบบ stream ทีละก้อน — flush ทุกก้อน ให้ client ได้ข้อมูลไปเรื่อยๆ ไม่ต้องรอจนจบ"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31 = header แบบ gzip
+
+    def compress(self, chunk: bytes, finish: bool) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(chunk) + (self._compressor.finish() if finish else self._compressor.flush())
+        return self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_FINISH if finish else zlib.Z_SYNC_FLUSH)
+
+
+class CompressionMiddleware:
+    """ASGI middleware บีบอัด response ตาม Accept-Encoding
+    ข้าม: response ที่บีบมาแล้ว (เช่น EncodedJSON), ชนิดที่ไม่ใช่ข้อความ, body ทั้งก้อนที่เล็กกว่า minimum_size
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start = None
+        compressor = None
+        passthrough = False
+
+        async def compress_send(message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start = {**message, "headers": list(message.get("headers", []))}  # รอดู body ก้อนแรกก่อนตัดสินใจ
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                return await send(message)
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                headers = MutableHeaders(raw=start["headers"])
+                if (
+                    "content-encoding" in headers
+                    or not headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+                    or (not more_body and len(body) < self.minimum_size)
+                ):
+                    passthrough = True
+                    await send(start)
+                    return await send(message)
+
+                headers["content-encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if not more_body:  # body ครบในก้อนเดียว
+                    body = await compress_async(body, encoding)
+                    headers["content-length"] = str(len(body))
+                    passthrough = True
+                    await send(start)
+                    return await send({"type": "http.response.body", "body": body})
+                if "content-length" in headers:
+                    del headers["content-length"]
+                compressor = _StreamCompressor(encoding)
+                await send(start)
+
+            await send({"type": "http.response.body", "body": compressor.compress(body, finish=not more_body), "more_body": more_body})
+
+        await self.app(scope, receive, compress_send)
@@ -0,0 +1,349 @@
+import re
+import sys
+import unicodedata
+from collections import Counter
+from sqlalchemy import Float, Integer, case, delete, insert, inspect, text
+from sqlmodel import Session, select, func
+from database import BACKEND, engine, init_db, lock_schema
+from models import ProductDB, ProductTagDB, TagMatch
+
+#Full-text index ของสินค้า (SQLite FTS5)
+#rowid ของ product_fts = product_id ของ productdb
+FTS_TABLE = "product_fts"
+FTS_COLUMNS = ("pname", "brand", "description", "tags")
+#น้ำหนัก bm25 ต่อคอลัมน์ (ชื่อสินค้าสำคัญสุด)
+FTS_WEIGHTS = (10.0, 5.0, 1.0, 3.0)
+
+#ข้อความถูกตัดเป็น token ฝั่ง Python ก่อน (ดู tokenize_text) แล้วเก็บคั่นด้วยช่องว่าง
+#FTS จึงใช้ tokenizer "ascii" ที่แค่ตัดตามช่องว่าง และไม่แตะตัวอักษรไทย
+FTS_TOKENIZE = "ascii"
+FTS_DDL = (
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} "
+    f"USING fts5({', '.join(FTS_COLUMNS)}, tokenize='{FTS_TOKENIZE}')"
+)
+
+#Postgres: ตาราง product_fts ธรรมดา (product_id, document tsvector) + GIN index
+#document สร้างจาก token ชุดเดียวกับ FTS5 ใส่ตำแหน่ง/น้ำหนักเอง (ไม่ผ่าน parser ของ Postgres ที่ตัดสระ/วรรณยุกต์ไทยทิ้ง)
+#น้ำหนักของ ts_rank เรียงตาม D, C, B, A = description, tags, brand, pname (สัดส่วนเดียวกับ FTS_WEIGHTS)
+PG_FTS_DDL = (
+    f"CREATE TABLE {FTS_TABLE} (product_id INTEGER PRIMARY KEY, document TSVECTOR NOT NULL)",
+    f"CREATE INDEX ix_{FTS_TABLE}_document ON {FTS_TABLE} USING GIN (document)",
+)
+PG_FTS_CLASSES = {"pname": "A", "brand": "B", "tags": "C", "description": "D"}
+PG_RANK_WEIGHTS = "{0.1, 0.3, 0.5, 1.0}"
+
+_TERM_SPLIT = re.compile(r"[\s,]+")
+#ภาษาไทยเขียนติดกันไม่มีช่องว่าง → ตัดเป็น n-gram / ภาษาอื่นตัดเป็นคำตามปกติ
+_TOKEN_RUN = re.compile(r"([\u0E00-\u0E7F]+)|([^\W_]+)")
+
+
+def _normalize(value: str) -> str:
+    return unicodedata.normalize("NFC", value).casefold()
+
+
+def tokenize_text(value: str | None) -> list[str]:
+    """ตัดข้อความเป็น token สำหรับลง index
+
+    คำอังกฤษ/ตัวเลข → 1 คำ 1 token
+    ข้อความไทย → bigram ที่ซ้อนกัน + ตัวอักษรสุดท้าย เช่น "เสื้อ" → เส สื ื้ ้อ อ
+    ค้นด้วย phrase ของ bigram ที่ติดกันจึงได้ผลเหมือน substring match
+    """
+    if not value:
+        return []
+    tokens = []
+    for thai, word in _TOKEN_RUN.findall(_normalize(value)):
+        if word:
+            tokens.append(word)
+            continue
+        tokens.extend(thai[i:i + 2] for i in range(len(thai) - 1))
+        tokens.append(thai[-1])
+    return tokens
+
+
+def _query_phrases(term: str) -> list[str]:
+    """คำค้น 1 คำ → FTS5 phrase (อาจได้หลาย phrase ถ้ามีทั้งไทยและอังกฤษปนกัน)"""
+    phrases = []
+    for thai, word in _TOKEN_RUN.findall(_normalize(term)):
+        if word:
+            phrases.append(f'"{word}"*')
+        elif len(thai) == 1:
+            phrases.append(f'"{thai}"*')
+        else:
+            bigrams = " ".join(thai[i:i + 2] for i in range(len(thai) - 1))
+            phrases.append(f'"{bigrams}"')
+    return phrases
+
+
+def normalize_tag(tag: str) -> str:
+    return " ".join(_normalize(tag).split())
+
+
+def parse_tags(tags: str | None) -> list[str]:
+    """ "เสื้อเชิ้ต, แบรนด์เนม, ยูนิโคล่" → ["เสื้อเชิ้ต", "แบรนด์เนม", "ยูนิโคล่"] (ตัดซ้ำ/ค่าว่างทิ้ง)"""
+    if not tags:
+        return []
+    return list(dict.fromkeys(t for t in (normalize_tag(part) for part in tags.split(",")) if t))
+
+
+def _is_postgres(session: Session) -> bool:
+    return session.get_bind().dialect.name == "postgresql"
+
+
+def init_search_index(bind=engine) -> bool:
+    """สร้าง FTS table ถ้ายังไม่มี (หรือ tokenizer เปลี่ยน) แล้ว backfill จาก productdb ให้อัตโนมัติ
+    producttagdb ที่ยังว่าง (DB เก่าก่อนมีตาราง tag) ก็ถูก backfill ด้วย
+    ทำใน transaction เดียวแบบ IMMEDIATE: หลาย worker เปิดพร้อมกันจะเรียงคิวกัน ตัวแรก backfill ตัวที่เหลือเห็นว่าเสร็จแล้ว
+
+    คืน True ถ้ามีการสร้าง index ใหม่
+    """
+    with Session(bind) as session:
+        lock_schema(session.connection(execution_options={"sqlite_begin": "IMMEDIATE"}))
+        if _is_postgres(session):
+            expected = PG_FTS_DDL[0]
+            current = expected if inspect(session.connection()).has_table(FTS_TABLE) else None
+        else:
+            expected = FTS_DDL
+            current = session.execute(
+                text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {"name": FTS_TABLE},
+            ).scalar()
+        tags_missing = (
+            session.execute(select(ProductTagDB.product_id).limit(1)).first() is None
+            and session.execute(select(ProductDB.product_id).where(ProductDB.tags != "").limit(1)).first() is not None
+        )
+        if current == expected and not tags_missing:
+            return False
+        if current is not None and current != expected:
+            session.execute(text(f"DROP TABLE {FTS_TABLE}"))
+            current = None
+        if current is None:
+            for ddl in PG_FTS_DDL if _is_postgres(session) else (FTS_DDL,):
+                session.execute(text(ddl))
+
+        _rebuild(session)
+        session.commit()
+    return True
+
+
+def _document(product: ProductDB) -> dict:
+    return {
+        "rowid": product.product_id,
+        "pname": " ".join(tokenize_text(product.pname)),
+        "brand": " ".join(tokenize_text(product.brand)),
+        "description": " ".join(tokenize_text(product.description)),
+        "tags": " ".join(tokenize_text(product.tags)),
+    }
+
+
+def _pg_document(product: ProductDB) -> dict:
+    """tsvector literal เช่น 'เส':1A 'สื':2A ... เว้นตำแหน่ง 1 ช่องระหว่างคอลัมน์ ไม่ให้ phrase คร่อมคอลัมน์"""
+    lexemes, position = [], 0
+    for column in FTS_COLUMNS:
+        for token in tokenize_text(getattr(product, column)):
+            position += 1
+            lexemes.append(f"'{token}':{min(position, 16383)}{PG_FTS_CLASSES[column]}")
+        position += 1
+    return {"rowid": product.product_id, "document": " ".join(lexemes)}
+
+
+_DELETE_SQL = text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :rowid")
+_INSERT_SQL = text(
+    f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(FTS_COLUMNS)}) "
+    f"VALUES (:rowid, {', '.join(':' + c for c in FTS_COLUMNS)})"
+)
+_PG_DELETE_SQL = text(f"DELETE FROM {FTS_TABLE} WHERE product_id = :rowid")
+_PG_INSERT_SQL = text(f"INSERT INTO {FTS_TABLE} (product_id, document) VALUES (:rowid, CAST(:document AS tsvector))")
+
+
+def _fts_sql(session: Session):
+    """(delete, insert, แปลงสินค้าเป็นแถว) ของ FTS ตาม backend"""
+    if _is_postgres(session):
+        return _PG_DELETE_SQL, _PG_INSERT_SQL, _pg_document
+    return _DELETE_SQL, _INSERT_SQL, _document
+
+
+def _tag_rows(product: ProductDB) -> list[dict]:
+    return [{"tag": tag, "product_id": product.product_id} for tag in parse_tags(product.tags)]
+
+
+def index_product(session: Session, product: ProductDB):
+    """อัปเดต index ของสินค้า 1 ชิ้น (FTS + tag) ใน transaction เดียวกับ session
+    ต้อง flush ให้ได้ product_id ก่อน
+    """
+    delete_sql, insert_sql, document = _fts_sql(session)
+    session.execute(delete_sql, {"rowid": product.product_id})
+    session.execute(insert_sql, document(product))
+
+    session.execute(delete(ProductTagDB).where(ProductTagDB.product_id == product.product_id))
+    tag_rows = _tag_rows(product)
+    if tag_rows:
+        session.execute(insert(ProductTagDB), tag_rows)
+
+
+def rebuild_search_index(bind=engine, batch_size: int = 1000) -> int:
+    """ล้าง index (FTS + tag) แล้วสร้างใหม่จาก productdb ทั้งหมด (ใช้ตอน backfill)"""
+    with Session(bind) as session:
+        # จอง write lock ก่อนอ่าน ไม่งั้นตอนเปลี่ยนจากอ่านเป็นเขียนจะชนกับ worker อื่นที่อ่านอยู่
+        lock_schema(session.connection(execution_options={"sqlite_begin": "IMMEDIATE"}))
+        total = _rebuild(session, batch_size)
+        session.commit()
+    return total
+
+
+def _rebuild(session: Session, batch_size: int = 1000) -> int:
+    total = 0
+    _, insert_sql, document = _fts_sql(session)
+    session.execute(text(f"DELETE FROM {FTS_TABLE}"))
+    session.execute(delete(ProductTagDB))
+    statement = select(ProductDB).execution_options(yield_per=batch_size)
+    batch, tag_batch = [], []
+    for product in session.exec(statement):
+        batch.append(document(product))
+        tag_batch.extend(_tag_rows(product))
+        if len(batch) >= batch_size:
+            session.execute(insert_sql, batch)
+            if tag_batch:
+                session.execute(insert(ProductTagDB), tag_batch)
+            total += len(batch)
+            batch, tag_batch = [], []
+    if batch:
+        session.execute(insert_sql, batch)
+        total += len(batch)
+    if tag_batch:
+        session.execute(insert(ProductTagDB), tag_batch)
+    if not _is_postgres(session):
+        session.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')"))
+    return total
+
+
+def build_match_query(raw_query: str) -> str | None:
+    """แปลงคำค้นของผู้ใช้เป็น FTS5 MATCH expression
+
+    ทุกคำต้องเจอ (AND) / คำอังกฤษค้นแบบ prefix / ข้อความไทยค้นเป็น phrase ของ bigram
+    token ไม่มีเครื่องหมาย " อยู่แล้ว (ถูกตัดทิ้งตอน tokenize) จึงครอบ "..." ได้ปลอดภัย
+    """
+    phrases = []
+    for term in _TERM_SPLIT.split(raw_query.strip()):
+        phrases.extend(_query_phrases(term))
+    if not phrases:
+        return None
+    return " ".join(phrases)
+
+
+def build_tsquery(raw_query: str) -> str | None:
+    """คำค้นเดียวกับ build_match_query แต่เป็น tsquery ของ Postgres
+    phrase ของ bigram → 'เส' <-> 'สื' / prefix → 'uniq':* / ทุกคำต้องเจอ → &
+    """
+    phrases = []
+    for term in _TERM_SPLIT.split(raw_query.strip()):
+        for thai, word in _TOKEN_RUN.findall(_normalize(term)):
+            if word or len(thai) == 1:
+                phrases.append(f"'{word or thai}':*")
+            else:
+                phrases.append("(" + " <-> ".join(f"'{thai[i:i + 2]}'" for i in range(len(thai) - 1)) + ")")
+    if not phrases:
+        return None
+    return " & ".join(phrases)
+
+
+def match_subquery(raw_query: str):
+    """subquery (product_id, score) ของสินค้าที่ตรงกับคำค้น — score ยิ่งน้อยยิ่งเกี่ยวข้อง (bm25 / -ts_rank)"""
+    if BACKEND == "postgresql":
+        tsquery = build_tsquery(raw_query)
+        if tsquery is None:
+            return None
+        statement = (
+            text(
+                f"SELECT product_id, -ts_rank('{PG_RANK_WEIGHTS}', document, CAST(:tsquery AS tsquery)) AS score "
+                f"FROM {FTS_TABLE} WHERE document @@ CAST(:tsquery AS tsquery)"
+            )
+            .bindparams(tsquery=tsquery)
+            .columns(product_id=Integer, score=Float)
+        )
+        return statement.subquery("fts")
+
+    match = build_match_query(raw_query)
+    if match is None:
+        return None
+    weights = ", ".join(str(w) for w in FTS_WEIGHTS)
+    statement = (
+        text(
+            f"SELECT rowid AS product_id, bm25({FTS_TABLE}, {weights}) AS score "
+            f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match"
+        )
+        .bindparams(match=match)
+        .columns(product_id=Integer, score=Float)
+    )
+    return statement.subquery("fts")
+
+
+def tag_filter(tags: list[str], mode: TagMatch = TagMatch.ANY):
+    """เงื่อนไข where ของ ProductDB สำหรับกรองตาม tag (lookup ผ่าน index ของ producttagdb)"""
+    wanted = list(dict.fromkeys(t for t in (normalize_tag(tag) for tag in tags) if t))
+    if not wanted:
+        return None
+    matched = select(ProductTagDB.product_id).where(ProductTagDB.tag.in_(wanted))
+    if mode == TagMatch.ALL and len(wanted) > 1:
+        matched = matched.group_by(ProductTagDB.product_id).having(func.count() == len(wanted))
+    return ProductDB.product_id.in_(matched)
+
+
+def compute_facets(session: Session, statement, price_buckets: list[float], status: str | None = "available") -> dict:
+    """นับ facet ทั้งหมดด้วย GROUP BY query เดียว แล้วรวมยอดแต่ละ facet ใน Python
+
+    statement = query ค้นหาที่ใส่ filter แล้ว แต่ยังไม่กรอง product_status
+    facet product_status จึงนับทุกสถานะ ส่วน facet อื่นนับเฉพาะสถานะที่ค้นอยู่ (status)
+    จำนวนแถวที่ได้ = จำนวน combination ของค่า ซึ่งน้อยกว่าจำนวนสินค้ามาก
+    """
+    edges = sorted(set(price_buckets))
+    base = statement.subquery()
+    bucket = case(
+        (base.c.price.is_(None), -1),
+        *((base.c.price < edge, i) for i, edge in enumerate(edges)),
+        else_=len(edges),
+    ).label("bucket")
+    grouped = (
+        select(base.c.categoryID, base.c.brand, base.c.product_status, bucket, func.count())
+        .group_by(base.c.categoryID, base.c.brand, base.c.product_status, bucket)
+    )
+
+    categories, brands, statuses, prices = Counter(), Counter(), Counter(), Counter()
+    for category_id, brand, product_status, price_bucket, count in session.exec(grouped):
+        statuses[product_status] += count
+        if status is not None and product_status != status:
+            continue
+        categories[category_id] += count
+        brands[brand] += count
+        prices[price_bucket] += count
+
+    def ranked(counter: Counter) -> list[dict]:
+        return [{"value": value, "count": count} for value, count in counter.most_common()]
+
+    bounds = [None, *edges, None]
+    price_facet = [
+        {"min": bounds[i], "max": bounds[i + 1], "count": prices[i]}
+        for i in range(len(edges) + 1)
+    ]
+    if prices[-1]:
+        price_facet.append({"min": None, "max": None, "count": prices[-1]})  # สินค้าที่ยังไม่ตั้งราคา
+
+    return {
+        "categoryID": ranked(categories),
+        "brand": ranked(brands),
+        "product_status": ranked(statuses),
+        "price": price_facet,
+    }
+
+
+if __name__ == "__main__":
+    # python search.py rebuild  → backfill index จากสินค้าที่มีอยู่แล้ว
+    if len(sys.argv) > 1 and sys.argv[1] == "rebuild":
+        init_db()  # DB เก่าที่ยังไม่มี producttagdb ฯลฯ
+        # index ยังไม่มี/ตาราง tag ว่าง → init_search_index สร้างและ backfill ให้แล้ว ไม่ต้อง rebuild ซ้ำ
+        if init_search_index():
+            print("✅ Created and backfilled the search index")
+        else:
+            count = rebuild_search_index()
+            print(f"✅ Indexed {count} products")
+    else:
+        print("usage: python search.py rebuild")
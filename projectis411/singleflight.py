@@ -0,0 +1,44 @@
+import asyncio
+import os
+
+#Request coalescing (single-flight)
+#request ที่อ่าน key เดียวกันพร้อมๆ กันใน worker เดียว จะรอผลจาก DB fetch ก้อนเดียวกัน
+#แทนที่จะยิง query ซ้ำกันคนละรอบ (ช่วยตอนสินค้า/โพสต์ไหนคนเข้าพร้อมกันเยอะๆ)
+
+#เปิด/ปิดแยกตาม route: FIIT_COALESCE_ROUTES = route ที่เปิด คั่นด้วย , (ชื่อเดียวกับที่ส่งให้ SingleFlight) / ว่าง = ปิดหมด
+#เช่น FIIT_COALESCE_ROUTES="GET /products/{product_id}" → เปิดแค่หน้าสินค้า
+DEFAULT_COALESCE_ROUTES = "GET /products/{product_id},GET /posts/{post_id}"
+COALESCE_ROUTES = {
+    route.strip() for route in os.environ.get("FIIT_COALESCE_ROUTES", DEFAULT_COALESCE_ROUTES).split(",") if route.strip()
+}
+
+
+class SingleFlight:
+    def __init__(self, route: str):
+        self.route = route
+        self.enabled = route in COALESCE_ROUTES
+        self._inflight = {}  # key → asyncio.Task ที่กำลังดึงข้อมูลอยู่
+        self.calls = 0       # จำนวนครั้งที่เรียกจริง (ไป DB)
+        self.shared = 0      # จำนวน request ที่ได้ผลร่วมกับคนอื่น
+
+    async def do(self, key, fn):
+        """รัน fn() (async function ที่คุย DB) — ถ้ามีคนกำลังดึง key เดียวกันอยู่ก็รอผลนั้นแทน
+        fn ต้องเปิด session ของตัวเอง (ห้ามใช้ session ของ request เพราะ request อื่นรอผลเดียวกันอยู่)
+        """
+        if not self.enabled:
+            self.calls += 1
+            return await fn()
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.shared += 1
+        # shield: request ไหนถูกยกเลิก (client ตัดสาย) ต้องไม่ยกเลิก fetch ที่คนอื่นรออยู่
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "calls": self.calls, "shared": self.shared, "inflight": len(self._inflight)}
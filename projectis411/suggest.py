@@ -0,0 +1,173 @@
+import threading
+from sqlmodel import Session, select, func
+from models import CategoryDB, ProductDB, ProductTagDB
+from search import normalize_tag, parse_tags
+
+#Autocomplete ของช่องค้นหา: prefix trie อยู่ใน memory ของ process
+#แต่ละ node เก็บ top-k ของคำที่ขึ้นต้นด้วย prefix นั้นไว้เลย ตอนค้นจึงแค่เดินตาม prefix
+#ความนิยม (count) = จำนวนสินค้าที่ใช้ชื่อ/brand/tag/category นั้น
+
+TOP_K = 10
+MAX_KEY_LENGTH = 32  # prefix ยาวกว่านี้ไม่ต้องเก็บ node ต่อ ประหยัด memory
+
+
+class _Node:
+    __slots__ = ("children", "entries", "top", "dirty")
+
+    def __init__(self):
+        self.children = {}
+        self.entries = set()  # คำที่ key จบที่ node นี้พอดี
+        self.top = []         # [(count, entry)] เรียงจากนิยมมากไปน้อย
+        self.dirty = False    # top ไม่ถูกต้องแล้ว ต้องคำนวณใหม่จากลูกก่อนใช้
+
+
+def _rank(item):
+    count, (kind, text) = item
+    return (-count, len(text), text)
+
+
+class SuggestIndex:
+    def __init__(self, top_k: int = TOP_K):
+        self.top_k = top_k
+        self.root = _Node()
+        self.counts = {}      # entry → count, entry = (kind, text)
+        self.categories = {}  # category_id → category_name
+        self.lock = threading.Lock()
+
+    # ---------- keys ----------
+    @staticmethod
+    def _keys(text: str) -> list[str]:
+        """key ของคำหนึ่งคำ = ข้อความเต็ม + ทุกตำแหน่งที่ขึ้นต้นคำใหม่ (พิมพ์ "uniqlo" ก็เจอ "เสื้อยืด Uniqlo")"""
+        words = normalize_tag(text).split(" ")
+        return list(dict.fromkeys(" ".join(words[i:])[:MAX_KEY_LENGTH] for i in range(len(words))))
+
+    def _path(self, key: str, create: bool):
+        node = self.root
+        path = [node]
+        for char in key:
+            child = node.children.get(char)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[char] = _Node()
+            node = child
+            path.append(node)
+        return path
+
+    # ---------- update ----------
+    def _change(self, entry, delta: int):
+        old = self.counts.get(entry, 0)
+        new = max(old + delta, 0)
+        if new == old:
+            return
+        if new:
+            self.counts[entry] = new
+        else:
+            self.counts.pop(entry, None)
+
+        for key in self._keys(entry[1]):
+            path = self._path(key, create=new > 0)
+            if path is None:
+                continue
+            if new:
+                path[-1].entries.add(entry)
+            else:
+                path[-1].entries.discard(entry)
+            for node in path:
+                self._update_top(node, entry, new, grew=new > old)
+
+    def _update_top(self, node: _Node, entry, count: int, grew: bool):
+        if node.dirty:
+            return
+        position = next((i for i, (_, e) in enumerate(node.top) if e == entry), None)
+        if not grew:
+            # ลดลง: คำอื่นที่ไม่ได้อยู่ใน top อาจแซงขึ้นมาได้ → ค่อยคำนวณใหม่ตอนมีคนค้น
+            if position is not None:
+                node.dirty = True
+            return
+        if position is not None:
+            node.top[position] = (count, entry)
+        elif len(node.top) < self.top_k or _rank((count, entry)) < _rank(node.top[-1]):
+            node.top.append((count, entry))
+        else:
+            return
+        node.top.sort(key=_rank)
+        del node.top[self.top_k:]
+
+    def _clean(self, node: _Node):
+        if not node.dirty:
+            return
+        best = {entry: self.counts[entry] for entry in node.entries}
+        for child in node.children.values():
+            self._clean(child)
+            for count, entry in child.top:
+                best[entry] = count
+        node.top = sorted(((count, entry) for entry, count in best.items()), key=_rank)[:self.top_k]
+        node.dirty = False
+
+    def product_entries(self, product: ProductDB) -> list:
+        entries = [("product", product.pname), ("brand", product.brand)]
+        entries.extend(("tag", tag) for tag in parse_tags(product.tags))
+        category_name = self.categories.get(product.categoryID)
+        if category_name:
+            entries.append(("category", category_name))
+        return [(kind, text.strip()) for kind, text in entries if text and text.strip()]
+
+    def add_product(self, product: ProductDB):
+        with self.lock:
+            for entry in self.product_entries(product):
+                self._change(entry, +1)
+
+    def replace_product(self, old_entries: list, product: ProductDB):
+        """แก้ไขสินค้าแล้ว: old_entries = product_entries() ที่อ่านไว้ก่อนแก้ / เรียกหลัง commit สำเร็จเท่านั้น
+        (commit พังก็ไม่ได้เรียก index ยังเป็นค่าเดิมครบ ไม่มีสินค้าหายไปจาก autocomplete)
+        """
+        with self.lock:
+            for entry in old_entries:
+                self._change(entry, -1)
+            for entry in self.product_entries(product):
+                self._change(entry, +1)
+
+    # ---------- query ----------
+    def suggest(self, prefix: str, limit: int = TOP_K) -> list[dict]:
+        key = normalize_tag(prefix)[:MAX_KEY_LENGTH]
+        if not key:
+            return []
+        with self.lock:
+            path = self._path(key, create=False)
+            if path is None:
+                return []
+            node = path[-1]
+            self._clean(node)
+            top = list(node.top[:limit])
+        return [{"text": text, "type": kind, "count": count} for count, (kind, text) in top]
+
+    # ---------- initial load ----------
+    def load(self, session: Session):
+        """โหลดครั้งแรกตอนเปิด app ด้วย GROUP BY (ไม่ต้องดึงสินค้าทีละแถว) หลังจากนั้นอัปเดตทีละสินค้า"""
+        self.categories = {c.category_id: c.category_name for c in session.exec(select(CategoryDB))}
+        totals = {}
+
+        def bump(kind, text, count):
+            text = (text or "").strip()
+            if text:
+                totals[(kind, text)] = totals.get((kind, text), 0) + count
+
+        for pname, count in session.exec(select(ProductDB.pname, func.count()).group_by(ProductDB.pname)):
+            bump("product", pname, count)
+        for brand, count in session.exec(select(ProductDB.brand, func.count()).group_by(ProductDB.brand)):
+            bump("brand", brand, count)
+        for tag, count in session.exec(select(ProductTagDB.tag, func.count()).group_by(ProductTagDB.tag)):
+            bump("tag", tag, count)
+        category_counts = select(ProductDB.categoryID, func.count()).group_by(ProductDB.categoryID)
+        for category_id, count in session.exec(category_counts):
+            bump("category", self.categories.get(category_id), count)
+
+        with self.lock:
+            self.root = _Node()
+            self.counts = {}
+            for entry, count in totals.items():
+                self._change(entry, count)
+
+
+suggest_index = SuggestIndex()
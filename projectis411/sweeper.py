@@ -0,0 +1,125 @@
+import asyncio
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlmodel import select, update
+from database import write_session
+from models import OrderDB, OrderItemDB, OrderStatus, ProductDB
+from cache import invalidate_products
+from idempotency import purge_expired_keys
+
+#ยกเลิก order ที่ค้าง pending นานเกิน RESERVATION_TTL แล้วปล่อยสินค้าของ order นั้นกลับเป็น available
+#ไม่งั้นคนกด Buy Now (reserved) / checkout (sold แต่ order ยัง pending) แล้วไม่จ่าย สินค้าจะถูกกันไว้ตลอดไป
+#ทำแบบ set-based (UPDATE ... WHERE IN (subquery)) ทีละก้อน ไม่ต้องดึง order มาทีละแถว
+#รอบเดียวกันลบผล Idempotency-Key ที่หมดอายุด้วย
+
+RESERVATION_TTL = float(os.environ.get("FIIT_RESERVATION_TTL", "1800"))  # วินาที
+SWEEP_INTERVAL = float(os.environ.get("FIIT_SWEEP_INTERVAL", "60"))      # วินาที, 0 = ไม่รัน sweeper
+SWEEP_BATCH_SIZE = 1000  # order ต่อ transaction — ถือ write lock สั้นๆ แล้วปล่อยให้คนอื่นเขียนบ้าง
+
+
+class SweepStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.errors = 0
+        self.orders_cancelled = 0
+        self.products_released = 0
+        self.keys_purged = 0
+        self.last_sweep = None  # ผลของรอบล่าสุด
+        self.last_error = None
+
+    def record(self, sweep: dict):
+        with self._lock:
+            self.runs += 1
+            self.orders_cancelled += sweep["orders_cancelled"]
+            self.products_released += sweep["products_released"]
+            self.keys_purged += sweep["keys_purged"]
+            self.last_sweep = sweep
+
+    def record_error(self, error: Exception):
+        with self._lock:
+            self.errors += 1
+            self.last_error = repr(error)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "ttl": RESERVATION_TTL,
+                "interval": SWEEP_INTERVAL,
+                "runs": self.runs,
+                "errors": self.errors,
+                "orders_cancelled": self.orders_cancelled,
+                "products_released": self.products_released,
+                "keys_purged": self.keys_purged,
+                "last_sweep": self.last_sweep,
+                "last_error": self.last_error,
+            }
+
+
+sweep_stats = SweepStats()
+
+
+def sweep_expired_orders(ttl: float = RESERVATION_TTL, batch_size: int = SWEEP_BATCH_SIZE, now: datetime | None = None) -> dict:
+    """ยกเลิก order pending ที่สร้างก่อน now - ttl ทั้งหมด คืนผลของรอบนี้ (บันทึกลง sweep_stats ด้วย)"""
+    started = time.perf_counter()
+    cutoff = (now or datetime.now()) - timedelta(seconds=ttl)
+    orders_cancelled = products_released = batches = 0
+
+    while True:
+        expired = (
+            select(OrderDB.order_id)
+            .where(OrderDB.order_status == OrderStatus.pending, OrderDB.created_at < cutoff)
+            .order_by(OrderDB.order_id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)  # Postgres: sweeper หลาย host แบ่ง order กันไป ไม่รอกัน (SQLite ไม่มีผล)
+        )
+        # IMMEDIATE: ระหว่างนี้ไม่มีใครจ่ายเงิน/ยกเลิก order ก้อนนี้แทรกได้ ทั้งสอง UPDATE เห็น order ชุดเดียวกัน
+        with write_session() as session:
+            released = session.exec(
+                update(ProductDB)
+                .where(
+                    ProductDB.product_id.in_(select(OrderItemDB.product_id).where(OrderItemDB.order_id.in_(expired))),
+                    # Buy Now จองเป็น reserved / checkout ตั้งเป็น sold ทั้งที่ order ยัง pending — ปล่อยทั้งคู่เหมือน cancel_order
+                    # (order ถูกยกเลิกแล้วจ่ายเงินไม่ได้ ถ้าไม่ปล่อย sold ของชิ้นนั้นจะขายไม่ได้อีกเลย)
+                    ProductDB.product_status.in_(("reserved", "sold")),
+                )
+                .values(product_status="available")
+            ).rowcount
+            cancelled = session.exec(
+                update(OrderDB).where(OrderDB.order_id.in_(expired)).values(order_status=OrderStatus.cancelled)
+            ).rowcount
+            session.commit()
+
+        orders_cancelled += cancelled
+        products_released += released
+        batches += 1
+        if cancelled < batch_size:
+            break
+
+    if products_released:
+        invalidate_products()  # ไม่รู้ id ที่เปลี่ยน (UPDATE แบบ set-based) → ล้าง cache สินค้าทั้งหมด
+
+    keys_purged = purge_expired_keys()
+
+    sweep = {
+        "finished_at": datetime.now().isoformat(timespec="seconds"),
+        "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+        "batches": batches,
+        "orders_cancelled": orders_cancelled,
+        "products_released": products_released,
+        "keys_purged": keys_purged,
+    }
+    sweep_stats.record(sweep)
+    return sweep
+
+
+async def run_sweeper(interval: float = SWEEP_INTERVAL):
+    """loop ใน background ของ app (เริ่ม/หยุดใน lifespan ของ main.py)"""
+    while True:
+        try:
+            await asyncio.to_thread(sweep_expired_orders)
+        except Exception as e:  # DB ล็อกนาน ฯลฯ — รอรอบหน้า ไม่ให้ task ตาย
+            sweep_stats.record_error(e)
+        await asyncio.sleep(interval)
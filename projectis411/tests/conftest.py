@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+#รันจากโฟลเดอร์ projectis411: python -m pytest -q
+#import แบบเดียวกับ main.py (from database import ...) → ใส่โฟลเดอร์ app ไว้ใน sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def app():
+    """(main, statements) จาก benchmark.temp_app() — DB เปล่าใน temp dir (หรือ FIIT_BENCH_DATABASE_URL) ใช้ร่วมกันทั้ง session
+    main.py import ได้ครั้งเดียวต่อ process ทุก test จึงใช้ app ตัวเดียวกัน
+    """
+    from benchmark import temp_app
+
+    with temp_app() as (main, statements):
+        yield main, statements
@@ -0,0 +1,18 @@
+from benchmark import contend
+
+
+def test_one_order_per_product_under_contention(app):
+    """2 process × 4 thread แย่งซื้อสินค้าชิ้นเดียวกัน: ชนะได้คนเดียวต่อชิ้น ที่เหลือ 409 ไม่มี 5xx"""
+    main, _ = app
+    rounds = 10
+    product_ids, outcomes, order_counts = contend(main, processes=2, threads=4, rounds=rounds)
+
+    statuses = [status for _, status, _, _ in outcomes]
+    assert not [status for status in statuses if status >= 500]
+    winners = {}
+    for product_id, status, _, _ in outcomes:
+        if 200 <= status < 300:
+            winners[product_id] = winners.get(product_id, 0) + 1
+    assert winners == {product_id: 1 for product_id in product_ids}
+    assert statuses.count(409) == len(outcomes) - rounds
+    assert order_counts == {product_id: 1 for product_id in product_ids}
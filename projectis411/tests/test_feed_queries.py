@@ -0,0 +1,9 @@
+from benchmark import feed_query_counts
+
+
+def test_feed_query_count_is_constant(app):
+    """GET /posts/ ต้องใช้จำนวน SQL เท่าเดิมไม่ว่าจะมีโพสต์/คอมเมนต์เท่าไร (N+1 กลับมา = test นี้พัง)"""
+    main, statements = app
+    counts = feed_query_counts(main, statements)
+    assert counts[0][0] < counts[-1][0]  # feed ใหญ่ขึ้นจริง
+    assert len({count for _, count in counts}) == 1, counts
@@ -0,0 +1,87 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import httpx
+from fastapi.testclient import TestClient
+from sqlmodel import Session, func, select
+
+from benchmark import generate_products
+
+
+def _new_product(main) -> int:
+    with Session(main.engine) as session:
+        product = main.ProductDB(**{**next(generate_products(1)), "product_status": "available"})
+        session.add(product)
+        session.commit()
+        return product.product_id
+
+
+def _order_count(main, cus_id: int) -> int:
+    with Session(main.engine) as session:
+        return session.exec(select(func.count()).where(main.OrderDB.cus_id == cus_id)).one()
+
+
+def _key_exists(main, key: str) -> bool:
+    from models import IdempotencyKeyDB
+
+    with Session(main.engine) as session:
+        return session.exec(select(IdempotencyKeyDB).where(IdempotencyKeyDB.key == key)).first() is not None
+
+
+def test_concurrent_requests_with_same_key_create_one_order(app):
+    """ยิง key เดียวกันพร้อมกัน 8 ตัว: order เกิดครั้งเดียว ที่เหลือได้ผลเดิม (replay) หรือ 409 ถ้ารอไม่ทัน ไม่มีใครได้ 409 สินค้าถูกจอง"""
+    main, _ = app
+    order = {"cus_id": 9101, "items": [{"product_id": _new_product(main), "qty": 1}]}
+
+    async def send_all():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*(
+                client.post("/create-order/", json=order, headers={"Idempotency-Key": "same-order"}) for _ in range(8)
+            ))
+
+    responses = asyncio.run(send_all())
+    created = [r for r in responses if r.status_code == 200 and "idempotent-replayed" not in r.headers]
+    replayed = [r for r in responses if r.headers.get("idempotent-replayed") == "true"]
+    assert len(created) == 1
+    assert len(created) + len(replayed) + sum(r.status_code == 409 and "in progress" in r.text for r in responses) == 8
+    assert all(r.content == created[0].content for r in replayed)
+    assert _order_count(main, 9101) == 1
+
+
+def test_same_key_with_different_body_is_rejected(app):
+    main, _ = app
+    client = TestClient(main.app)
+    headers = {"Idempotency-Key": "reused-key"}
+    order = {"cus_id": 9102, "items": [{"product_id": _new_product(main), "qty": 1}]}
+    assert client.post("/create-order/", json=order, headers=headers).status_code == 200
+
+    other = {"cus_id": 9102, "items": [{"product_id": _new_product(main), "qty": 1}]}
+    assert client.post("/create-order/", json=other, headers=headers).status_code == 422
+    # key เดียวกันคนละ endpoint ไม่ชนกัน
+    assert client.post("/orders/checkout/9102", headers=headers).status_code == 400  # ตะกร้าว่าง
+    assert _order_count(main, 9102) == 1
+
+
+def test_expired_keys_are_purged_and_reusable(app):
+    """ผลที่เกิน IDEMPOTENCY_TTL: purge_expired_keys ลบทิ้ง และ key เดิมทำงานใหม่ได้ (ไม่ replay ผลเก่า)"""
+    from idempotency import IDEMPOTENCY_TTL, purge_expired_keys
+
+    main, _ = app
+    client = TestClient(main.app)
+    headers = {"Idempotency-Key": "short-lived"}
+    order = {"cus_id": 9103, "items": [{"product_id": _new_product(main), "qty": 1}]}
+    first = client.post("/create-order/", json=order, headers=headers)
+    assert first.status_code == 200
+    replay = client.post("/create-order/", json=order, headers=headers)
+    assert replay.headers.get("idempotent-replayed") == "true" and replay.content == first.content
+
+    purge_expired_keys()
+    assert _key_exists(main, "short-lived")  # ยังไม่หมดอายุ ไม่โดนลบ
+    assert purge_expired_keys(now=datetime.now() + timedelta(seconds=IDEMPOTENCY_TTL + 1)) >= 1
+    assert not _key_exists(main, "short-lived")
+
+    # key เดิมหลังหมดอายุ = request ใหม่: ทำงานจริง สินค้าชิ้นเดิมถูกจองไปแล้ว → 409 จาก endpoint ไม่ใช่ผลเก่า
+    again = client.post("/create-order/", json=order, headers=headers)
+    assert again.status_code == 409 and "idempotent-replayed" not in again.headers
+    assert _order_count(main, 9103) == 1
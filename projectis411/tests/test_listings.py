@@ -0,0 +1,27 @@
+import json
+
+import pytest
+from sqlmodel import Session, select
+
+
+@pytest.mark.parametrize("path, table", [("/orders/", "OrderDB"), ("/payments/", "PaymentDB"), ("/customers/", "CustomerDB")])
+def test_listing_streams_every_row(app, path, table):
+    """GET /orders/ ฯลฯ ส่งเป็น stream (ไม่มี content-length) แต่ได้ JSON array ครบทุกแถวเหมือน list ของ object เดิม"""
+    from fastapi.testclient import TestClient
+
+    main, _ = app
+    table = getattr(main, table)
+    with Session(main.engine) as session:
+        session.add(main.CustomerDB(username="lister", email="lister@fiit.test", customer_phone="0", password="x"))
+        session.add(main.OrderDB(cus_id=1, total_price=100, grand_total=150))
+        session.add(main.PaymentDB(order_id=1, payment_method="cash", payment_amount=150, payment_status="paid",
+                                   payment_date="2024-01-01", transaction_no=1))
+        session.commit()
+        expected = [row.model_dump(mode="json") for row in session.exec(select(table)).all()]
+
+    with TestClient(main.app).stream("GET", path) as response:
+        assert response.status_code == 200
+        assert "content-length" not in response.headers
+        rows = json.loads(response.read())
+    key = table.__table__.primary_key.columns[0].name
+    assert sorted(rows, key=lambda row: row[key]) == sorted(expected, key=lambda row: row[key])
@@ -0,0 +1,153 @@
+import asyncio
+import os
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+#รันเฉพาะเมื่อตั้ง FIIT_BENCH_DATABASE_URL=postgresql://... (DB ทดสอบ ถูกล้างทั้ง schema) — ไม่ตั้ง = skip
+pytestmark = pytest.mark.skipif(
+    not os.environ.get("FIIT_BENCH_DATABASE_URL", "").startswith("postgresql"),
+    reason="FIIT_BENCH_DATABASE_URL is not a Postgres URL",
+)
+
+
+def _product(pname: str, description: str) -> dict:
+    return {"pname": pname, "price": 100, "brand": "fiit", "description": description, "categoryID": 1, "seller_id": 1, "tags": "test"}
+
+
+def test_engines_use_postgres(app):
+    from database import BACKEND
+
+    main, _ = app
+    assert BACKEND == "postgresql"
+    assert main.engine.dialect.name == main.async_engine.dialect.name == "postgresql"
+
+
+def test_search_thai_and_english(app):
+    """สินค้าที่เพิ่งสร้างค้นเจอผ่าน tsvector ทั้งคำไทยและคำอังกฤษ คำที่ไม่มีไม่เจอ"""
+    from fastapi.testclient import TestClient
+
+    main, _ = app
+    client = TestClient(main.app)
+    created = client.post("/products/", json=_product("เสื้อยืดวินเทจ zebracorn", "ผ้าฝ้าย สีครีม")).json()
+
+    def found(query: str) -> list[int]:
+        response = client.post("/products/search", json={"query": query})
+        assert response.status_code == 200
+        return [product["product_id"] for product in response.json()["products"]]
+
+    assert created["product_id"] in found("zebracorn")
+    assert created["product_id"] in found("วินเทจ")
+    assert created["product_id"] in found("ผ้าฝ้าย")
+    assert found("unicornzebra") == []
+
+
+def test_lock_timeout_is_retryable(app):
+    """แถวที่ถูก FOR UPDATE ค้างไว้: อีก connection รอเกิน lock_timeout → error ที่ is_retryable_lock_error รับ (→ 503)"""
+    main, _ = app
+    with main.engine.begin() as conn:
+        product_id = conn.execute(text(
+            "INSERT INTO productdb (pname, brand, description, \"categoryID\", seller_id, tags, product_status)"
+            " VALUES ('locked', 'fiit', 'x', 1, 1, 'test', 'available') RETURNING product_id"
+        )).scalar_one()
+    update = text("UPDATE productdb SET product_status = 'sold' WHERE product_id = :id")
+
+    async def update_async():
+        async with main.async_engine.begin() as conn:
+            await conn.execute(text("SET LOCAL lock_timeout = '100ms'"))
+            await conn.execute(update, {"id": product_id})
+
+    with main.engine.begin() as holder:
+        holder.execute(text("SELECT 1 FROM productdb WHERE product_id = :id FOR UPDATE"), {"id": product_id})
+        with pytest.raises(DBAPIError) as sync_error, main.engine.begin() as conn:  # psycopg2 (sweeper/สคริปต์)
+            conn.execute(text("SET LOCAL lock_timeout = '100ms'"))
+            conn.execute(update, {"id": product_id})
+        with pytest.raises(DBAPIError) as async_error:  # asyncpg (request handler)
+            asyncio.run(update_async())
+    assert main.is_retryable_lock_error(sync_error.value)
+    assert main.is_retryable_lock_error(async_error.value)
+
+
+def test_payment_waits_for_sweeper_cancelling_the_order(app):
+    """sweeper ยกเลิก order (ถือ lock แถวอยู่) ระหว่างที่มีคนจ่ายเงิน: payment ต้องรอแล้วได้ 409 ไม่เขียน paid ทับ cancelled"""
+    import threading
+    import time
+    from fastapi.testclient import TestClient
+
+    main, _ = app
+    client = TestClient(main.app)
+    product_id = client.post("/products/", json=_product("ลุ้นจ่ายทัน", "x")).json()["product_id"]
+    order_id = client.post("/create-order/", json={"cus_id": 9201, "items": [{"product_id": product_id, "qty": 1}]}).json()["order_id"]
+    payment = {"order_id": order_id, "payment_method": "qr_code", "payment_amount": 1, "payment_status": "ok",
+               "payment_date": "2026-01-01", "transaction_no": 1}
+
+    responses = []
+    with main.engine.begin() as sweeper:  # ทำแบบเดียวกับ sweep_expired_orders แต่ค้าง transaction ไว้
+        assert sweeper.execute(text("SELECT order_id FROM orderdb WHERE order_id = :id FOR UPDATE SKIP LOCKED"), {"id": order_id}).all()
+        sweeper.execute(text("UPDATE productdb SET product_status = 'available' WHERE product_id = :id"), {"id": product_id})
+        sweeper.execute(text("UPDATE orderdb SET order_status = 'cancelled' WHERE order_id = :id"), {"id": order_id})
+        paying = threading.Thread(target=lambda: responses.append(client.post("/payments/", json=payment)))
+        paying.start()
+        time.sleep(0.5)
+        assert paying.is_alive()  # รอ lock ของ order อยู่
+    paying.join()
+
+    assert responses[0].status_code == 409
+    assert client.get(f"/orders/{order_id}").json()["order_status"] == "cancelled"
+    assert client.get(f"/products/{product_id}").json()["product_status"] == "available"
+
+
+def test_sweeper_skips_order_being_paid(app):
+    """payment ถือ lock แถว order อยู่ (ยังไม่ commit): sweeper ข้าม order นั้นไป ไม่ยกเลิก ไม่ปล่อยสินค้า"""
+    from datetime import datetime
+    from fastapi.testclient import TestClient
+    from sweeper import sweep_expired_orders
+
+    main, _ = app
+    client = TestClient(main.app)
+    product_id = client.post("/products/", json=_product("จ่ายอยู่", "x")).json()["product_id"]
+    order_id = client.post("/create-order/", json={"cus_id": 9202, "items": [{"product_id": product_id, "qty": 1}]}).json()["order_id"]
+    with main.engine.begin() as conn:
+        conn.execute(text("UPDATE orderdb SET created_at = :at WHERE order_id = :id"), {"at": datetime(1999, 1, 1), "id": order_id})
+
+    with main.engine.begin() as paying:  # lock เดียวกับที่ create_payment ถือ (session.get with_for_update)
+        paying.execute(text("SELECT order_id FROM orderdb WHERE order_id = :id FOR UPDATE"), {"id": order_id})
+        sweep = sweep_expired_orders(ttl=60, now=datetime(1999, 1, 2))
+    assert sweep["orders_cancelled"] == 0
+    assert client.get(f"/orders/{order_id}").json()["order_status"] == "pending"
+    assert client.get(f"/products/{product_id}").json()["product_status"] == "reserved"
+
+    # lock หลุดแล้ว (payment ไม่ได้ commit) → รอบถัดไปยกเลิกได้ตามปกติ
+    assert sweep_expired_orders(ttl=60, now=datetime(1999, 1, 2))["orders_cancelled"] == 1
+    assert client.get(f"/orders/{order_id}").json()["order_status"] == "cancelled"
+
+
+def test_checkout_keeps_items_added_to_the_cart_meanwhile(app):
+    """ของที่ถูกหยิบใส่ตะกร้าหลัง checkout อ่านตะกร้าไปแล้ว (Postgres ไม่มี write lock ทั้ง DB) ต้องยังอยู่ในตะกร้า ไม่ถูกลบทิ้ง"""
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+
+    main, _ = app
+    client = TestClient(main.app)
+    first, late = (client.post("/products/", json=_product(name, "x")).json()["product_id"] for name in ("ของในตะกร้า", "หยิบทีหลัง"))
+    assert client.post("/cart/add", json={"cus_id": 9301, "product_id": first}).status_code == 200
+
+    added = []
+
+    def add_to_cart_meanwhile(conn, cursor, statement, parameters, context, executemany):
+        # checkout อ่านตะกร้าแล้ว กำลังสร้าง order → อีก request หยิบของเพิ่ม (commit ไปก่อน DELETE ของ checkout)
+        if statement.startswith("INSERT INTO orderdb") and not added:
+            added.append(late)
+            with main.engine.begin() as other:
+                other.execute(text("INSERT INTO cartitemdb (cus_id, product_id, qty) VALUES (9301, :id, 1)"), {"id": late})
+
+    event.listen(main.async_engine.sync_engine, "before_cursor_execute", add_to_cart_meanwhile)
+    try:
+        response = client.post("/orders/checkout/9301")
+    finally:
+        event.remove(main.async_engine.sync_engine, "before_cursor_execute", add_to_cart_meanwhile)
+    assert added
+    assert response.status_code == 200
+    assert [item["product_id"] for item in client.get(f"/order_items/{response.json()['order_id']}").json()["items"]] == [first]
+    assert [item["product_id"] for item in client.get("/cart/9301").json()] == [late]
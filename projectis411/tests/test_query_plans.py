@@ -0,0 +1,27 @@
+from benchmark import hot_queries, query_plans
+
+
+def test_hot_queries_use_an_index(app):
+    """query ที่วิ่งบ่อยต้องไม่อ่านทั้งตาราง — index หายไปจาก models.py / migration = test นี้พัง"""
+    main, _ = app
+    plans = query_plans(main)
+    assert set(plans) == set(hot_queries(main))
+    full_scans = {name: scans for name, (_, scans) in plans.items() if scans}
+    assert not full_scans, full_scans
+
+
+def test_query_plans_detect_a_dropped_index(app):
+    """ตัวตรวจเองต้องจับ full scan ได้จริง: ลบ index ของ orderitemdb.order_id ชั่วคราวแล้ว "items of order" ต้องโดนจับ"""
+    main, _ = app
+    index = next(ix for ix in main.OrderItemDB.__table__.indexes if list(ix.columns.keys()) == ["order_id"])
+    with main.engine.begin() as conn:
+        index.drop(conn)
+    # connection ใน pool จำ statement EXPLAIN ที่ prepare ไว้แล้ว (plan เก่า) → ใช้ connection ใหม่
+    main.engine.dispose()
+    try:
+        _, scans = query_plans(main)["items of order"]
+        assert scans
+    finally:
+        with main.engine.begin() as conn:
+            index.create(conn)
+        main.engine.dispose()
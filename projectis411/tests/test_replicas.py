@@ -0,0 +1,15 @@
+import multiprocessing
+import os
+
+import pytest
+
+from benchmark import check_replica_routing
+
+
+@pytest.mark.skipif(bool(os.environ.get("FIIT_BENCH_DATABASE_URL")), reason="the replica is a SQLite file copy")
+def test_reads_follow_replica_freshness():
+    """GET อ่านจาก replica (ไฟล์ SQLite ที่ copy มา) ตอนยังสด กลับไป primary เมื่อเก่าเกิน max_lag / POST เขียน primary เสมอ
+    FIIT_REPLICA_URLS ต้องตั้งก่อน import main.py แต่ main ถูก import ไปแล้วใน fixture app → รันใน process ใหม่
+    """
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        assert pool.apply(check_replica_routing)
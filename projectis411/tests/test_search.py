@@ -0,0 +1,15 @@
+from fastapi.testclient import TestClient
+
+
+def test_price_buckets_are_capped(app):
+    """price_buckets กำหนดขนาด CASE ใน query facet — เกิน 20 ขอบ = 422 ไม่ถึง DB"""
+    main, _ = app
+    client = TestClient(main.app)
+    search = {"facets": True, "price_buckets": [100 * i for i in range(1, 21)]}
+    response = client.post("/products/search", json=search)
+    assert response.status_code == 200
+    edges = [bucket["max"] for bucket in response.json()["facets"]["price"][:21]]
+    assert edges == [*search["price_buckets"], None]
+
+    search["price_buckets"].append(5000)
+    assert client.post("/products/search", json=search).status_code == 422
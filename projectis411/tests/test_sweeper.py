@@ -0,0 +1,61 @@
+from datetime import datetime
+
+from fastapi.testclient import TestClient
+from sqlmodel import Session, select, update
+
+from benchmark import generate_products
+
+PAYMENT = {"payment_method": "qr_code", "payment_amount": 1, "payment_status": "ok", "payment_date": "2026-01-01", "transaction_no": 1}
+
+
+def _statuses(main, column, ids) -> dict:
+    key = column.table.primary_key.columns[0]
+    with Session(main.engine) as session:
+        return dict(session.exec(select(key, column).where(key.in_(ids))).all())
+
+
+def test_sweeper_releases_expired_buy_now_and_checkout(app):
+    """order ที่ค้าง pending เกิน TTL ทั้ง Buy Now (reserved) และ checkout (sold): ถูกยกเลิก สินค้ากลับมาขายได้ จ่ายเงินไม่ได้
+    order ที่จ่ายแล้วไม่โดนแตะ
+    """
+    from sweeper import sweep_expired_orders
+
+    main, _ = app
+    client = TestClient(main.app)
+    with Session(main.engine) as session:
+        products = [main.ProductDB(**{**row, "product_status": "available"}) for row in generate_products(3)]
+        session.add_all(products)
+        session.commit()
+        product_ids = buy_now, in_cart, paid = [p.product_id for p in products]
+
+    def buy(product_id: int) -> int:
+        response = client.post("/create-order/", json={"cus_id": 9001, "items": [{"product_id": product_id, "qty": 1}]})
+        assert response.status_code == 200
+        return response.json()["order_id"]
+
+    def checkout(cus_id: int, product_id: int) -> int:
+        assert client.post("/cart/add", json={"cus_id": cus_id, "product_id": product_id}).status_code == 200
+        response = client.post(f"/orders/checkout/{cus_id}")
+        assert response.status_code == 200
+        return response.json()["order_id"]
+
+    order_ids = buy_now_order, checkout_order, paid_order = buy(buy_now), checkout(9002, in_cart), buy(paid)
+    assert client.post("/payments/", json={**PAYMENT, "order_id": paid_order}).status_code == 200
+    assert _statuses(main, main.ProductDB.product_status, product_ids) == {buy_now: "reserved", in_cart: "sold", paid: "reserved"}
+
+    # ย้อนเวลา order ของ test นี้ไปปี 2000 แล้ว sweep ที่ cutoff ปี 2000 → order อื่นใน DB ของ session ไม่โดน
+    with Session(main.engine) as session:
+        session.exec(update(main.OrderDB).where(main.OrderDB.order_id.in_(order_ids)).values(created_at=datetime(2000, 1, 1)))
+        session.commit()
+    sweep = sweep_expired_orders(ttl=60, now=datetime(2000, 1, 2))
+    assert (sweep["orders_cancelled"], sweep["products_released"]) == (2, 2)
+
+    assert _statuses(main, main.OrderDB.order_status, order_ids) == {
+        buy_now_order: "cancelled", checkout_order: "cancelled", paid_order: "paid",
+    }
+    assert _statuses(main, main.ProductDB.product_status, product_ids) == {buy_now: "available", in_cart: "available", paid: "reserved"}
+    for order_id in (buy_now_order, checkout_order):
+        assert client.post("/payments/", json={**PAYMENT, "order_id": order_id}).status_code == 409
+    # สินค้าที่ถูกปล่อยกลับมาซื้อได้อีกทั้งสองทาง
+    buy(in_cart)
+    checkout(9003, buy_now)